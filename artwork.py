@@ -0,0 +1,364 @@
+import asyncio
+import base64
+import binascii
+import glob
+import hashlib
+import io
+import logging
+import os
+import re
+import tempfile
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, Optional, Tuple
+
+from starlette.staticfiles import StaticFiles
+
+from http_client import http_client
+from metrics import static_bytes_written
+from utils import guess_file_ext_from_base64, guess_file_ext_from_bytes
+
+logger = logging.getLogger(__name__)
+
+ARTWORK_DIR = "artwork"
+VARIANTS_DIR = "variants"
+IMAGE_EXTENSIONS = ("png", "jpg", "gif", "webp")
+# multiple of 4 so every chunk decodes on its own
+BASE64_CHUNK_SIZE = 256 * 1024
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+_variant_name = re.compile(r"^variants/([0-9a-f]{64})-(\d+)\.(webp|jpg)$")
+_image_workers: Optional[ProcessPoolExecutor] = None
+
+CREATE_TABLE_QUERY = """
+    CREATE TABLE IF NOT EXISTS artwork (
+        url_hash text PRIMARY KEY,
+        source_url text NOT NULL,
+        content_hash text NOT NULL,
+        ext text NOT NULL,
+        etag text,
+        last_modified text,
+        size bigint NOT NULL,
+        fetched_at timestamptz NOT NULL DEFAULT now()
+    );
+"""
+
+
+def url_digest(url: str) -> str:
+    return hashlib.sha256(url.encode()).hexdigest()
+
+
+def write_atomic(path: str, data: bytes):
+    """
+    Write `data` to a temp file next to `path` and rename it into place,
+    so readers never see a partially written file.
+    """
+    directory = os.path.dirname(path)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+def ingest_base64(image_str: str, directory: str, max_bytes: int) -> Tuple[Optional[str], int]:
+    """
+    Decode a base64 image chunk by chunk into a temp file while hashing it, and
+    store it as <sha256>.<ext> in `directory`. Identical images map to the same file.
+    Returns the filename, or None if the payload is too large, invalid or not an image,
+    and the number of bytes newly stored. Blocking, run it in a worker thread.
+    """
+    if image_str.startswith("data:"):
+        image_str = image_str.partition(",")[2]
+    # line breaks would shift the chunk boundaries
+    image_str = image_str.replace("\n", "").replace("\r", "")
+    if len(image_str) // 4 * 3 > max_bytes + 3:
+        logger.error("cover art payload is over the size limit")
+        return None, 0
+
+    expected_ext = guess_file_ext_from_base64(image_str)
+    digest = hashlib.sha256()
+    size = 0
+    ext = None
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            for start in range(0, len(image_str), BASE64_CHUNK_SIZE):
+                chunk = base64.b64decode(image_str[start:start + BASE64_CHUNK_SIZE], validate=True)
+                if ext is None:
+                    ext = guess_file_ext_from_bytes(chunk)
+                    if ext != expected_ext or ext not in IMAGE_EXTENSIONS:
+                        logger.error(f"cover art looks like {expected_ext} but decodes to {ext}")
+                        return None, 0
+                size += len(chunk)
+                if size > max_bytes:
+                    logger.error("cover art payload is over the size limit")
+                    return None, 0
+                digest.update(chunk)
+                f.write(chunk)
+
+        if ext is None:
+            return None, 0
+        filename = f"{digest.hexdigest()}.{ext}"
+        path = os.path.join(directory, filename)
+        if os.path.exists(path):
+            return filename, 0
+        os.replace(tmp_path, path)
+        return filename, size
+    except (binascii.Error, ValueError) as e:
+        logger.error(f"invalid base64 cover art: {e}")
+        return None, 0
+    finally:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+
+
+class ArtworkStore:
+    """
+    Content addressed store for remote artwork.
+    Images are saved once as <sha256 of content>.<ext> under STATIC_DIR/artwork and
+    indexed by the hash of their source URL in the `artwork` table. Stored URLs are
+    revalidated with conditional GETs after `revalidate_after` seconds. The
+    `max_known` most recently used URLs are also kept in memory.
+    """
+
+    def __init__(self, pool, static_dir: str, revalidate_after: int = 86400, max_known: int = 10000):
+        self._pool = pool
+        self.directory = os.path.join(static_dir, ARTWORK_DIR)
+        self.revalidate_after = revalidate_after
+        # url_hash -> (filename, checked_at), saves a DB round trip for recently used URLs
+        self._known: OrderedDict = OrderedDict()
+        self._max_known = max_known
+        self.downloads = 0
+        self.revalidations = 0
+        self.bytes_written = 0
+
+    async def init(self):
+        os.makedirs(self.directory, exist_ok=True)
+        async with self._pool.acquire() as con:
+            await con.execute(CREATE_TABLE_QUERY)
+
+    def _remember(self, url_hash: str, filename: str, checked_at: float):
+        self._known[url_hash] = (filename, checked_at)
+        self._known.move_to_end(url_hash)
+        while len(self._known) > self._max_known:
+            self._known.popitem(last=False)
+
+    def public_path(self, filename: str) -> str:
+        return f"/static/{ARTWORK_DIR}/{filename}"
+
+    def file_path(self, filename: str) -> str:
+        return os.path.join(self.directory, filename)
+
+    async def get(self, url: str) -> Optional[str]:
+        """
+        Return the immutable /static path for the artwork at `url`, downloading it if needed.
+        """
+        if not url:
+            return None
+        try:
+            return await self._get(url)
+        except Exception as e:
+            logger.error(f"artwork lookup failed due to {e}", exc_info=True)
+            return None
+
+    async def _get(self, url: str) -> Optional[str]:
+        url_hash = url_digest(url)
+
+        known = self._known.get(url_hash)
+        if known is not None and time.monotonic() - known[1] < self.revalidate_after:
+            self._known.move_to_end(url_hash)
+            return self.public_path(known[0])
+
+        query = """
+            SELECT content_hash, ext, etag, last_modified,
+            extract(epoch from now() - fetched_at) AS age
+            FROM artwork WHERE url_hash = $1;
+        """
+        async with self._pool.acquire() as con:
+            row = await con.fetchrow(query, url_hash)
+
+        filename = None
+        headers = {}
+        if row is not None:
+            filename = f"{row['content_hash']}.{row['ext']}"
+            if os.path.exists(self.file_path(filename)):
+                if row["age"] < self.revalidate_after:
+                    self._remember(url_hash, filename, time.monotonic() - float(row["age"]))
+                    return self.public_path(filename)
+                if row["etag"]:
+                    headers["If-None-Match"] = row["etag"]
+                if row["last_modified"]:
+                    headers["If-Modified-Since"] = row["last_modified"]
+            else:
+                filename = None
+
+        fetched = await self._fetch(url, url_hash, headers)
+        if fetched is not None:
+            filename = fetched
+        if filename is None:
+            return None
+
+        self._remember(url_hash, filename, time.monotonic())
+        return self.public_path(filename)
+
+    async def _fetch(self, url: str, url_hash: str, headers: dict) -> Optional[str]:
+        try:
+            response = await http_client.request("GET", url, headers=headers, follow_redirects=True)
+        except Exception as e:
+            logger.error(f"artwork download failed due to {e}", exc_info=True)
+            return None
+
+        if response.status_code == 304:
+            self.revalidations += 1
+            async with self._pool.acquire() as con:
+                await con.execute("UPDATE artwork SET fetched_at = now() WHERE url_hash = $1;", url_hash)
+            return None
+
+        if response.status_code != 200:
+            logger.error(f"artwork download failed with status {response.status_code}")
+            return None
+
+        content = response.content
+        ext = guess_file_ext_from_bytes(content)
+        if ext in ("unknown", "pdf"):
+            logger.error(f"artwork at {url} is not an image")
+            return None
+
+        content_hash = hashlib.sha256(content).hexdigest()
+        filename = f"{content_hash}.{ext}"
+        path = self.file_path(filename)
+        if not os.path.exists(path):
+            await asyncio.to_thread(write_atomic, path, content)
+            self.bytes_written += len(content)
+            static_bytes_written.inc("artwork", amount=len(content))
+        self.downloads += 1
+
+        query = """
+            INSERT INTO artwork (url_hash, source_url, content_hash, ext, etag, last_modified, size)
+            VALUES ($1, $2, $3, $4, $5, $6, $7)
+            ON CONFLICT (url_hash)
+            DO UPDATE SET content_hash = $3, ext = $4, etag = $5, last_modified = $6, size = $7, fetched_at = now();
+        """
+        async with self._pool.acquire() as con:
+            await con.execute(
+                query,
+                url_hash,
+                url,
+                content_hash,
+                ext,
+                response.headers.get("etag"),
+                response.headers.get("last-modified"),
+                len(content),
+            )
+        return filename
+
+    def stats(self) -> dict:
+        return {
+            "known": len(self._known),
+            "downloads": self.downloads,
+            "revalidations": self.revalidations,
+            "bytes_written": self.bytes_written,
+        }
+
+
+def start_image_workers(workers: int):
+    global _image_workers
+    if _image_workers is None:
+        _image_workers = ProcessPoolExecutor(max_workers=workers)
+
+
+def stop_image_workers():
+    global _image_workers
+    if _image_workers is not None:
+        _image_workers.shutdown(wait=True, cancel_futures=True)
+        _image_workers = None
+
+
+def variant_path(artwork_path: str, size: int, fmt: str) -> str:
+    """
+    Public path of a resized variant for an artwork path returned by ArtworkStore.get.
+    """
+    content_hash = os.path.splitext(os.path.basename(artwork_path))[0]
+    return f"/static/{ARTWORK_DIR}/{VARIANTS_DIR}/{content_hash}-{size}.{fmt}"
+
+
+def variant_paths(artwork_path: str, sizes: Iterable[int], fmt: str) -> dict:
+    return {str(size): variant_path(artwork_path, size, fmt) for size in sizes}
+
+
+def render_variant(source: str, destination: str, size: int, fmt: str) -> int:
+    """
+    Resize `source` to fit in a `size` x `size` box and save it as `fmt`. Runs in the image worker processes.
+    Returns the size of the rendered file.
+    """
+    from PIL import Image
+
+    with Image.open(source) as image:
+        image = image.convert("RGBA" if fmt == "webp" else "RGB")
+        image.thumbnail((size, size), Image.LANCZOS)
+        buffer = io.BytesIO()
+        if fmt == "webp":
+            image.save(buffer, "WEBP", quality=85, method=4)
+        else:
+            image.save(buffer, "JPEG", quality=85, optimize=True, progressive=True)
+    write_atomic(destination, buffer.getvalue())
+    return buffer.tell()
+
+
+def _count_variant_bytes(future: asyncio.Future):
+    if not future.cancelled() and future.exception() is None:
+        static_bytes_written.inc("variant", amount=future.result())
+
+
+class ArtworkFiles(StaticFiles):
+    """
+    Static files for the artwork directory. Everything in it is content addressed,
+    so responses are marked immutable. Variants under variants/ are rendered on
+    first request in the image worker processes and then served from disk.
+    """
+
+    def __init__(self, *args, sizes: Iterable[int] = (64, 300, 600), **kwargs):
+        super().__init__(*args, **kwargs)
+        self.sizes = set(sizes)
+        self._rendering: Dict[str, asyncio.Future] = {}
+        self.rendered = 0
+
+    async def get_response(self, path: str, scope):
+        match = _variant_name.match(path)
+        if match:
+            await self._ensure_variant(path, *match.groups())
+
+        response = await super().get_response(path, scope)
+        if response.status_code in (200, 304):
+            response.headers["Cache-Control"] = IMMUTABLE_CACHE_CONTROL
+        return response
+
+    async def _ensure_variant(self, path: str, content_hash: str, size: str, fmt: str):
+        destination = os.path.join(self.directory, path)
+        if int(size) not in self.sizes or os.path.exists(destination):
+            return
+
+        pending = self._rendering.get(path)
+        if pending is None:
+            sources = glob.glob(os.path.join(self.directory, f"{content_hash}.*"))
+            if not sources or _image_workers is None:
+                return
+            os.makedirs(os.path.dirname(destination), exist_ok=True)
+            pending = asyncio.get_running_loop().run_in_executor(
+                _image_workers, render_variant, sources[0], destination, int(size), fmt
+            )
+            self._rendering[path] = pending
+            pending.add_done_callback(lambda _: self._rendering.pop(path, None))
+            pending.add_done_callback(_count_variant_bytes)
+            self.rendered += 1
+
+        try:
+            await asyncio.shield(pending)
+        except Exception as e:
+            logger.error(f"failed to render artwork variant {path} due to {e}", exc_info=True)
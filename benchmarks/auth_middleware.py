@@ -0,0 +1,111 @@
+"""
+Microbenchmark of the auth middleware against the BaseHTTPMiddleware version it replaced.
+
+Drives each middleware directly with ASGI messages around a trivial endpoint,
+so the numbers are per request middleware overhead.
+
+    python -m benchmarks.auth_middleware --requests 20000
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from fastapi import HTTPException
+from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.requests import Request
+from starlette.responses import PlainTextResponse
+
+from config import AuthMiddleware
+
+TOKEN = "benchmark-token"
+
+
+class LegacyAuthMiddleware(BaseHTTPMiddleware):
+    async def dispatch(self, request: Request, call_next):
+        path = request.url.path
+        if request.method == "OPTIONS" or path.startswith("/static"):
+            return await call_next(request)
+
+        token = request.headers.get("Authorization")
+        if not token:
+            raise HTTPException(status_code=401, detail="Missing Authorization header")
+
+        if token != f"Bearer {TOKEN}":
+            raise HTTPException(status_code=401, detail="Invalid or missing token")
+
+        return await call_next(request)
+
+
+async def endpoint(scope, receive, send):
+    await PlainTextResponse("ok")(scope, receive, send)
+
+
+def make_scope(token: str) -> dict:
+    return {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": "/current-playing",
+        "raw_path": b"/current-playing",
+        "query_string": b"",
+        "root_path": "",
+        "headers": [
+            (b"host", b"localhost"),
+            (b"authorization", f"Bearer {token}".encode()),
+        ],
+        "client": ("127.0.0.1", 50000),
+        "server": ("127.0.0.1", 8004),
+    }
+
+
+async def run(app, requests: int, token: str) -> dict:
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    status = []
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            status.append(message["status"])
+
+    # warm up
+    for _ in range(200):
+        await app(make_scope(token), receive, send)
+
+    status.clear()
+    started = time.perf_counter()
+    for _ in range(requests):
+        await app(make_scope(token), receive, send)
+    elapsed = time.perf_counter() - started
+    return {
+        "requests": requests,
+        "us_per_request": round(elapsed / requests * 1e6, 2),
+        "requests_per_sec": round(requests / elapsed),
+        "status": sorted(set(status)),
+    }
+
+
+async def main(requests: int):
+    results = {
+        "legacy": await run(LegacyAuthMiddleware(endpoint), requests, TOKEN),
+        "asgi": await run(AuthMiddleware(endpoint, tokens={TOKEN: frozenset({"*"})}), requests, TOKEN),
+        "asgi_10_tokens": await run(
+            AuthMiddleware(
+                endpoint,
+                tokens={**{f"rotated-{n}": frozenset({"read"}) for n in range(9)}, TOKEN: frozenset({"*"})},
+            ),
+            requests,
+            TOKEN,
+        ),
+    }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=20000)
+    args = parser.parse_args()
+    asyncio.run(main(args.requests))
@@ -0,0 +1,74 @@
+"""
+Local SMTP stand-in for the email outbox, built on aiosmtpd.
+
+Accepts every message without TLS or auth, optionally refusing a share of
+them with a temporary (451) or permanent (550) error, and prints counters
+every few seconds:
+
+    python -m benchmarks.fake_smtp --port 8025 --temp-fail-rate 0.1 --perm-fail-rate 0.01
+
+Point the service at it with EMAIL_SERVER=127.0.0.1, EMAIL_PORT=8025,
+EMAIL_STARTTLS=false and no EMAIL_USER/EMAIL_PASS. aiosmtpd comes with
+requirements-dev.txt.
+"""
+import argparse
+import asyncio
+import json
+import random
+
+from aiosmtpd.controller import Controller
+
+
+class Handler:
+    def __init__(self, temp_fail_rate: float, perm_fail_rate: float):
+        self.temp_fail_rate = temp_fail_rate
+        self.perm_fail_rate = perm_fail_rate
+        self.sessions = set()
+        self.counts = {"accepted": 0, "temp_failed": 0, "perm_failed": 0}
+
+    async def handle_DATA(self, server, session, envelope):
+        self.sessions.add(id(session))
+        roll = random.random()
+        if roll < self.perm_fail_rate:
+            self.counts["perm_failed"] += 1
+            return "550 mailbox unavailable"
+        if roll < self.perm_fail_rate + self.temp_fail_rate:
+            self.counts["temp_failed"] += 1
+            return "451 try again later"
+        self.counts["accepted"] += 1
+        return "250 OK"
+
+    def stats(self) -> dict:
+        return {**self.counts, "sessions": len(self.sessions)}
+
+
+async def report(handler: Handler, interval: float):
+    while True:
+        await asyncio.sleep(interval)
+        print(json.dumps(handler.stats()), flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8025)
+    parser.add_argument("--temp-fail-rate", type=float, default=0)
+    parser.add_argument("--perm-fail-rate", type=float, default=0)
+    parser.add_argument("--report-interval", type=float, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    handler = Handler(args.temp_fail_rate, args.perm_fail_rate)
+    controller = Controller(handler, hostname=args.host, port=args.port)
+    controller.start()
+    try:
+        asyncio.run(report(handler, args.report_interval))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        controller.stop()
+
+
+if __name__ == "__main__":
+    main()
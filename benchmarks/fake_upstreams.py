@@ -0,0 +1,208 @@
+"""
+Local stand-ins for Last.fm, MusicBrainz, Cover Art Archive and OpenWeather.
+
+Every upstream answers with a small canned payload after a configurable
+latency, and fails with a 503 at a configurable rate:
+
+    python -m benchmarks.fake_upstreams --port 9100 --latency-ms 80 --jitter-ms 20 --error-rate 0.01
+    python -m benchmarks.fake_upstreams --port 9100 --latency-ms lastfm=150,musicbrainz=300
+
+Point the service at it with THE_LAST_FM_BASE_URL, MUSICBRAINZ_BASE_URL,
+COVERT_ART_ARCHIVE_BASE_URL, OPENWEATHER_API_URL and OPENWEATHER_URL all set
+to http://127.0.0.1:<port>.
+"""
+import argparse
+import asyncio
+import base64
+import hashlib
+import random
+from typing import Dict
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, RedirectResponse, Response
+from starlette.routing import Route
+
+UPSTREAMS = ("lastfm", "musicbrainz", "coverart", "openweather", "images")
+
+# 1x1 transparent PNG
+PIXEL_PNG = base64.b64decode(
+    "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNkYPhfDwAChwGA60e6kgAAAABJRU5ErkJggg=="
+)
+
+
+def parse_per_upstream(value: str, cast) -> Dict[str, float]:
+    """
+    "80" applies to every upstream, "lastfm=150,musicbrainz=300" sets them one by one.
+    """
+    if "=" not in value:
+        return {name: cast(value) for name in UPSTREAMS}
+    result = {name: cast(0) for name in UPSTREAMS}
+    for entry in value.split(","):
+        name, _, number = entry.partition("=")
+        result[name.strip()] = cast(number)
+    return result
+
+
+def mbid(*parts: str) -> str:
+    digest = hashlib.md5("-".join(parts).encode()).hexdigest()
+    return f"{digest[:8]}-{digest[8:12]}-{digest[12:16]}-{digest[16:20]}-{digest[20:32]}"
+
+
+class FakeUpstreams:
+    def __init__(self, latency_ms: Dict[str, float], jitter_ms: float, error_rate: Dict[str, float]):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.calls = {name: 0 for name in UPSTREAMS}
+
+    async def delay(self, upstream: str) -> bool:
+        """
+        Sleep for the configured latency and return False if this call should fail.
+        """
+        self.calls[upstream] += 1
+        latency = self.latency_ms[upstream] + random.uniform(-self.jitter_ms, self.jitter_ms)
+        if latency > 0:
+            await asyncio.sleep(latency / 1000)
+        return random.random() >= self.error_rate[upstream]
+
+    def image_url(self, request: Request, name: str) -> str:
+        return str(request.base_url) + f"img/{name}.png"
+
+    async def lastfm(self, request: Request):
+        if not await self.delay("lastfm"):
+            return JSONResponse({"error": 16, "message": "unavailable"}, status_code=503)
+        title = request.query_params.get("track", "")
+        artist = request.query_params.get("artist", "")
+        album = f"{artist} greatest hits"
+        release_id = mbid(artist, album)
+        return JSONResponse(
+            {
+                "track": {
+                    "name": title,
+                    "mbid": mbid(artist, title),
+                    "duration": "215000",
+                    "artist": {"name": artist, "mbid": mbid(artist)},
+                    "album": {
+                        "artist": artist,
+                        "title": album,
+                        "mbid": release_id,
+                        "image": [
+                            {"size": "small", "#text": self.image_url(request, f"{release_id}-34")},
+                            {"size": "extralarge", "#text": self.image_url(request, f"{release_id}-300")},
+                        ],
+                    },
+                }
+            }
+        )
+
+    async def musicbrainz(self, request: Request):
+        if not await self.delay("musicbrainz"):
+            return JSONResponse({"error": "unavailable"}, status_code=503)
+        query = request.query_params.get("query", "")
+        return JSONResponse(
+            {
+                "recordings": [
+                    {
+                        "id": mbid(query),
+                        "score": 100,
+                        "title": query,
+                        "artist-credit": [{"name": "artist", "artist": {"id": mbid("artist", query)}}],
+                        "releases": [{"id": mbid("release", query), "title": "release", "status": "Official"}],
+                    }
+                ]
+            }
+        )
+
+    async def coverart_redirect(self, request: Request):
+        # like the real archive, which redirects /release/{mbid} to archive.org
+        return RedirectResponse(f"/_archive/release/{request.path_params['release_id']}/index.json", status_code=307)
+
+    async def coverart(self, request: Request):
+        if not await self.delay("coverart"):
+            return JSONResponse({"error": "unavailable"}, status_code=503)
+        release_id = request.path_params["release_id"]
+        return JSONResponse(
+            {
+                "release": f"https://musicbrainz.org/release/{release_id}",
+                "images": [
+                    {
+                        "front": True,
+                        "back": False,
+                        "id": 1,
+                        "image": self.image_url(request, release_id),
+                        "thumbnails": {"250": self.image_url(request, f"{release_id}-250")},
+                    }
+                ],
+            }
+        )
+
+    async def geocode(self, request: Request):
+        if not await self.delay("openweather"):
+            return JSONResponse({"cod": 503}, status_code=503)
+        return JSONResponse(
+            [{"name": request.query_params.get("q", ""), "lat": 52.52, "lon": 13.40, "country": "DE", "state": "Berlin"}]
+        )
+
+    async def weather(self, request: Request):
+        if not await self.delay("openweather"):
+            return JSONResponse({"cod": 503}, status_code=503)
+        return JSONResponse(
+            {
+                "weather": [{"main": "Clouds", "icon": "04d"}],
+                "main": {"temp": 285.1, "temp_min": 283.9, "temp_max": 286.3},
+                "name": "Berlin",
+                "timezone": 3600,
+            }
+        )
+
+    async def image(self, request: Request):
+        if not await self.delay("images"):
+            return Response(status_code=503)
+        etag = '"pixel"'
+        if request.headers.get("if-none-match") == etag:
+            return Response(status_code=304, headers={"ETag": etag})
+        return Response(PIXEL_PNG, media_type="image/png", headers={"ETag": etag})
+
+    async def stats(self, request: Request):
+        return JSONResponse(self.calls)
+
+    def app(self) -> Starlette:
+        return Starlette(
+            routes=[
+                Route("/2.0", self.lastfm),
+                Route("/2.0/", self.lastfm),
+                Route("/ws/2/recording", self.musicbrainz),
+                Route("/release/{release_id}", self.coverart_redirect),
+                Route("/_archive/release/{release_id}/index.json", self.coverart),
+                Route("/geo/1.0/direct", self.geocode),
+                Route("/data/2.5/weather", self.weather),
+                Route("/img/{name}", self.image),
+                Route("/img/wn/{name}", self.image),
+                Route("/_stats", self.stats),
+            ]
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--latency-ms", default="50")
+    parser.add_argument("--jitter-ms", type=float, default=10)
+    parser.add_argument("--error-rate", default="0")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    upstreams = FakeUpstreams(
+        parse_per_upstream(args.latency_ms, float),
+        args.jitter_ms,
+        parse_per_upstream(args.error_rate, float),
+    )
+    uvicorn.run(upstreams.app(), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,368 @@
+"""
+Load test for the events service.
+
+Starts the fake upstreams, the `main:app` FastAPI app under uvicorn and, with
+--temp-postgres, a throwaway Postgres cluster (needs initdb/pg_ctl on PATH).
+Otherwise the DB_* environment variables must point at a database the
+benchmark may write to. Each route is then driven at every concurrency level
+for a fixed time, and throughput plus p50/p95/p99 latency is written as JSON
+so runs can be diffed between versions:
+
+    python -m benchmarks.load_test --temp-postgres --concurrency 1,16,64 --duration 10 --output bench.json
+    python -m benchmarks.load_test --base-url http://127.0.0.1:8004 --token $AUTH_TOKEN
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from typing import Callable, Dict, List, Optional
+
+import asyncpg
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ROUTES = ("add-music", "add-music-batch", "current-playing", "weather", "cover-art", "cover-art-image")
+TOKEN = "benchmark-token"
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def percentile(values: List[float], p: float) -> float:
+    """
+    Nearest rank percentile of an already sorted list.
+    """
+    if not values:
+        return 0.0
+    rank = max(0, min(len(values) - 1, math.ceil(p / 100 * len(values)) - 1))
+    return values[rank]
+
+
+class Environment:
+    """
+    The processes a local run needs, torn down in reverse order.
+    """
+
+    def __init__(self, args):
+        self.args = args
+        self.workdir = tempfile.mkdtemp(prefix="events-bench-")
+        self.processes: List[subprocess.Popen] = []
+        self.pg_data: Optional[str] = None
+        self.db_env: Dict[str, str] = {}
+
+    def spawn(self, cmd: List[str], env: Optional[dict] = None, name: str = "process") -> subprocess.Popen:
+        log = open(os.path.join(self.workdir, f"{name}.log"), "wb")
+        process = subprocess.Popen(cmd, cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT)
+        self.processes.append(process)
+        return process
+
+    def start_postgres(self):
+        port = free_port()
+        self.pg_data = os.path.join(self.workdir, "pg")
+        subprocess.run(
+            ["initdb", "-D", self.pg_data, "-U", "bench", "--auth=trust", "-E", "UTF8"],
+            check=True,
+            stdout=subprocess.DEVNULL,
+        )
+        subprocess.run(
+            [
+                "pg_ctl", "-D", self.pg_data, "-w", "-l", os.path.join(self.workdir, "postgres.log"),
+                "-o", f"-p {port} -k {self.workdir} -c listen_addresses=127.0.0.1 -c fsync=off",
+                "start",
+            ],
+            check=True,
+            stdout=subprocess.DEVNULL,
+        )
+        subprocess.run(
+            ["createdb", "-h", "127.0.0.1", "-p", str(port), "-U", "bench", "events"],
+            check=True,
+        )
+        self.db_env = {
+            "DB_HOST": "127.0.0.1",
+            "DB_PORT": str(port),
+            "DB_USER": "bench",
+            "DB_PASS": "bench",
+            "DB_NAME": "events",
+        }
+
+    async def apply_schema(self):
+        env = {**os.environ, **self.db_env}
+        dsn = f"postgresql://{env['DB_USER']}:{env['DB_PASS']}@{env['DB_HOST']}:{env['DB_PORT']}/{env['DB_NAME']}"
+        con = await asyncpg.connect(dsn)
+        try:
+            with open(os.path.join(ROOT, "benchmarks", "schema.sql")) as f:
+                await con.execute(f.read())
+        finally:
+            await con.close()
+
+    def start_upstreams(self) -> str:
+        port = free_port()
+        self.spawn(
+            [
+                sys.executable, "-m", "benchmarks.fake_upstreams",
+                "--port", str(port),
+                "--latency-ms", self.args.upstream_latency_ms,
+                "--jitter-ms", str(self.args.upstream_jitter_ms),
+                "--error-rate", self.args.upstream_error_rate,
+            ],
+            name="upstreams",
+        )
+        return f"http://127.0.0.1:{port}"
+
+    def start_app(self, upstream_url: str) -> str:
+        port = free_port()
+        env = {
+            **os.environ,
+            **self.db_env,
+            "APP_NAME": "events-bench",
+            "APP_URL": f"http://127.0.0.1:{port}",
+            "BASE_ROUTE": "",
+            "AUTH_TOKEN": TOKEN,
+            "STATIC_DIR": os.path.join(self.workdir, "static"),
+            "COVER_ART_CACHE_DIR": os.path.join(self.workdir, "cover-art"),
+            "THE_LAST_FM_BASE_URL": upstream_url,
+            "MUSICBRAINZ_BASE_URL": upstream_url,
+            "COVERT_ART_ARCHIVE_BASE_URL": upstream_url,
+            "OPENWEATHER_API_URL": upstream_url,
+            "OPENWEATHER_URL": upstream_url,
+            "LAST_FM_API_KEY": "bench",
+            "OPENWEATHER_API_KEY": "bench",
+            "WEATHER_LOCATION_QUERY": "Berlin",
+            # the fakes answer every request, throttling would only measure the limiter
+            "LFM_RATE_LIMIT": "0",
+            "MB_RATE_LIMIT": "0",
+            "CAA_RATE_LIMIT": "0",
+        }
+        self.spawn(
+            [
+                sys.executable, "-m", "uvicorn", "main:app",
+                "--host", "127.0.0.1",
+                "--port", str(port),
+                "--workers", str(self.args.workers),
+                "--log-level", "warning",
+            ],
+            env=env,
+            name="app",
+        )
+        return f"http://127.0.0.1:{port}"
+
+    def stop(self):
+        for process in reversed(self.processes):
+            process.terminate()
+            try:
+                process.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        if self.pg_data:
+            subprocess.run(["pg_ctl", "-D", self.pg_data, "-m", "fast", "stop"], stdout=subprocess.DEVNULL)
+        if not self.args.keep_workdir:
+            shutil.rmtree(self.workdir, ignore_errors=True)
+
+
+async def wait_for(client: httpx.AsyncClient, url: str, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            response = await client.get(url)
+            if response.status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.25)
+    raise RuntimeError(f"{url} did not come up within {timeout}s")
+
+
+def make_requests(args) -> Dict[str, Callable[[random.Random], dict]]:
+    tracks = [(f"Track {n}", f"Artist {n % max(1, args.tracks // 10)}") for n in range(args.tracks)]
+    devices = [f"device-{n}" for n in range(args.devices)]
+    releases = [f"00000000-0000-0000-0000-{n:012d}" for n in range(args.tracks)]
+
+    def event(rng: random.Random) -> dict:
+        title, artist = rng.choice(tracks)
+        return {
+            "title": title,
+            "artist": artist,
+            "album": f"{artist} greatest hits",
+            "duration": 215.0,
+            "elapsed": round(rng.uniform(0, 215), 1),
+            "playbackRate": rng.random() < 0.9,
+            "deviceName": rng.choice(devices),
+        }
+
+    def add_music(rng: random.Random) -> dict:
+        return {"method": "POST", "url": "/add-music", "json": event(rng)}
+
+    def add_music_batch(rng: random.Random) -> dict:
+        return {"method": "POST", "url": "/add-music/batch", "json": [event(rng) for _ in range(args.batch_size)]}
+
+    return {
+        "add-music": add_music,
+        "add-music-batch": add_music_batch,
+        "current-playing": lambda rng: {"method": "GET", "url": "/current-playing"},
+        "weather": lambda rng: {"method": "GET", "url": "/weather"},
+        "cover-art": lambda rng: {"method": "GET", "url": f"/cover-art/{rng.choice(releases)}"},
+        "cover-art-image": lambda rng: {"method": "GET", "url": f"/cover-art/{rng.choice(releases)}/image?size=250"},
+    }
+
+
+async def drive(
+    client: httpx.AsyncClient,
+    make_request: Callable[[random.Random], dict],
+    concurrency: int,
+    duration: float,
+    seed: int,
+) -> dict:
+    latencies: List[float] = []
+    statuses: Counter = Counter()
+    deadline = time.monotonic() + duration
+
+    async def worker(n: int):
+        rng = random.Random(seed * 1000 + n)
+        while time.monotonic() < deadline:
+            request = make_request(rng)
+            started = time.perf_counter()
+            try:
+                response = await client.request(**request)
+                await response.aread()
+                statuses[str(response.status_code)] += 1
+            except httpx.HTTPError as e:
+                statuses[type(e).__name__] += 1
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    started = time.monotonic()
+    await asyncio.gather(*(worker(n) for n in range(concurrency)))
+    elapsed = time.monotonic() - started
+
+    latencies.sort()
+    ok = sum(count for status, count in statuses.items() if status.isdigit() and int(status) < 400)
+    return {
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "ok": ok,
+        "errors": len(latencies) - ok,
+        "status": dict(sorted(statuses.items())),
+        "throughput_rps": round(len(latencies) / elapsed, 1),
+        "latency_ms": {
+            "p50": round(percentile(latencies, 50), 2),
+            "p95": round(percentile(latencies, 95), 2),
+            "p99": round(percentile(latencies, 99), 2),
+            "mean": round(sum(latencies) / len(latencies), 2) if latencies else 0.0,
+            "max": round(latencies[-1], 2) if latencies else 0.0,
+        },
+    }
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(args) -> dict:
+    env = None
+    base_url = args.base_url
+    token = args.token or TOKEN
+    try:
+        if base_url is None:
+            env = Environment(args)
+            if args.temp_postgres:
+                env.start_postgres()
+            await env.apply_schema()
+            upstream_url = env.start_upstreams()
+            base_url = env.start_app(upstream_url)
+
+        limits = httpx.Limits(max_connections=max(args.concurrency), max_keepalive_connections=max(args.concurrency))
+        async with httpx.AsyncClient(
+            base_url=base_url,
+            headers={"Authorization": f"Bearer {token}"},
+            limits=limits,
+            timeout=args.timeout,
+        ) as client:
+            await wait_for(client, "/health")
+            requests = make_requests(args)
+            results = []
+            for route in args.routes:
+                for concurrency in args.concurrency:
+                    result = await drive(client, requests[route], concurrency, args.duration, args.seed)
+                    result["route"] = route
+                    if route == "add-music-batch":
+                        result["events_per_s"] = round(result["throughput_rps"] * args.batch_size, 1)
+                    results.append(result)
+                    print(
+                        f"{route:>16} c={concurrency:<4} {result['throughput_rps']:>9} req/s "
+                        f"p50={result['latency_ms']['p50']}ms p99={result['latency_ms']['p99']}ms "
+                        f"errors={result['errors']}"
+                        + (f" events/s={result['events_per_s']}" if "events_per_s" in result else ""),
+                        file=sys.stderr,
+                    )
+    finally:
+        if env is not None:
+            env.stop()
+
+    return {
+        "meta": {
+            "revision": git_revision(),
+            "started_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "duration_s": args.duration,
+            "workers": args.workers,
+            "upstream_latency_ms": args.upstream_latency_ms,
+            "upstream_error_rate": args.upstream_error_rate,
+            "tracks": args.tracks,
+            "devices": args.devices,
+            "batch_size": args.batch_size,
+        },
+        "results": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--routes", default=",".join(ROUTES), type=lambda v: v.split(","))
+    parser.add_argument("--concurrency", default="1,16,64", type=lambda v: [int(c) for c in v.split(",")])
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--tracks", type=int, default=500)
+    parser.add_argument("--devices", type=int, default=4)
+    parser.add_argument("--batch-size", type=int, default=1000, help="events per add-music-batch request")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--upstream-latency-ms", default="50")
+    parser.add_argument("--upstream-jitter-ms", type=float, default=10)
+    parser.add_argument("--upstream-error-rate", default="0")
+    parser.add_argument("--temp-postgres", action="store_true")
+    parser.add_argument("--base-url", help="benchmark an already running service instead of starting one")
+    parser.add_argument("--token", help="bearer token for --base-url")
+    parser.add_argument("--keep-workdir", action="store_true")
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    unknown = set(args.routes) - set(ROUTES)
+    if unknown:
+        parser.error(f"unknown routes: {', '.join(sorted(unknown))}")
+
+    report = asyncio.run(run(args))
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,22 @@
+-- events table as the service expects it, for benchmark databases
+CREATE TABLE IF NOT EXISTS events (
+    id bigserial PRIMARY KEY,
+    title text NOT NULL,
+    recording_id text,
+    artist text NOT NULL,
+    artist_id text,
+    album text,
+    release_id text,
+    duration double precision,
+    playbackRate boolean,
+    bundle text,
+    elapsed double precision,
+    deviceName text,
+    images jsonb,
+    is_valid boolean,
+    is_deleted boolean NOT NULL DEFAULT false,
+    playcount integer NOT NULL DEFAULT 1,
+    created timestamptz NOT NULL DEFAULT now(),
+    updated timestamptz NOT NULL DEFAULT now(),
+    UNIQUE (title, artist, album)
+);
@@ -0,0 +1,114 @@
+import asyncio
+import logging
+from collections import deque
+from typing import Any, List, Optional, Set, Tuple
+
+import orjson
+
+logger = logging.getLogger(__name__)
+
+
+class Subscriber:
+    __slots__ = ("queue", "dropped")
+
+    def __init__(self, queue_size: int):
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.dropped = False
+
+
+class Broadcaster:
+    """
+    In-process fan-out of events to any number of subscribers.
+    Each event gets an increasing id and the last `history` events are kept
+    so a reconnecting client can resume after the last id it saw.
+    Subscribers whose queue fills up are dropped and have to reconnect.
+    """
+
+    def __init__(self, queue_size: int = 16, history: int = 64):
+        self._queue_size = queue_size
+        self._subscribers: Set[Subscriber] = set()
+        self._history: deque = deque(maxlen=history)
+        self._last_id = 0
+        self.published = 0
+        self.dropped = 0
+
+    @property
+    def subscribers(self) -> int:
+        return len(self._subscribers)
+
+    def latest(self) -> Optional[Tuple[int, str]]:
+        return self._history[-1] if self._history else None
+
+    def publish(self, payload: Any) -> Optional[int]:
+        """
+        Send `payload` to every subscriber. Returns the event id, or None if the
+        payload is identical to the last one published.
+        """
+        data = orjson.dumps(payload).decode()
+        latest = self.latest()
+        if latest is not None and latest[1] == data:
+            return None
+
+        self._last_id += 1
+        event = (self._last_id, data)
+        self._history.append(event)
+        self.published += 1
+
+        for subscriber in list(self._subscribers):
+            try:
+                subscriber.queue.put_nowait(event)
+            except asyncio.QueueFull:
+                self._drop(subscriber)
+        return self._last_id
+
+    def _drop(self, subscriber: Subscriber):
+        self._subscribers.discard(subscriber)
+        subscriber.dropped = True
+        self.dropped += 1
+        # make room for the end of stream marker
+        while not subscriber.queue.empty():
+            subscriber.queue.get_nowait()
+        subscriber.queue.put_nowait(None)
+        logger.info("dropped slow now-playing subscriber")
+
+    def subscribe(self, last_event_id: Optional[int] = None) -> Tuple[Subscriber, List[Tuple[int, str]]]:
+        """
+        Register a subscriber. Also returns the events it missed since `last_event_id`,
+        or the latest event when there is nothing to resume from.
+        """
+        subscriber = Subscriber(self._queue_size)
+        self._subscribers.add(subscriber)
+
+        if (
+            last_event_id is not None
+            and self._history
+            and self._history[0][0] <= last_event_id + 1
+            and last_event_id <= self._last_id
+        ):
+            backlog = [event for event in self._history if event[0] > last_event_id]
+        else:
+            backlog = [self._history[-1]] if self._history else []
+        return subscriber, backlog
+
+    def unsubscribe(self, subscriber: Subscriber):
+        self._subscribers.discard(subscriber)
+
+    def close(self):
+        for subscriber in list(self._subscribers):
+            self._subscribers.discard(subscriber)
+            try:
+                subscriber.queue.put_nowait(None)
+            except asyncio.QueueFull:
+                self._drop(subscriber)
+
+    def stats(self) -> dict:
+        return {
+            "subscribers": self.subscribers,
+            "published": self.published,
+            "dropped": self.dropped,
+            "last_event_id": self._last_id,
+        }
+
+
+def format_event(event_id: int, data: str, event: str = "message") -> str:
+    return f"id: {event_id}\nevent: {event}\ndata: {data}\n\n"
@@ -1,54 +1,128 @@
+import asyncio
+import logging
+import sys
 import time
+from collections import OrderedDict
 from typing import Any, Optional
 
+logger = logging.getLogger(__name__)
+
+
+def estimate_size(value: Any) -> int:
+    """
+    Rough size in bytes of a cached value, good enough for budgeting.
+    """
+    if isinstance(value, (bytes, bytearray, str)):
+        return sys.getsizeof(value)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(
+            estimate_size(k) + estimate_size(v) for k, v in value.items()
+        )
+    if isinstance(value, (list, tuple, set)):
+        return sys.getsizeof(value) + sum(estimate_size(v) for v in value)
+    if hasattr(value, "__slots__"):
+        return sys.getsizeof(value) + sum(
+            estimate_size(getattr(value, name, None)) for name in value.__slots__
+        )
+    return sys.getsizeof(value)
+
+
+class _Entry:
+    __slots__ = ("value", "expire_at", "size")
+
+    def __init__(self, value: Any, expire_at: Optional[float], size: int):
+        self.value = value
+        self.expire_at = expire_at
+        self.size = size
+
 
 class InMemoryCache:
-    def __init__(self):
-        self._store = {}
+    def __init__(self, max_entries: int = 10000, max_bytes: int = 64 * 1024 * 1024):
+        self._store: OrderedDict = OrderedDict()
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def _remove(self, key: str) -> Optional[_Entry]:
+        entry = self._store.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry.size
+        return entry
+
+    def _expired(self, entry: _Entry, now: float) -> bool:
+        return entry.expire_at is not None and now > entry.expire_at
+
+    def _evict(self):
+        while self._store and (len(self._store) > self.max_entries or self.bytes > self.max_bytes):
+            _, entry = self._store.popitem(last=False)
+            self.bytes -= entry.size
+            self.evictions += 1
 
     def set(self, key: str, value: Any, ttl: Optional[int] = None):
         """
         Store a key-value pair in the cache with an optional time-to-live (ttl) in seconds.
         """
-        expire_at = time.time() + ttl if ttl is not None else None
-        self._store[key] = {"value": value, "expire_at": expire_at}
+        expire_at = time.monotonic() + ttl if ttl is not None else None
+        size = estimate_size(key) + estimate_size(value)
+        self._remove(key)
+        self._store[key] = _Entry(value, expire_at, size)
+        self.bytes += size
+        self._evict()
 
     def get(self, key: str) -> Optional[Any]:
         """
         Retrieve a value from the cache. Returns None if the key is missing or expired.
         """
-        item = self._store.get(key)
-        if item is None:
+        entry = self._store.get(key)
+        if entry is None:
+            self.misses += 1
             return None
 
-        if item["expire_at"] is not None and time.time() > item["expire_at"]:
-            self._store.pop(key, None)
+        if self._expired(entry, time.monotonic()):
+            self._remove(key)
+            self.expirations += 1
+            self.misses += 1
             return None
 
-        return item["value"]
+        self._store.move_to_end(key)
+        self.hits += 1
+        return entry.value
 
     def delete(self, key: str):
         """
         Remove a key from the cache.
         """
-        self._store.pop(key, None)
+        self._remove(key)
+
+    def delete_prefix(self, prefix: str) -> int:
+        """
+        Remove every key starting with `prefix`. Returns the number of keys removed.
+        """
+        keys = [key for key in self._store if key.startswith(prefix)]
+        for key in keys:
+            self._remove(key)
+        return len(keys)
 
     def ttl(self, key: str) -> Optional[int]:
         """
-        Return the TTL (time to live) in seconds for a key. 
+        Return the TTL (time to live) in seconds for a key.
         Returns None if no TTL is set, or -1 if the key does not exist or has expired.
         """
-        item = self._store.get(key)
-        if item is None:
+        entry = self._store.get(key)
+        if entry is None:
             return -1
 
-        expire_at = item["expire_at"]
-        if expire_at is None:
+        if entry.expire_at is None:
             return None
 
-        remaining = expire_at - time.time()
+        remaining = entry.expire_at - time.monotonic()
         if remaining <= 0:
-            self._store.pop(key, None)
+            self._remove(key)
+            self.expirations += 1
             return -1
 
         return int(remaining)
@@ -58,13 +132,49 @@ class InMemoryCache:
         Update the TTL for a given key.
         Returns True if successful, False if the key does not exist or has expired.
         """
-        item = self._store.get(key)
-        if item is None:
+        entry = self._store.get(key)
+        if entry is None:
             return False
 
-        if item["expire_at"] is not None and time.time() > item["expire_at"]:
-            self._store.pop(key, None)
+        now = time.monotonic()
+        if self._expired(entry, now):
+            self._remove(key)
+            self.expirations += 1
             return False
 
-        item["expire_at"] = time.time() + ttl
+        entry.expire_at = now + ttl
         return True
+
+    def sweep(self) -> int:
+        """
+        Drop every expired entry. Returns the number of entries removed.
+        """
+        now = time.monotonic()
+        expired = [key for key, entry in self._store.items() if self._expired(entry, now)]
+        for key in expired:
+            self._remove(key)
+        self.expirations += len(expired)
+        return len(expired)
+
+    async def run_sweeper(self, interval: float = 60.0):
+        """
+        Sweep expired entries every `interval` seconds until cancelled.
+        """
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                removed = self.sweep()
+                if removed:
+                    logger.debug(f"cache sweeper removed {removed} expired entries")
+            except Exception as e:
+                logger.error(f"cache sweep failed due to {e}", exc_info=True)
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._store),
+            "bytes": self.bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
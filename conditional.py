@@ -0,0 +1,68 @@
+import hashlib
+import time
+from typing import Any, Awaitable, Callable, Optional, Tuple
+
+import orjson
+from fastapi import Request
+from starlette.responses import Response
+
+
+class CachedResponse:
+    """
+    A 200 payload together with its encoded body and strong ETag. Built once when
+    the cache is filled, so serving a hit is a write of `body` and a 304 costs nothing.
+    """
+
+    __slots__ = ("content", "body", "etag", "created")
+
+    def __init__(self, content: Any):
+        self.content = content
+        self.body = orjson.dumps(content)
+        self.etag = '"' + hashlib.blake2b(self.body, digest_size=16).hexdigest() + '"'
+        self.created = time.monotonic()
+
+    def age(self) -> float:
+        return time.monotonic() - self.created
+
+
+def cached_response(fn: Callable[[], Awaitable[Tuple[int, Any]]]) -> Callable[[], Awaitable[Tuple[int, Any]]]:
+    """
+    Wrap a get_or_compute loader so 200 payloads are cached as CachedResponse.
+    """
+
+    async def load():
+        status_code, payload = await fn()
+        if status_code == 200:
+            return status_code, CachedResponse(payload)
+        return status_code, payload
+
+    return load
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == etag:
+            return True
+    return False
+
+
+def conditional_response(
+    request: Request,
+    cached: CachedResponse,
+    max_age: int,
+    stale_while_revalidate: Optional[int] = None,
+) -> Response:
+    """
+    304 if the client already has this payload, otherwise the pre-encoded body.
+    """
+    cache_control = f"public, max-age={max(0, int(max_age))}"
+    if stale_while_revalidate:
+        cache_control += f", stale-while-revalidate={stale_while_revalidate}"
+    headers = {"ETag": cached.etag, "Cache-Control": cache_control}
+    if etag_matches(request, cached.etag):
+        return Response(status_code=304, headers=headers)
+    return Response(cached.body, media_type="application/json", headers=headers)
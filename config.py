@@ -1,29 +1,123 @@
+import asyncio
 from contextlib import asynccontextmanager
+import hmac
 import logging
-from typing import Union
+from typing import Dict, FrozenSet, Optional, Union
 import asyncpg
 from fastapi import FastAPI, HTTPException
 from starlette.requests import Request
-from starlette.responses import JSONResponse
+from fastapi.responses import ORJSONResponse
 from starlette.status import HTTP_500_INTERNAL_SERVER_ERROR
+from artwork import ArtworkStore, start_image_workers, stop_image_workers
+from broadcaster import Broadcaster
 from cache import InMemoryCache
-from email_service import init_fastmail
-from settings import AUTH_TOKEN, DB_HOST, DB_PORT, DB_USER, DB_PASS, DB_NAME
-from starlette.middleware.base import BaseHTTPMiddleware
+from constant import CURRENT_PLAYING_CACHE_KEY
+from cover_art import CoverArtIndex, ImageCache
+from db import Connection, init_connection
+from dedupe import DedupeWindow
+from email_service import EmailOutbox
+from enrichment import EnrichmentQueue
+from http_client import http_client
+from invalidation import CacheInvalidator
+from metadata_cache import TrackMetadataCache
+from metrics import TimedPool, collect_app_metrics, registry
+from pending_events import PendingEnrichment
+from plays import PlayLog
+from service import enrich_music, flush_events, publish_current_playing
+from singleflight import SingleFlight
+from stats import init_stats
+from stream_token import STREAM_TOKEN_COOKIE, STREAM_TOKEN_PARAM, verify_stream_token
+from settings import (
+    ARTWORK_IMAGE_WORKERS,
+    ARTWORK_KNOWN_URLS,
+    ARTWORK_REVALIDATE_AFTER,
+    AUTH_TOKEN,
+    AUTH_TOKENS,
+    CACHE_INVALIDATION_CHANNEL,
+    CACHE_MAX_BYTES,
+    CACHE_MAX_ENTRIES,
+    CACHE_SWEEP_INTERVAL,
+    COVER_ART_CACHE_DIR,
+    COVER_ART_DISK_BUDGET,
+    COVER_ART_INDEX_SIZE,
+    COVER_ART_MAX_IMAGE_BYTES,
+    COVER_ART_SWEEP_INTERVAL,
+    COVERT_ART_ARCHIVE_BASE_URL,
+    DB_HOST,
+    DB_PORT,
+    DB_USER,
+    DB_PASS,
+    DB_NAME,
+    DB_COMMAND_TIMEOUT,
+    DB_MAINTENANCE_TIMEOUT,
+    DB_MAX_INACTIVE_LIFETIME,
+    DB_POOL_MAX_SIZE,
+    DB_POOL_MIN_SIZE,
+    DB_STATEMENT_CACHE_SIZE,
+    DEDUPE_BACKEND,
+    DEDUPE_MAX_DEVICES,
+    DEDUPE_MAX_PER_DEVICE,
+    DEDUPE_MAX_WINDOW,
+    DEDUPE_MIN_WINDOW,
+    EMAIL_BACKOFF_BASE,
+    EMAIL_BACKOFF_MAX,
+    EMAIL_BATCH_SIZE,
+    EMAIL_BURST,
+    EMAIL_FROM,
+    EMAIL_IDLE_TIMEOUT,
+    EMAIL_LEASE,
+    EMAIL_MAX_ATTEMPTS,
+    EMAIL_MAX_PER_MINUTE,
+    EMAIL_PASS,
+    EMAIL_POLL_INTERVAL,
+    EMAIL_PORT,
+    EMAIL_SERVER,
+    EMAIL_SMTP_TIMEOUT,
+    EMAIL_SSL_TLS,
+    EMAIL_STARTTLS,
+    EMAIL_USER,
+    ENRICHMENT_BACKOFF_BASE,
+    ENRICHMENT_BACKOFF_MAX,
+    ENRICHMENT_CLAIM_BATCH,
+    ENRICHMENT_DRAIN_TIMEOUT,
+    ENRICHMENT_LEASE,
+    ENRICHMENT_POLL_INTERVAL,
+    ENRICHMENT_QUEUE_SIZE,
+    ENRICHMENT_WORKERS,
+    METADATA_CACHE_SIZE,
+    METADATA_CACHE_TTL,
+    METADATA_NEGATIVE_TTL,
+    PLAYS_ARCHIVE_DIR,
+    PLAYS_MAINTENANCE_INTERVAL,
+    PLAYS_PARTITIONS_AHEAD,
+    PLAYS_RETENTION_MONTHS,
+    RATE_LIMIT_BACKEND,
+    SINGLE_FLIGHT_TIMEOUT,
+    SSE_HISTORY_SIZE,
+    SSE_QUEUE_SIZE,
+    STATIC_DIR,
+    WRITE_BUFFER_FLUSH_MS,
+    WRITE_BUFFER_MAX_ENTRIES,
+    WRITE_BUFFER_MAX_PENDING,
+)
+from starlette.types import ASGIApp, Receive, Scope, Send
+from utils import init_rate_limiter, rate_limiter
+from weather import GeocodeCache, warm_weather
+from write_buffer import WriteBehindBuffer
 
 logger = logging.getLogger(__name__)
 
 
-async def http_error_handler(_: Request, exc: HTTPException) -> JSONResponse:
-    return JSONResponse({"errors": [exc.detail]}, status_code=exc.status_code)
+async def http_error_handler(_: Request, exc: HTTPException) -> ORJSONResponse:
+    return ORJSONResponse({"errors": [exc.detail]}, status_code=exc.status_code)
 
 
 async def generic_error_handler(
     _: Request,
     exc: Union[Exception],
-) -> JSONResponse:
+) -> ORJSONResponse:
     logger.error(exc, exc_info=True)
-    return JSONResponse(
+    return ORJSONResponse(
         {"errors": "failed"},
         status_code=HTTP_500_INTERNAL_SERVER_ERROR,
     )
@@ -32,10 +126,138 @@ async def generic_error_handler(
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     await init_db(app)
-    app.cache = InMemoryCache()
+    await init_rate_limiter(app.db)
+    app.cache = InMemoryCache(max_entries=CACHE_MAX_ENTRIES, max_bytes=CACHE_MAX_BYTES)
+    cache_sweeper = asyncio.create_task(app.cache.run_sweeper(CACHE_SWEEP_INTERVAL))
+    app.flights = SingleFlight(timeout=SINGLE_FLIGHT_TIMEOUT)
+    app.broadcaster = Broadcaster(queue_size=SSE_QUEUE_SIZE, history=SSE_HISTORY_SIZE)
+    app.invalidator = CacheInvalidator(app.db, app.cache, app.flights, channel=CACHE_INVALIDATION_CHANNEL)
+    await app.invalidator.start()
+
+    async def on_invalidate(key: str, prefix: bool):
+        # another worker changed now-playing, refresh the streams connected to this one
+        affected = CURRENT_PLAYING_CACHE_KEY.startswith(key) if prefix else key == CURRENT_PLAYING_CACHE_KEY
+        if affected and app.broadcaster.subscribers:
+            await publish_current_playing(app)
+
+    app.invalidator.add_hook(on_invalidate)
+    await http_client.start()
+    app.metadata_cache = TrackMetadataCache(
+        app.db,
+        max_entries=METADATA_CACHE_SIZE,
+        ttl=METADATA_CACHE_TTL,
+        negative_ttl=METADATA_NEGATIVE_TTL,
+    )
+    await app.metadata_cache.init()
+    app.artwork = ArtworkStore(
+        app.db,
+        STATIC_DIR,
+        revalidate_after=ARTWORK_REVALIDATE_AFTER,
+        max_known=ARTWORK_KNOWN_URLS,
+    )
+    await app.artwork.init()
+    start_image_workers(ARTWORK_IMAGE_WORKERS)
+    app.cover_art = CoverArtIndex(app.db, COVERT_ART_ARCHIVE_BASE_URL, max_entries=COVER_ART_INDEX_SIZE)
+    await app.cover_art.init()
+    app.cover_art_images = ImageCache(
+        COVER_ART_CACHE_DIR,
+        max_bytes=COVER_ART_DISK_BUDGET,
+        max_file_bytes=COVER_ART_MAX_IMAGE_BYTES,
+    )
+    await app.cover_art_images.init()
+    cover_art_sweeper = asyncio.create_task(app.cover_art_images.run_sweeper(COVER_ART_SWEEP_INTERVAL))
+    app.dedupe = DedupeWindow(
+        app.db if DEDUPE_BACKEND == "postgres" else None,
+        max_devices=DEDUPE_MAX_DEVICES,
+        max_per_device=DEDUPE_MAX_PER_DEVICE,
+        min_window=DEDUPE_MIN_WINDOW,
+        max_window=DEDUPE_MAX_WINDOW,
+    )
+    await app.dedupe.init()
+    await init_stats(app.db, ddl_timeout=DB_MAINTENANCE_TIMEOUT)
+    app.plays = PlayLog(
+        app.db,
+        PLAYS_ARCHIVE_DIR,
+        retention_months=PLAYS_RETENTION_MONTHS,
+        months_ahead=PLAYS_PARTITIONS_AHEAD,
+        maintenance_timeout=DB_MAINTENANCE_TIMEOUT,
+    )
+    await app.plays.init()
+    plays_maintenance = asyncio.create_task(app.plays.run_maintenance(PLAYS_MAINTENANCE_INTERVAL))
+    dedupe_pruner = asyncio.create_task(app.dedupe.run_pruner())
+    app.enrichment = EnrichmentQueue(
+        lambda event: enrich_music(app, event),
+        workers=ENRICHMENT_WORKERS,
+        maxsize=ENRICHMENT_QUEUE_SIZE,
+    )
+    app.enrichment.start()
+    app.pending = PendingEnrichment(
+        app.db,
+        app.enrichment,
+        batch_size=ENRICHMENT_CLAIM_BATCH,
+        lease=ENRICHMENT_LEASE,
+        backoff_base=ENRICHMENT_BACKOFF_BASE,
+        backoff_max=ENRICHMENT_BACKOFF_MAX,
+        poll_interval=ENRICHMENT_POLL_INTERVAL,
+        ddl_timeout=DB_MAINTENANCE_TIMEOUT,
+    )
+    await app.pending.init()
+    # connections opened before the schema was complete prepare their statements again
+    await app.db.expire_connections()
+    app.pending.start()
+    app.write_buffer = WriteBehindBuffer(
+        lambda rows: flush_events(app, rows),
+        interval=WRITE_BUFFER_FLUSH_MS / 1000,
+        max_entries=WRITE_BUFFER_MAX_ENTRIES,
+        max_pending=WRITE_BUFFER_MAX_PENDING,
+    )
+    app.write_buffer.start()
+    app.geocode = GeocodeCache(app.db)
+    await app.geocode.init()
+    warm_weather(app)
+    app.outbox = EmailOutbox(
+        app.db,
+        EMAIL_FROM,
+        {
+            "hostname": EMAIL_SERVER,
+            "port": EMAIL_PORT,
+            "username": EMAIL_USER or None,
+            "password": EMAIL_PASS or None,
+            "start_tls": EMAIL_STARTTLS,
+            "use_tls": EMAIL_SSL_TLS,
+            "timeout": EMAIL_SMTP_TIMEOUT,
+        },
+        batch_size=EMAIL_BATCH_SIZE,
+        max_attempts=EMAIL_MAX_ATTEMPTS,
+        backoff_base=EMAIL_BACKOFF_BASE,
+        backoff_max=EMAIL_BACKOFF_MAX,
+        rate=EMAIL_MAX_PER_MINUTE / 60,
+        burst=EMAIL_BURST,
+        idle_timeout=EMAIL_IDLE_TIMEOUT,
+        poll_interval=EMAIL_POLL_INTERVAL,
+        lease=EMAIL_LEASE,
+        limiter_pool=app.db if RATE_LIMIT_BACKEND == "postgres" else None,
+    )
+    await app.outbox.init()
+    app.outbox.start()
+    registry.add_collector(lambda: collect_app_metrics(app, rate_limiter))
     
     yield
 
+    registry.clear_collectors()
+
+    await app.outbox.stop()
+    await app.write_buffer.stop()
+    await app.pending.stop()
+    await app.enrichment.stop(timeout=ENRICHMENT_DRAIN_TIMEOUT)
+    app.broadcaster.close()
+    await app.invalidator.stop()
+    await http_client.close()
+    stop_image_workers()
+    cache_sweeper.cancel()
+    cover_art_sweeper.cancel()
+    dedupe_pruner.cancel()
+    plays_maintenance.cancel()
     await app.db.close()
     logger.info("database connection closed")
 
@@ -43,29 +265,97 @@ async def lifespan(app: FastAPI):
 async def init_db(app: FastAPI):
     logger.info("initializing database connection")
     dsn = f"postgresql://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
-    pool = await asyncpg.create_pool(dsn)
-    app.db = pool
+    pool = await asyncpg.create_pool(
+        dsn,
+        min_size=DB_POOL_MIN_SIZE,
+        max_size=DB_POOL_MAX_SIZE,
+        max_inactive_connection_lifetime=DB_MAX_INACTIVE_LIFETIME,
+        command_timeout=DB_COMMAND_TIMEOUT or None,
+        statement_cache_size=DB_STATEMENT_CACHE_SIZE,
+        connection_class=Connection,
+        init=init_connection,
+    )
+    app.db = TimedPool(pool)
     logger.info("database connection initialized")
 
-class AuthMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request: Request, call_next):
-        # Extract the Authorization header
-        path = request.url.path
-        if request.method == "OPTIONS" or path.startswith("/static"):
-            return await call_next(request)
-        
-        token = request.headers.get("Authorization")
+def load_tokens() -> Dict[str, FrozenSet[str]]:
+    """
+    Accepted bearer tokens and their scopes. AUTH_TOKEN gets every scope,
+    AUTH_TOKENS adds comma separated `token:scope+scope` entries, so tokens can be rotated.
+    """
+    tokens = {}
+    if AUTH_TOKEN:
+        tokens[AUTH_TOKEN] = frozenset({"*"})
+    for entry in (AUTH_TOKENS or "").split(","):
+        token, _, scopes = entry.strip().partition(":")
+        if token:
+            tokens[token] = frozenset(scopes.split("+")) if scopes else frozenset({"*"})
+    return tokens
+
+
+def required_scope(method: str, path: str) -> str:
+    if path.endswith("/metrics"):
+        return "metrics"
+    if path.endswith("/current-playing/stream-token"):
+        return "read"
+    return "read" if method in ("GET", "HEAD") else "ingest"
+
+
+class AuthMiddleware:
+    """
+    Pure ASGI bearer token check. Credentials are encoded once at startup and
+    compared in constant time against every accepted token. Browser EventSource
+    can't set headers, so /current-playing/stream also takes a stream token
+    from POST /current-playing/stream-token in a query parameter or cookie.
+    """
+
+    def __init__(self, app: ASGIApp, tokens: Optional[Dict[str, FrozenSet[str]]] = None):
+        self.app = app
+        tokens = load_tokens() if tokens is None else tokens
+        self._credentials = [
+            (f"Bearer {token}".encode(), scopes) for token, scopes in tokens.items()
+        ]
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        method = scope["method"]
+        if method == "OPTIONS" or scope["path"].startswith("/static"):
+            return await self.app(scope, receive, send)
+
+        token = None
+        for name, value in scope["headers"]:
+            if name == b"authorization":
+                token = value
+                break
         if not token:
-            raise HTTPException(status_code=401, detail="Missing Authorization header")
+            if method == "GET" and scope["path"].endswith("/current-playing/stream"):
+                request = Request(scope)
+                stream_token = request.query_params.get(STREAM_TOKEN_PARAM) or request.cookies.get(STREAM_TOKEN_COOKIE)
+                if stream_token:
+                    if verify_stream_token(stream_token):
+                        return await self.app(scope, receive, send)
+                    return await self._reject(scope, receive, send, 401, "Invalid or expired stream token")
+            return await self._reject(scope, receive, send, 401, "Missing Authorization header")
+
+        if not self._credentials:
+            return await self._reject(scope, receive, send, 500, "Server misconfiguration: AUTH_TOKEN is not set")
+
+        # no early exit, every token is compared
+        granted = None
+        for credential, scopes in self._credentials:
+            if hmac.compare_digest(token, credential):
+                granted = scopes
+        if granted is None:
+            return await self._reject(scope, receive, send, 401, "Invalid or missing token")
 
-        # Verify the token
-        expected_token = AUTH_TOKEN
-        if not expected_token:
-            raise HTTPException(status_code=500, detail="Server misconfiguration: AUTH_TOKEN is not set")
+        required = required_scope(method, scope["path"])
+        if required not in granted and "*" not in granted:
+            return await self._reject(scope, receive, send, 403, f"Token does not have the {required} scope")
 
-        if token != f"Bearer {expected_token}":
-            raise HTTPException(status_code=401, detail="Invalid or missing token")
+        await self.app(scope, receive, send)
 
-        # Proceed to the next handler if authenticated
-        response = await call_next(request)
-        return response
\ No newline at end of file
+    async def _reject(self, scope: Scope, receive: Receive, send: Send, status_code: int, detail: str):
+        response = ORJSONResponse({"errors": [detail]}, status_code=status_code)
+        await response(scope, receive, send)
@@ -0,0 +1,406 @@
+import asyncio
+import logging
+import os
+import re
+import tempfile
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+from urllib.parse import urlparse
+
+from http_client import http_client
+from utils import NOT_FOUND, make_api_request, rate_limiter
+
+logger = logging.getLogger(__name__)
+
+CREATE_TABLE_QUERY = """
+    CREATE TABLE IF NOT EXISTS cover_art (
+        release_id text PRIMARY KEY,
+        found boolean NOT NULL,
+        data jsonb,
+        checked_at timestamptz NOT NULL DEFAULT now()
+    );
+"""
+
+# CAA sizes, "full" is the original upload
+IMAGE_SIZES = ("250", "500", "1200", "full")
+IMAGE_TYPES = {"image/jpeg": "jpg", "image/png": "png", "image/gif": "gif", "image/webp": "webp"}
+MEDIA_TYPES = {ext: media_type for media_type, ext in IMAGE_TYPES.items()}
+CHUNK_SIZE = 64 * 1024
+
+_release_id = re.compile(r"^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$")
+_image_name = re.compile(r"^([0-9a-f-]{36}-[0-9a-z]+)\.(jpg|png|gif|webp)$")
+
+
+class CoverArtError(Exception):
+    pass
+
+
+def is_release_id(release_id: str) -> bool:
+    return bool(_release_id.match(release_id))
+
+
+def write_chunk(f, chunk: bytes):
+    # flushed straight away, readers of a running download go by Download.written
+    f.write(chunk)
+    f.flush()
+
+
+def front_image_url(data: dict, size: str) -> Optional[str]:
+    """
+    URL of the front image at `size`, falling back to the original when CAA has no such thumbnail.
+    """
+    if size != "full":
+        url = (data.get("thumbnails") or {}).get(size)
+        if url:
+            return url
+    return data.get("image")
+
+
+class CoverArtIndex:
+    """
+    Release -> front image metadata from the Cover Art Archive. Artwork for a
+    release doesn't change, so answers are kept forever, misses included: in an
+    in-process LRU and in the `cover_art` table, shared by every worker.
+    Failed lookups (rate limited, upstream errors) are not stored.
+    """
+
+    def __init__(self, pool, base_url: str, max_entries: int = 10000):
+        self._pool = pool
+        self.base_url = base_url
+        self._local: OrderedDict = OrderedDict()
+        self._max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+    async def init(self):
+        async with self._pool.acquire() as con:
+            await con.execute(CREATE_TABLE_QUERY)
+
+    def _remember(self, release_id: str, data: Optional[dict]):
+        self._local[release_id] = data
+        self._local.move_to_end(release_id)
+        while len(self._local) > self._max_entries:
+            self._local.popitem(last=False)
+
+    def _result(self, data: Optional[dict]) -> Tuple[int, dict]:
+        if data is None:
+            return 404, {"message": "No cover art found"}
+        return 200, data
+
+    async def get(self, release_id: str) -> Tuple[int, dict]:
+        if release_id in self._local:
+            self._local.move_to_end(release_id)
+            self.hits += 1
+            return self._result(self._local[release_id])
+
+        try:
+            async with self._pool.acquire() as con:
+                row = await con.fetchrow("SELECT found, data FROM cover_art WHERE release_id = $1;", release_id)
+        except Exception as e:
+            logger.error(f"cover art index read failed due to {e}", exc_info=True)
+            row = None
+        if row is not None:
+            data = row["data"] if row["found"] else None
+            self._remember(release_id, data)
+            self.hits += 1
+            return self._result(data)
+
+        self.misses += 1
+        status, reason, response = await make_api_request(f"{self.base_url}/release/{release_id}", "GET")
+        if not status and reason != NOT_FOUND:
+            return 400, {"message": f"Failed to get cover art due to {reason}"}
+
+        data = None
+        if status:
+            try:
+                images = response.json().get("images") or []
+            except ValueError:
+                return 400, {"message": "Invalid JSON response"}
+            for image in images:
+                if image.get("front"):
+                    data = {"release_id": release_id, **image}
+                    break
+
+        self._remember(release_id, data)
+        try:
+            async with self._pool.acquire() as con:
+                await con.execute(
+                    "INSERT INTO cover_art (release_id, found, data) VALUES ($1, $2, $3) ON CONFLICT (release_id) DO NOTHING;",
+                    release_id,
+                    data is not None,
+                    data,
+                )
+        except Exception as e:
+            logger.error(f"failed to persist cover art for {release_id}: {e}")
+        return self._result(data)
+
+    def stats(self) -> dict:
+        return {"entries": len(self._local), "hits": self.hits, "misses": self.misses}
+
+
+class Download:
+    """
+    An image being written to the disk cache. Readers follow the temp file as it
+    grows, so the first request streams while the bytes arrive and later ones
+    join the same download. It keeps going if the client that started it leaves.
+    """
+
+    def __init__(self):
+        self.ready: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.media_type: Optional[str] = None
+        self.path: Optional[str] = None
+        self.written = 0
+        self.finished = False
+        self.error: Optional[BaseException] = None
+        self._changed = asyncio.Event()
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def start(self, path: str, media_type: str):
+        self.path = path
+        self.media_type = media_type
+        if not self.ready.done():
+            self.ready.set_result(None)
+
+    def wrote(self, size: int):
+        self.written += size
+        self._notify()
+
+    def finish(self, path: str):
+        self.path = path
+        self.finished = True
+        self._notify()
+
+    def fail(self, error: BaseException):
+        self.error = error
+        if not self.ready.done():
+            self.ready.set_exception(error)
+            # nobody may be waiting on it
+            self.ready.exception()
+        self._notify()
+
+    async def wait(self):
+        """
+        Wait until the whole file is in the cache.
+        """
+        while not self.finished:
+            if self.error is not None:
+                raise CoverArtError("cover art download failed") from self.error
+            await self._changed.wait()
+
+    async def stream(self):
+        # opened once, the temp file may be renamed into place while this reads it
+        with open(self.path, "rb") as f:
+            sent = 0
+            while True:
+                changed = self._changed
+                if sent < self.written:
+                    chunk = await asyncio.to_thread(f.read, min(CHUNK_SIZE, self.written - sent))
+                    if not chunk:
+                        raise CoverArtError("cover art file ended early")
+                    sent += len(chunk)
+                    yield chunk
+                    continue
+                if self.error is not None:
+                    raise CoverArtError("cover art download failed") from self.error
+                if self.finished:
+                    return
+                await changed.wait()
+
+
+class ImageCache:
+    """
+    Disk cache for cover art bytes, files are <release_id>-<size>.<ext> in
+    `directory`. When the total goes over `max_bytes` the least recently used
+    files are removed until it is back under 90% of it. Hits touch the file's
+    mtime, so workers sharing the directory agree on what was used recently;
+    each one also sweeps it every now and then to account for the others' writes.
+    """
+
+    def __init__(self, directory: str, max_bytes: int, max_file_bytes: int, touch_interval: float = 60.0):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_file_bytes = max_file_bytes
+        self.touch_interval = touch_interval
+        # key -> (filename, size, last touched)
+        self._files: Dict[str, Tuple[str, int, float]] = {}
+        self._downloads: Dict[str, Download] = {}
+        self.total_bytes = 0
+        self.hits = 0
+        self.downloads = 0
+        self.joined = 0
+        self.bytes_written = 0
+        self.evictions = 0
+
+    async def init(self):
+        os.makedirs(self.directory, exist_ok=True)
+        await self.sweep()
+
+    def file_path(self, filename: str) -> str:
+        return os.path.join(self.directory, filename)
+
+    def _scan(self) -> list:
+        """
+        (mtime, key, filename, size) for every cached file, oldest first. Blocking.
+        """
+        files = []
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if entry.name.startswith(".tmp-"):
+                    # left over from a crash, or being written by another worker
+                    stat = entry.stat()
+                    if time.time() - stat.st_mtime > 3600:
+                        os.unlink(entry.path)
+                    continue
+                match = _image_name.match(entry.name)
+                if match is None:
+                    continue
+                stat = entry.stat()
+                files.append((stat.st_mtime, match.group(1), entry.name, stat.st_size))
+        files.sort()
+        return files
+
+    def _evict(self) -> Tuple[Dict[str, Tuple[str, int, float]], int, int]:
+        files = self._scan()
+        total = sum(size for _, _, _, size in files)
+        evicted = 0
+        if total > self.max_bytes:
+            target = self.max_bytes * 0.9
+            for mtime, key, filename, size in files:
+                if total <= target:
+                    break
+                try:
+                    os.unlink(self.file_path(filename))
+                except FileNotFoundError:
+                    pass
+                total -= size
+                evicted += 1
+            files = files[evicted:]
+        known = {key: (filename, size, mtime) for mtime, key, filename, size in files}
+        return known, total, evicted
+
+    async def sweep(self):
+        self._files, self.total_bytes, evicted = await asyncio.to_thread(self._evict)
+        self.evictions += evicted
+        if evicted:
+            logger.info(f"evicted {evicted} cover art files, {self.total_bytes} bytes cached")
+
+    async def run_sweeper(self, interval: float = 300.0):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.sweep()
+            except Exception as e:
+                logger.error(f"cover art cache sweep failed due to {e}", exc_info=True)
+
+    def get(self, key: str) -> Optional[Tuple[str, str]]:
+        """
+        (path, media type) of the cached image for `key`, if there is one.
+        """
+        known = self._files.get(key)
+        if known is None:
+            # maybe written by another worker since the last sweep
+            for ext in MEDIA_TYPES:
+                filename = f"{key}.{ext}"
+                if os.path.exists(self.file_path(filename)):
+                    known = (filename, os.path.getsize(self.file_path(filename)), 0.0)
+                    break
+            else:
+                return None
+
+        filename, size, touched = known
+        path = self.file_path(filename)
+        now = time.time()
+        if now - touched > self.touch_interval:
+            try:
+                os.utime(path)
+            except FileNotFoundError:
+                # evicted by another worker
+                self._files.pop(key, None)
+                return None
+            touched = now
+        self._files[key] = (filename, size, touched)
+        self.hits += 1
+        return path, MEDIA_TYPES[filename.rsplit(".", 1)[1]]
+
+    def fetch(self, key: str, url: str) -> Download:
+        """
+        Start downloading `url` into the cache, or join the download already running for `key`.
+        """
+        download = self._downloads.get(key)
+        if download is not None:
+            self.joined += 1
+            return download
+        download = self._downloads[key] = Download()
+        self.downloads += 1
+        task = asyncio.create_task(self._download(key, url, download), name=f"cover-art-{key}")
+        task.add_done_callback(lambda _: self._downloads.pop(key, None))
+        return download
+
+    async def _download(self, key: str, url: str, download: Download):
+        tmp_path = None
+        try:
+            host = urlparse(url).hostname
+            if not await rate_limiter.acquire(host):
+                raise CoverArtError(f"rate limit exceeded for {host}")
+
+            async with http_client.client.stream(
+                "GET", url, follow_redirects=True, timeout=http_client.timeout_for(host)
+            ) as response:
+                if response.status_code != 200:
+                    raise CoverArtError(f"cover art download failed with status {response.status_code}")
+                media_type = response.headers.get("content-type", "").split(";")[0].strip().lower()
+                ext = IMAGE_TYPES.get(media_type)
+                if ext is None:
+                    raise CoverArtError(f"cover art at {url} is {media_type or 'untyped'}, not an image")
+
+                fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=".tmp-")
+                with os.fdopen(fd, "wb") as f:
+                    download.start(tmp_path, media_type)
+                    async for chunk in response.aiter_bytes(CHUNK_SIZE):
+                        if download.written + len(chunk) > self.max_file_bytes:
+                            raise CoverArtError(f"cover art at {url} is over the size limit")
+                        await asyncio.to_thread(write_chunk, f, chunk)
+                        download.wrote(len(chunk))
+
+            filename = f"{key}.{ext}"
+            path = self.file_path(filename)
+            os.replace(tmp_path, path)
+            tmp_path = None
+            download.finish(path)
+        except CoverArtError as e:
+            logger.error(str(e))
+            download.fail(e)
+            return
+        except asyncio.CancelledError:
+            download.fail(CoverArtError("cover art download cancelled"))
+            raise
+        except Exception as e:
+            logger.error(f"cover art download of {url} failed due to {e}", exc_info=True)
+            download.fail(e)
+            return
+        finally:
+            if tmp_path is not None and os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+
+        self._files[key] = (filename, download.written, time.time())
+        self.total_bytes += download.written
+        self.bytes_written += download.written
+        if self.total_bytes > self.max_bytes:
+            await self.sweep()
+
+    def stats(self) -> dict:
+        return {
+            "files": len(self._files),
+            "bytes": self.total_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "downloads": self.downloads,
+            "joined": self.joined,
+            "downloading": len(self._downloads),
+            "bytes_written": self.bytes_written,
+            "evictions": self.evictions,
+        }
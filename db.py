@@ -0,0 +1,125 @@
+import asyncio
+import logging
+import time
+from typing import Dict, List, Optional
+
+import asyncpg
+import orjson
+from asyncpg.prepared_stmt import PreparedStatement
+
+logger = logging.getLogger(__name__)
+
+# hot statements, prepared on every new connection
+STATEMENTS: Dict[str, str] = {}
+
+
+def register_statement(name: str, query: str) -> str:
+    STATEMENTS[name] = query
+    return name
+
+
+def encode_json(value) -> str:
+    return orjson.dumps(value).decode()
+
+
+class Connection(asyncpg.Connection):
+    """
+    Pool connection that keeps the registered statements prepared.
+    """
+
+    __slots__ = ("_prepared",)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._prepared: Dict[str, PreparedStatement] = {}
+
+    async def prepare_registered(self):
+        for name, query in STATEMENTS.items():
+            try:
+                self._prepared[name] = await self.prepare(query)
+            except (asyncpg.UndefinedTableError, asyncpg.UndefinedColumnError):
+                # created later during startup, prepared on first use instead
+                pass
+
+    async def statement(self, name: str) -> PreparedStatement:
+        prepared = self._prepared.get(name)
+        if prepared is None:
+            prepared = self._prepared[name] = await self.prepare(STATEMENTS[name])
+        return prepared
+
+    async def fetch_prepared(self, name: str, *args) -> List[asyncpg.Record]:
+        try:
+            return await (await self.statement(name)).fetch(*args)
+        except asyncpg.InvalidCachedStatementError:
+            # the table changed under the statement, prepare it again
+            self._prepared.pop(name, None)
+            if self.is_in_transaction():
+                raise
+            return await (await self.statement(name)).fetch(*args)
+
+
+async def init_connection(con: Connection):
+    # json and jsonb columns take and return Python objects
+    for name in ("json", "jsonb"):
+        await con.set_type_codec(name, encoder=encode_json, decoder=orjson.loads, schema="pg_catalog")
+    await con.prepare_registered()
+
+
+INVALID_INDEX_QUERY = """
+    SELECT NOT indisvalid FROM pg_index WHERE indexrelid = to_regclass($1);
+"""
+
+
+async def create_index_concurrently(con, name: str, query: str, timeout: Optional[float]):
+    """
+    Build index `name` with `query` (a CREATE INDEX CONCURRENTLY IF NOT EXISTS)
+    outside the statement timeout. A build that failed or was cancelled leaves
+    an INVALID index that IF NOT EXISTS would skip forever, it is dropped and
+    built again. One worker builds, the others leave it to that one.
+    """
+    if not await con.fetchval("SELECT pg_try_advisory_lock(hashtext($1));", name):
+        return
+    try:
+        if await con.fetchval(INVALID_INDEX_QUERY, name):
+            logger.warning(f"rebuilding invalid index {name}")
+            await con.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name};", timeout=timeout)
+        await con.execute(query, timeout=timeout)
+    except (asyncio.TimeoutError, asyncpg.PostgresError) as e:
+        # the service works without it, only slower. The next start tries again
+        logger.error(f"could not create index {name}: {e!r}")
+    finally:
+        await con.execute("SELECT pg_advisory_unlock(hashtext($1));", name)
+
+
+async def check_database(pool, timeout: float, shed_saturation: float) -> dict:
+    """
+    Round trip a query and report pool usage. `healthy` is False when the ping
+    fails or times out, or when the pool is busier than `shed_saturation`.
+    """
+    size = pool.get_size()
+    idle = pool.get_idle_size()
+    max_size = pool.get_max_size()
+    saturation = (size - idle) / max_size if max_size else 0.0
+    result = {
+        "pool": {
+            "size": size,
+            "idle": idle,
+            "in_use": size - idle,
+            "max": max_size,
+            "waiting": pool.waiting,
+            "saturation": round(saturation, 3),
+        },
+    }
+
+    started = time.perf_counter()
+    try:
+        async with pool.acquire(timeout=timeout) as con:
+            await con.fetchval("SELECT 1;", timeout=timeout)
+        result["ping_ms"] = round((time.perf_counter() - started) * 1000, 2)
+    except (asyncio.TimeoutError, OSError, asyncpg.PostgresError, asyncpg.InterfaceError) as e:
+        logger.error(f"database ping failed: {e!r}")
+        result["ping_ms"] = None
+        result["error"] = type(e).__name__
+
+    result["healthy"] = result["ping_ms"] is not None and saturation < shed_saturation
+    return result
@@ -0,0 +1,275 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Dict, List, Set, Tuple
+
+from validation import AddMusicModel
+
+logger = logging.getLogger(__name__)
+
+CREATE_TABLE_QUERY = """
+    CREATE TABLE IF NOT EXISTS event_dedupe (
+        device text NOT NULL,
+        fingerprint text NOT NULL,
+        expires_at timestamptz NOT NULL,
+        PRIMARY KEY (device, fingerprint)
+    );
+"""
+
+# returns a row only if nobody holds a live claim on this fingerprint
+CLAIM_QUERY = """
+    INSERT INTO event_dedupe AS d (device, fingerprint, expires_at)
+    VALUES ($1, $2, now() + make_interval(secs => $3))
+    ON CONFLICT (device, fingerprint)
+    DO UPDATE SET expires_at = EXCLUDED.expires_at
+    WHERE d.expires_at < now()
+    RETURNING 1;
+"""
+
+# CLAIM_QUERY for many fingerprints at once, returns the ones claimed
+CLAIM_MANY_QUERY = """
+    INSERT INTO event_dedupe AS d (device, fingerprint, expires_at)
+    SELECT device, fingerprint, now() + make_interval(secs => window_secs)
+    FROM unnest($1::text[], $2::text[], $3::float8[]) AS t(device, fingerprint, window_secs)
+    ON CONFLICT (device, fingerprint)
+    DO UPDATE SET expires_at = EXCLUDED.expires_at
+    WHERE d.expires_at < now()
+    RETURNING device, fingerprint;
+"""
+
+# moves the end of the window, e.g. after a pause, whoever holds the claim
+REFRESH_MANY_QUERY = """
+    INSERT INTO event_dedupe AS d (device, fingerprint, expires_at)
+    SELECT device, fingerprint, now() + make_interval(secs => window_secs)
+    FROM unnest($1::text[], $2::text[], $3::float8[]) AS t(device, fingerprint, window_secs)
+    ON CONFLICT (device, fingerprint)
+    DO UPDATE SET expires_at = EXCLUDED.expires_at;
+"""
+
+# releases claims of events that were not stored after all
+RELEASE_MANY_QUERY = """
+    DELETE FROM event_dedupe
+    WHERE (device, fingerprint) IN (SELECT * FROM unnest($1::text[], $2::text[]));
+"""
+
+
+def fingerprint(data: AddMusicModel) -> str:
+    # playback state is left out, pausing and resuming is the same play
+    return f"{data.title}-{data.artist}-{data.album}"
+
+
+class DedupeWindow:
+    """
+    Per device record of recently seen events. An event is redundant while the
+    same fingerprint from the same device is inside its window, which lasts until
+    the track would have finished playing (clamped to min/max_window). A replay
+    after that counts as a new play. A repeat moves the end of the window to
+    where the track now finishes, so resuming after a long pause is not a new
+    play. The shared copy is only rewritten when the end moves by more than
+    `refresh_tolerance` seconds, regular progress updates don't touch it.
+    Optionally backed by the `event_dedupe` table so every worker agrees.
+    """
+
+    def __init__(
+        self,
+        pool=None,
+        max_devices: int = 1000,
+        max_per_device: int = 64,
+        min_window: float = 30,
+        max_window: float = 3600,
+        refresh_tolerance: float = 5,
+    ):
+        self._pool = pool
+        self._devices: OrderedDict = OrderedDict()
+        self.max_devices = max_devices
+        self.max_per_device = max_per_device
+        self.min_window = min_window
+        self.max_window = max_window
+        self.refresh_tolerance = refresh_tolerance
+        self.duplicates = 0
+        self.accepted = 0
+
+    async def init(self):
+        if self._pool is None:
+            return
+        async with self._pool.acquire() as con:
+            await con.execute(CREATE_TABLE_QUERY)
+
+    def window(self, data: AddMusicModel) -> float:
+        remaining = (data.duration or 0) - (data.elapsed or 0)
+        return min(self.max_window, max(self.min_window, remaining))
+
+    def _recent(self, device: str) -> OrderedDict:
+        recent = self._devices.get(device)
+        if recent is None:
+            recent = self._devices[device] = OrderedDict()
+            while len(self._devices) > self.max_devices:
+                self._devices.popitem(last=False)
+        else:
+            self._devices.move_to_end(device)
+        return recent
+
+    async def _claim_shared(self, device: str, key: str, window: float) -> bool:
+        try:
+            async with self._pool.acquire() as con:
+                return await con.fetchval(CLAIM_QUERY, device, key, window) is not None
+        except Exception as e:
+            logger.error(f"shared dedupe check failed, using local state: {e}")
+            return True
+
+    async def _claim_shared_many(self, claims: Dict[Tuple[str, str], float]) -> Set[Tuple[str, str]]:
+        try:
+            async with self._pool.acquire() as con:
+                rows = await con.fetch(
+                    CLAIM_MANY_QUERY,
+                    [device for device, _ in claims],
+                    [key for _, key in claims],
+                    list(claims.values()),
+                )
+        except Exception as e:
+            logger.error(f"shared dedupe check failed, using local state: {e}")
+            return set(claims)
+        return {(row["device"], row["fingerprint"]) for row in rows}
+
+    async def _refresh_shared(self, refreshes: Dict[Tuple[str, str], float]):
+        try:
+            async with self._pool.acquire() as con:
+                await con.execute(
+                    REFRESH_MANY_QUERY,
+                    [device for device, _ in refreshes],
+                    [key for _, key in refreshes],
+                    list(refreshes.values()),
+                )
+        except Exception as e:
+            logger.error(f"shared dedupe refresh failed: {e}")
+
+    def _extend(self, recent: OrderedDict, key: str, expires_at: float) -> bool:
+        """
+        Move the end of the window of a repeated event, True if the shared copy should follow.
+        """
+        moved = abs(recent[key] - expires_at) > self.refresh_tolerance
+        recent[key] = expires_at
+        recent.move_to_end(key)
+        return moved
+
+    def _remember(self, recent: OrderedDict, key: str, expires_at: float):
+        recent[key] = expires_at
+        recent.move_to_end(key)
+        while len(recent) > self.max_per_device:
+            recent.popitem(last=False)
+
+    async def seen(self, data: AddMusicModel) -> bool:
+        """
+        True if `data` repeats an event still inside its window, otherwise record it and return False.
+        """
+        device = data.deviceName or ""
+        key = fingerprint(data)
+        now = time.monotonic()
+
+        recent = self._recent(device)
+        expires_at = recent.get(key)
+        window = self.window(data)
+        if expires_at is not None and expires_at > now:
+            if self._extend(recent, key, now + window) and self._pool is not None:
+                await self._refresh_shared({(device, key): window})
+            self.duplicates += 1
+            return True
+
+        if self._pool is not None and not await self._claim_shared(device, key, window):
+            # another worker saw it first, remember it here too
+            self._remember(recent, key, now + window)
+            await self._refresh_shared({(device, key): window})
+            self.duplicates += 1
+            return True
+
+        self._remember(recent, key, now + window)
+        self.accepted += 1
+        return False
+
+    async def seen_many(self, items: List[AddMusicModel]) -> List[bool]:
+        """
+        `seen` for a whole batch, in order, with one shared claim for all of it.
+        """
+        now = time.monotonic()
+        results = [False] * len(items)
+        # first index and window of every fingerprint that is new to this worker
+        candidates: Dict[Tuple[str, str], Tuple[int, float]] = {}
+        # windows of repeats whose end moved, the latest event of a fingerprint wins
+        refreshes: Dict[Tuple[str, str], float] = {}
+        for index, data in enumerate(items):
+            device = data.deviceName or ""
+            key = fingerprint(data)
+            recent = self._recent(device)
+            expires_at = recent.get(key)
+            window = self.window(data)
+            if expires_at is not None and expires_at > now:
+                if self._extend(recent, key, now + window) or (device, key) in refreshes:
+                    refreshes[(device, key)] = window
+                results[index] = True
+                continue
+            self._remember(recent, key, now + window)
+            candidates[(device, key)] = (index, window)
+
+        if self._pool is not None and candidates:
+            claimed = await self._claim_shared_many({claim: window for claim, (_, window) in candidates.items()})
+            for claim, (index, window) in candidates.items():
+                # another worker saw it first, it stays remembered here too
+                if claim not in claimed:
+                    results[index] = True
+                    refreshes.setdefault(claim, window)
+        if self._pool is not None and refreshes:
+            await self._refresh_shared(refreshes)
+
+        duplicates = sum(results)
+        self.duplicates += duplicates
+        self.accepted += len(items) - duplicates
+        return results
+
+    async def forget(self, items: List[AddMusicModel]):
+        """
+        Undo `seen`/`seen_many` for accepted events that could not be stored,
+        so the client's retry counts as the play instead of a duplicate.
+        """
+        claims = {(data.deviceName or "", fingerprint(data)) for data in items}
+        for device, key in claims:
+            recent = self._devices.get(device)
+            if recent is not None:
+                recent.pop(key, None)
+        self.accepted -= len(items)
+        if self._pool is None or not claims:
+            return
+        try:
+            async with self._pool.acquire() as con:
+                await con.execute(
+                    RELEASE_MANY_QUERY,
+                    [device for device, _ in claims],
+                    [key for _, key in claims],
+                )
+        except Exception as e:
+            # the claim runs out with its window
+            logger.error(f"failed to release dedupe claims: {e}")
+
+    async def prune(self):
+        now = time.monotonic()
+        for recent in self._devices.values():
+            for key in [key for key, expires_at in recent.items() if expires_at <= now]:
+                del recent[key]
+        if self._pool is not None:
+            async with self._pool.acquire() as con:
+                await con.execute("DELETE FROM event_dedupe WHERE expires_at < now();")
+
+    async def run_pruner(self, interval: float = 300.0):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.prune()
+            except Exception as e:
+                logger.error(f"dedupe prune failed due to {e}", exc_info=True)
+
+    def stats(self) -> dict:
+        return {
+            "devices": len(self._devices),
+            "accepted": self.accepted,
+            "duplicates": self.duplicates,
+        }
@@ -1,44 +1,271 @@
-from fastapi.responses import JSONResponse
-from fastapi_mail import ConnectionConfig, FastMail, MessageSchema
-from settings import (
-    EMAIL_USER,
-    EMAIL_PASS,
-    EMAIL_FROM,
-    EMAIL_PORT,
-    EMAIL_SERVER,
-)
-
-
-def init_fastmail():
+import asyncio
+import logging
+import random
+import time
+from email.message import EmailMessage
+from typing import List, Optional
+
+import aiosmtplib
+from asyncpg import Record
+from fastapi import Request
+from fastapi.responses import ORJSONResponse
+
+from rate_limiter import TokenBucket
+from validation import EmailRequest
+
+logger = logging.getLogger(__name__)
+
+CREATE_TABLE_QUERY = """
+    CREATE TABLE IF NOT EXISTS email_outbox (
+        id bigserial PRIMARY KEY,
+        recipient text NOT NULL,
+        subject text NOT NULL,
+        body text NOT NULL,
+        subtype text NOT NULL DEFAULT 'html',
+        status text NOT NULL DEFAULT 'pending',
+        attempts integer NOT NULL DEFAULT 0,
+        next_attempt_at timestamptz NOT NULL DEFAULT now(),
+        last_error text,
+        created timestamptz NOT NULL DEFAULT now(),
+        sent_at timestamptz
+    );
+    CREATE INDEX IF NOT EXISTS email_outbox_due_idx ON email_outbox (next_attempt_at) WHERE status = 'pending';
+"""
+
+ENQUEUE_QUERY = """
+    INSERT INTO email_outbox (recipient, subject, body, subtype) VALUES ($1, $2, $3, $4) RETURNING id;
+"""
+
+# claimed rows are pushed `lease` seconds into the future, so a sender that dies
+# mid batch leaves them to be retried instead of stuck
+CLAIM_QUERY = """
+    UPDATE email_outbox SET attempts = attempts + 1, next_attempt_at = now() + make_interval(secs => $2)
+    WHERE id IN (
+        SELECT id FROM email_outbox
+        WHERE status = 'pending' AND next_attempt_at <= now()
+        ORDER BY next_attempt_at
+        LIMIT $1
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING id, recipient, subject, body, subtype, attempts;
+"""
+
+SENT_QUERY = """
+    UPDATE email_outbox SET status = 'sent', sent_at = now(), last_error = NULL WHERE id = $1;
+"""
+
+RETRY_QUERY = """
+    UPDATE email_outbox SET next_attempt_at = now() + make_interval(secs => $2), last_error = $3 WHERE id = $1;
+"""
+
+FAILED_QUERY = """
+    UPDATE email_outbox SET status = 'failed', last_error = $2 WHERE id = $1;
+"""
+
+
+class EmailOutbox:
     """
-    Initialize FastMail with the configuration.
+    Postgres backed outbox for outgoing mail. `enqueue` only inserts a row; a
+    background sender claims due rows in batches, sends them over one SMTP
+    session that is kept open between batches, and retries transient failures
+    with exponential backoff. Sending is capped at `rate` messages per second.
+    Delivery is at least once: a crash between sending and marking a row sent
+    sends it again after the lease.
     """
-    conf = ConnectionConfig(
-        MAIL_USERNAME=EMAIL_USER,
-        MAIL_PASSWORD=EMAIL_PASS,
-        MAIL_FROM=EMAIL_FROM,
-        MAIL_PORT=EMAIL_PORT,
-        MAIL_SERVER=EMAIL_SERVER,
-        MAIL_STARTTLS=True,
-        MAIL_SSL_TLS=False,
-    )
-    return FastMail(conf)
 
-async def send_email(email: str, subject: str, body: str):
+    def __init__(
+        self,
+        pool,
+        sender: str,
+        smtp: dict,
+        batch_size: int = 20,
+        max_attempts: int = 8,
+        backoff_base: float = 30.0,
+        backoff_max: float = 3600.0,
+        rate: float = 1.0,
+        burst: int = 10,
+        idle_timeout: float = 60.0,
+        poll_interval: float = 5.0,
+        lease: float = 300.0,
+        limiter_pool=None,
+    ):
+        self._pool = pool
+        self.sender = sender
+        self._smtp_options = smtp
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.idle_timeout = idle_timeout
+        self.poll_interval = poll_interval
+        self.lease = lease
+        self._bucket = TokenBucket("smtp", rate, burst, limiter_pool)
+        self._smtp: Optional[aiosmtplib.SMTP] = None
+        self._last_used = 0.0
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self.enqueued = 0
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+        self.sessions = 0
+
+    async def init(self):
+        async with self._pool.acquire() as con:
+            await con.execute(CREATE_TABLE_QUERY)
+
+    async def enqueue(self, recipient: str, subject: str, body: str, subtype: str = "html") -> int:
+        async with self._pool.acquire() as con:
+            message_id = await con.fetchval(ENQUEUE_QUERY, recipient, subject, body, subtype)
+        self.enqueued += 1
+        self._wake.set()
+        return message_id
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="email-outbox")
+            self._task.add_done_callback(self._on_done)
+
+    def _on_done(self, task: asyncio.Task):
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("email outbox sender stopped", exc_info=task.exception())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self._disconnect()
+
+    async def _run(self):
+        while True:
+            try:
+                rows = await self._claim()
+            except Exception as e:
+                logger.error(f"failed to claim outbox messages due to {e}", exc_info=True)
+                rows = []
+
+            if rows:
+                try:
+                    await self._send_batch(rows)
+                except Exception as e:
+                    # the rows not marked yet are retried after the lease
+                    logger.error(f"failed to send outbox batch due to {e}", exc_info=True)
+                    await self._disconnect()
+                    await asyncio.sleep(self.poll_interval)
+                continue
+
+            if self._smtp is not None and time.monotonic() - self._last_used > self.idle_timeout:
+                await self._disconnect()
+            self._wake.clear()
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _claim(self) -> List[Record]:
+        async with self._pool.acquire() as con:
+            return await con.fetch(CLAIM_QUERY, self.batch_size, float(self.lease))
+
+    async def _connection(self) -> aiosmtplib.SMTP:
+        if self._smtp is not None and self._smtp.is_connected:
+            if time.monotonic() - self._last_used <= self.idle_timeout:
+                return self._smtp
+            await self._disconnect()
+        smtp = aiosmtplib.SMTP(**self._smtp_options)
+        await smtp.connect()
+        self._smtp = smtp
+        self.sessions += 1
+        return smtp
+
+    async def _disconnect(self):
+        smtp, self._smtp = self._smtp, None
+        if smtp is None or not smtp.is_connected:
+            return
+        try:
+            await smtp.quit()
+        except aiosmtplib.SMTPException:
+            smtp.close()
+
+    def build_message(self, row: Record) -> EmailMessage:
+        message = EmailMessage()
+        message["From"] = self.sender
+        message["To"] = row["recipient"]
+        message["Subject"] = row["subject"]
+        message.set_content(row["body"], subtype=row["subtype"])
+        return message
+
+    async def _send_batch(self, rows: List[Record]):
+        for row in rows:
+            if row["attempts"] > self.max_attempts:
+                # claimed again after leases ran out, e.g. the sender kept dying on it
+                await self._failed(row, "lease expired too often", permanent=True)
+                continue
+            try:
+                message = self.build_message(row)
+            except Exception as e:
+                await self._failed(row, f"invalid message: {e!r}", permanent=True)
+                continue
+
+            await self._bucket.acquire()
+            try:
+                smtp = await self._connection()
+                await smtp.send_message(message)
+                self._last_used = time.monotonic()
+            except aiosmtplib.SMTPResponseException as e:
+                # 5xx is permanent for this message, anything else is worth another try
+                await self._failed(row, f"{e.code} {e.message}", permanent=500 <= e.code < 600)
+                continue
+            except (aiosmtplib.SMTPException, OSError, asyncio.TimeoutError) as e:
+                await self._disconnect()
+                await self._failed(row, repr(e), permanent=False)
+                continue
+            except Exception as e:
+                # not a delivery problem, trying again would fail the same way
+                logger.error(f"unexpected error sending email {row['id']}", exc_info=True)
+                await self._disconnect()
+                await self._failed(row, repr(e), permanent=True)
+                continue
+            await self._mark(SENT_QUERY, row["id"])
+            self.sent += 1
+
+    async def _failed(self, row: Record, error: str, permanent: bool):
+        if permanent or row["attempts"] >= self.max_attempts:
+            logger.error(f"giving up on email {row['id']} after {row['attempts']} attempts: {error}")
+            await self._mark(FAILED_QUERY, row["id"], error)
+            self.failed += 1
+            return
+        delay = min(self.backoff_max, self.backoff_base * 2 ** (row["attempts"] - 1))
+        delay *= random.uniform(0.8, 1.2)
+        logger.warning(f"email {row['id']} failed, retrying in {delay:.0f}s: {error}")
+        await self._mark(RETRY_QUERY, row["id"], delay, error)
+        self.retried += 1
+
+    async def _mark(self, query: str, *args):
+        try:
+            async with self._pool.acquire() as con:
+                await con.execute(query, *args)
+        except Exception as e:
+            # the lease runs out and the message is picked up again
+            logger.error(f"failed to update outbox message {args[0]} due to {e}", exc_info=True)
+
+    def stats(self) -> dict:
+        return {
+            "enqueued": self.enqueued,
+            "sent": self.sent,
+            "retried": self.retried,
+            "failed": self.failed,
+            "sessions": self.sessions,
+            "connected": self._smtp is not None and self._smtp.is_connected,
+        }
+
+
+async def send_email(request: Request, data: EmailRequest):
     """
-    Send an email using FastMail.
+    Queue an email in the outbox, it is sent in the background.
     """
-    fm:FastMail = init_fastmail()
-    message = {
-        "subject": subject,
-        "recipients": [email],
-        "body": body,
-        "subtype": "html",
-    }
-    schema =  MessageSchema(
-        **message,
-    )
-    response = await fm.send_message(schema)
-    print(response)
-    return JSONResponse(content={"message": "Message sent successfully"}, status_code=200)
-    
\ No newline at end of file
+    message_id = await request.app.outbox.enqueue(data.email, data.subject, data.body)
+    return ORJSONResponse(content={"message": "Message queued", "id": message_id}, status_code=202)
@@ -0,0 +1,108 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, List
+
+logger = logging.getLogger(__name__)
+
+
+class EnrichmentQueue:
+    """
+    Bounded in-process work queue drained by a fixed number of async workers.
+    `put` waits for room in the queue and returns False once it is closing.
+    """
+
+    def __init__(
+        self,
+        handler: Callable[[Any], Awaitable[None]],
+        workers: int = 4,
+        maxsize: int = 1000,
+        throughput_window: int = 60,
+    ):
+        self._handler = handler
+        self._workers = max(1, workers)
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self._tasks: List[asyncio.Task] = []
+        self._closing = False
+        self._window = throughput_window
+        self._completed_at: deque = deque(maxlen=10000)
+        self.in_flight = 0
+        self.processed = 0
+        self.failed = 0
+        self.rejected = 0
+
+    def start(self):
+        if self._tasks:
+            return
+        self._closing = False
+        for n in range(self._workers):
+            self._tasks.append(asyncio.create_task(self._run(n), name=f"enrichment-{n}"))
+        logger.info(f"enrichment queue started with {self._workers} workers")
+
+    def room(self) -> int:
+        """
+        Free slots in the queue, -1 if it is unbounded.
+        """
+        if self._queue.maxsize <= 0:
+            return -1
+        return max(0, self._queue.maxsize - self._queue.qsize())
+
+    async def put(self, item: Any) -> bool:
+        if self._closing or not self._tasks:
+            self.rejected += 1
+            return False
+        await self._queue.put(item)
+        return True
+
+    async def _run(self, n: int):
+        while True:
+            item = await self._queue.get()
+            self.in_flight += 1
+            try:
+                await self._handler(item)
+                self.processed += 1
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"enrichment worker {n} failed due to {e}", exc_info=True)
+            finally:
+                self.in_flight -= 1
+                self._completed_at.append(time.monotonic())
+                self._queue.task_done()
+
+    async def stop(self, timeout: float = 10.0):
+        """
+        Stop accepting work, wait up to `timeout` seconds for queued items, then cancel the workers.
+        """
+        self._closing = True
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout=timeout)
+        except asyncio.TimeoutError:
+            # the pending rows stay in the table and are claimed again once their lease runs out
+            logger.warning(f"enrichment queue drain timed out, dropping {self._queue.qsize()} items")
+
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        logger.info("enrichment queue stopped")
+
+    def throughput(self) -> float:
+        """
+        Completed items per second over the last `throughput_window` seconds.
+        """
+        cutoff = time.monotonic() - self._window
+        recent = sum(1 for t in self._completed_at if t >= cutoff)
+        return recent / self._window
+
+    def stats(self) -> dict:
+        return {
+            "depth": self._queue.qsize(),
+            "maxsize": self._queue.maxsize,
+            "workers": self._workers,
+            "in_flight": self.in_flight,
+            "processed": self.processed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "throughput": round(self.throughput(), 3),
+        }
@@ -0,0 +1,85 @@
+import logging
+from typing import Dict, Optional
+from urllib.parse import urlparse
+
+import httpx
+
+from settings import (
+    APP_NAME,
+    COVERT_ART_ARCHIVE_BASE_URL,
+    HTTP_CONNECT_TIMEOUT,
+    HTTP_KEEPALIVE_EXPIRY,
+    HTTP_MAX_CONNECTIONS,
+    HTTP_MAX_KEEPALIVE_CONNECTIONS,
+    HTTP_READ_TIMEOUT,
+    MUSICBRAINZ_BASE_URL,
+    OPENWEATHER_API_URL,
+    THE_LAST_FM_BASE_URL,
+)
+
+logger = logging.getLogger(__name__)
+
+# per host (connect, read) timeouts in seconds, anything else uses the defaults
+host_timeouts = {
+    urlparse(THE_LAST_FM_BASE_URL).hostname: (HTTP_CONNECT_TIMEOUT, 5.0),
+    urlparse(MUSICBRAINZ_BASE_URL).hostname: (HTTP_CONNECT_TIMEOUT, 5.0),
+    urlparse(COVERT_ART_ARCHIVE_BASE_URL).hostname: (HTTP_CONNECT_TIMEOUT, 10.0),
+    urlparse(OPENWEATHER_API_URL).hostname: (HTTP_CONNECT_TIMEOUT, 5.0),
+}
+
+
+class HttpClient:
+    """
+    Shared async HTTP client for upstream APIs.
+    Connections are pooled per host and kept alive between calls.
+    """
+
+    def __init__(self):
+        self._client: Optional[httpx.AsyncClient] = None
+        self._timeouts: Dict[str, httpx.Timeout] = {
+            host: httpx.Timeout(read, connect=connect)
+            for host, (connect, read) in host_timeouts.items()
+            if host
+        }
+        self._default_timeout = httpx.Timeout(HTTP_READ_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT)
+
+    async def start(self):
+        if self._client is not None:
+            return
+        self._client = httpx.AsyncClient(
+            http1=True,
+            http2=False,
+            limits=httpx.Limits(
+                max_connections=HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+            ),
+            timeout=self._default_timeout,
+            # the Cover Art Archive answers /release/{mbid} with a redirect to archive.org
+            follow_redirects=True,
+            headers={"User-Agent": f"{APP_NAME}/1.0"},
+        )
+        logger.info("http client started")
+
+    async def close(self):
+        if self._client is None:
+            return
+        await self._client.aclose()
+        self._client = None
+        logger.info("http client closed")
+
+    def timeout_for(self, host: Optional[str]) -> httpx.Timeout:
+        return self._timeouts.get(host, self._default_timeout)
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            raise RuntimeError("http client is not started")
+        return self._client
+
+    async def request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        kwargs.setdefault("timeout", self.timeout_for(urlparse(url).hostname))
+        return await self.client.request(method, url, **kwargs)
+
+
+http_client = HttpClient()
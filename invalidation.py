@@ -0,0 +1,133 @@
+import asyncio
+import json
+import logging
+import uuid
+from typing import Awaitable, Callable, List, Optional
+
+from cache import InMemoryCache
+from singleflight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+
+class CacheInvalidator:
+    """
+    Propagate cache invalidations between worker processes with Postgres LISTEN/NOTIFY.
+    Every worker keeps one dedicated listener connection from the pool and applies
+    the invalidations published by the other workers to its own InMemoryCache.
+    Computations in flight for an invalidated key are forgotten as well, so they
+    can't write their stale result back into the cache.
+    """
+
+    def __init__(
+        self,
+        pool,
+        cache: InMemoryCache,
+        flights: Optional[SingleFlight] = None,
+        channel: str = "cache_invalidation",
+    ):
+        self._pool = pool
+        self._cache = cache
+        self._flights = flights
+        self.channel = channel
+        self.origin = uuid.uuid4().hex
+        self._con = None
+        self._closing = False
+        self._reconnect: Optional[asyncio.Task] = None
+        self._hooks: List[Callable[[str, bool], Awaitable[None]]] = []
+        self.published = 0
+        self.received = 0
+
+    def add_hook(self, hook: Callable[[str, bool], Awaitable[None]]):
+        """
+        Run `hook(key, prefix)` after an invalidation from another worker was applied.
+        """
+        self._hooks.append(hook)
+
+    async def start(self):
+        self._closing = False
+        self._con = await self._pool.acquire()
+        await self._con.add_listener(self.channel, self._on_notify)
+        self._con.add_termination_listener(self._on_terminate)
+        logger.info(f"listening for cache invalidations on {self.channel}")
+
+    async def stop(self):
+        self._closing = True
+        if self._reconnect is not None:
+            self._reconnect.cancel()
+        if self._con is None:
+            return
+        try:
+            await self._con.remove_listener(self.channel, self._on_notify)
+            await self._pool.release(self._con)
+        except Exception as e:
+            logger.error(f"failed to release invalidation listener due to {e}")
+        self._con = None
+
+    def _on_terminate(self, con):
+        if self._closing:
+            return
+        logger.error("cache invalidation listener connection lost, reconnecting")
+        self._con = None
+        # anything published while we were away is lost, so start from an empty cache
+        self._apply("", prefix=True)
+        self._reconnect = asyncio.get_running_loop().create_task(self._reconnect_loop(con))
+
+    async def _reconnect_loop(self, con):
+        try:
+            await self._pool.release(con)
+        except Exception:
+            pass
+        delay = 1
+        while not self._closing:
+            try:
+                await self.start()
+                return
+            except Exception as e:
+                logger.error(f"invalidation listener reconnect failed due to {e}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 30)
+
+    def _on_notify(self, con, pid, channel, payload):
+        try:
+            message = json.loads(payload)
+        except json.JSONDecodeError:
+            logger.error(f"invalid cache invalidation payload {payload}")
+            return
+        if message.get("origin") == self.origin:
+            return
+
+        self.received += 1
+        key = message.get("key", "")
+        prefix = bool(message.get("prefix"))
+        self._apply(key, prefix)
+        for hook in self._hooks:
+            asyncio.get_running_loop().create_task(hook(key, prefix))
+
+    def _apply(self, key: str, prefix: bool):
+        if prefix:
+            self._cache.delete_prefix(key)
+        else:
+            self._cache.delete(key)
+        if self._flights is not None:
+            self._flights.forget(key, prefix)
+
+    async def invalidate(self, key: str, prefix: bool = False):
+        """
+        Invalidate `key` (or every key starting with it) locally and in every other worker.
+        """
+        self._apply(key, prefix)
+        payload = json.dumps({"origin": self.origin, "key": key, "prefix": prefix})
+        try:
+            async with self._pool.acquire() as con:
+                await con.execute("SELECT pg_notify($1, $2);", self.channel, payload)
+            self.published += 1
+        except Exception as e:
+            logger.error(f"failed to publish cache invalidation for {key} due to {e}", exc_info=True)
+
+    def stats(self) -> dict:
+        return {
+            "listening": self._con is not None,
+            "published": self.published,
+            "received": self.received,
+        }
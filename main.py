@@ -1,11 +1,14 @@
 import os
 from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
 from fastapi.staticfiles import StaticFiles
 from starlette.exceptions import HTTPException
 from starlette.middleware.cors import CORSMiddleware
 
+from artwork import ARTWORK_DIR, ArtworkFiles
 from config import AuthMiddleware, generic_error_handler, http_error_handler, lifespan
-from settings import BASE_ROUTE, STATIC_DIR
+from metrics import MetricsMiddleware
+from settings import ARTWORK_VARIANT_SIZES, BASE_ROUTE, STATIC_DIR
 from routes import api_v1
 
 
@@ -17,9 +20,18 @@ def get_app() -> FastAPI:
         title="Events service API documentation",
         version="1.0.0",
         lifespan=lifespan,
+        default_response_class=ORJSONResponse,
     )
     
     os.makedirs(STATIC_DIR, exist_ok=True)
+    artwork_dir = os.path.join(STATIC_DIR, ARTWORK_DIR)
+    os.makedirs(artwork_dir, exist_ok=True)
+    # must be mounted before /static so it takes precedence
+    app.mount(
+        f"/static/{ARTWORK_DIR}",
+        ArtworkFiles(directory=artwork_dir, sizes=ARTWORK_VARIANT_SIZES),
+        name="artwork",
+    )
     app.mount("/static", StaticFiles(directory=STATIC_DIR), name="static")
 
     origins = [
@@ -36,6 +48,8 @@ def get_app() -> FastAPI:
         allow_headers=["*"],
     )
     app.add_middleware(AuthMiddleware)
+    # outermost, so rejected and failed requests are timed too
+    app.add_middleware(MetricsMiddleware)
 
     app.add_exception_handler(HTTPException, http_error_handler)
     app.add_exception_handler(Exception, generic_error_handler)
@@ -0,0 +1,120 @@
+import copy
+import logging
+import re
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+CREATE_TABLE_QUERY = """
+    CREATE TABLE IF NOT EXISTS track_metadata (
+        key text PRIMARY KEY,
+        title text NOT NULL,
+        artist text NOT NULL,
+        found boolean NOT NULL,
+        data jsonb,
+        expires_at timestamptz NOT NULL,
+        updated timestamptz NOT NULL DEFAULT now()
+    );
+"""
+
+_whitespace = re.compile(r"\s+")
+
+
+def normalize_key(title: str, artist: str) -> str:
+    title = _whitespace.sub(" ", (title or "").strip().casefold())
+    artist = _whitespace.sub(" ", (artist or "").strip().casefold())
+    return f"{artist}\x1f{title}"
+
+
+class TrackMetadataCache:
+    """
+    Two tier cache for track lookups: an in-process LRU in front of the
+    `track_metadata` table, which is shared by every worker and survives restarts.
+    Misses are cached too (data is None) with a shorter TTL. Callers get their
+    own copy of the data, so changing it doesn't change the cached entry.
+    """
+
+    def __init__(self, pool, max_entries: int = 10000, ttl: int = 604800, negative_ttl: int = 86400):
+        self._pool = pool
+        self._local: OrderedDict = OrderedDict()
+        self._max_entries = max_entries
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.hits = 0
+        self.misses = 0
+
+    async def init(self):
+        async with self._pool.acquire() as con:
+            await con.execute(CREATE_TABLE_QUERY)
+
+    def _remember(self, key: str, data: Optional[dict], expire_at: float):
+        self._local[key] = (data, expire_at)
+        self._local.move_to_end(key)
+        while len(self._local) > self._max_entries:
+            self._local.popitem(last=False)
+
+    async def get(self, title: str, artist: str) -> Tuple[bool, Optional[dict]]:
+        """
+        Returns (hit, data). A hit with data None is a cached miss.
+        """
+        key = normalize_key(title, artist)
+        now = time.time()
+
+        item = self._local.get(key)
+        if item is not None:
+            if item[1] > now:
+                self._local.move_to_end(key)
+                self.hits += 1
+                return True, copy.deepcopy(item[0])
+            self._local.pop(key, None)
+
+        query = """
+            SELECT found, data, extract(epoch from expires_at) AS expire_at
+            FROM track_metadata
+            WHERE key = $1 AND expires_at > now();
+        """
+        try:
+            async with self._pool.acquire() as con:
+                row = await con.fetchrow(query, key)
+        except Exception as e:
+            logger.error(f"metadata cache read failed due to {e}", exc_info=True)
+            row = None
+
+        if row is None:
+            self.misses += 1
+            return False, None
+
+        data = row["data"] if row["found"] else None
+        self._remember(key, data, float(row["expire_at"]))
+        self.hits += 1
+        return True, copy.deepcopy(data)
+
+    async def set(self, title: str, artist: str, data: Optional[dict]):
+        key = normalize_key(title, artist)
+        ttl = self.ttl if data is not None else self.negative_ttl
+        self._remember(key, copy.deepcopy(data), time.time() + ttl)
+
+        query = """
+            INSERT INTO track_metadata (key, title, artist, found, data, expires_at)
+            VALUES ($1, $2, $3, $4, $5, now() + make_interval(secs => $6))
+            ON CONFLICT (key)
+            DO UPDATE SET found = $4, data = $5, expires_at = now() + make_interval(secs => $6), updated = now();
+        """
+        try:
+            async with self._pool.acquire() as con:
+                await con.execute(
+                    query,
+                    key,
+                    title,
+                    artist,
+                    data is not None,
+                    data,
+                    float(ttl),
+                )
+        except Exception as e:
+            logger.error(f"metadata cache write failed due to {e}", exc_info=True)
+
+    def stats(self) -> dict:
+        return {"entries": len(self._local), "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,267 @@
+import bisect
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+# everything runs on the event loop thread, so plain ints and lists are enough: no locks,
+# and nothing is formatted until /metrics is scraped
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values: Dict[Tuple, float] = {}
+
+    def inc(self, *labels, amount: float = 1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for labels, value in self.values.items():
+            lines.append(f"{self.name}{_labels(self.labels, labels)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # labels -> [per bucket counts..., +Inf count, sum]
+        self.values: Dict[Tuple, List[float]] = {}
+
+    def observe(self, value: float, *labels):
+        series = self.values.get(labels)
+        if series is None:
+            series = self.values[labels] = [0] * (len(self.buckets) + 2)
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, series in self.values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                le = 'le="%s"' % bound
+                lines.append(f"{self.name}_bucket{_labels(self.labels, labels, le)} {cumulative}")
+            cumulative += series[len(self.buckets)]
+            le = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{_labels(self.labels, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labels, labels)} {series[-1]}")
+            lines.append(f"{self.name}_count{_labels(self.labels, labels)} {cumulative}")
+        return lines
+
+
+class Registry:
+    """
+    Holds the metrics and the callbacks that read gauges from app state at scrape time.
+    A collector returns (name, help, type, [(labels dict, value), ...]) tuples.
+    """
+
+    def __init__(self):
+        self._metrics: List = []
+        self._collectors: List[Callable[[], Iterable[Tuple[str, str, str, Iterable[Tuple[dict, float]]]]]] = []
+
+    def counter(self, name: str, help: str, labels: Sequence[str] = ()) -> Counter:
+        metric = Counter(name, help, labels)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        metric = Histogram(name, help, labels, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector: Callable):
+        self._collectors.append(collector)
+
+    def clear_collectors(self):
+        self._collectors = []
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for collector in self._collectors:
+            for name, help, kind, samples in collector():
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    lines.append(f"{name}{_labels(list(labels), list(labels.values()))} {value}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+http_request_duration = registry.histogram(
+    "http_request_duration_seconds", "Request latency by route", ("method", "route", "status")
+)
+upstream_request_duration = registry.histogram(
+    "upstream_request_duration_seconds", "Upstream API latency by host and outcome", ("host", "outcome")
+)
+db_acquire_duration = registry.histogram(
+    "db_pool_acquire_seconds",
+    "Time spent waiting for a database connection",
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0),
+)
+enrichment_results = registry.counter(
+    "enrichment_total", "Track lookups by validate_music by outcome", ("outcome",)
+)
+static_bytes_written = registry.counter(
+    "static_bytes_written_total", "Bytes written to STATIC_DIR", ("kind",)
+)
+
+
+def collect_app_metrics(app, rate_limiter):
+    """
+    Gauges and counters the subsystems already keep, read at scrape time.
+    """
+    limits = rate_limiter.stats()
+    cache = app.cache.stats()
+    metadata = app.metadata_cache.stats()
+    cover_art = app.cover_art.stats()
+    images = app.cover_art_images.stats()
+    enrichment = app.enrichment.stats()
+    buffer = app.write_buffer.stats()
+    flights = app.flights.stats()
+    pool = app.db
+    size = pool.get_size()
+    return [
+        ("rate_limit_rejections_total", "Upstream calls rejected by the rate limiter", "counter",
+         [({"host": host}, bucket["rejected"]) for host, bucket in limits.items()]),
+        ("rate_limit_waiting", "Upstream calls waiting for a token", "gauge",
+         [({"host": host}, bucket["waiting"]) for host, bucket in limits.items()]),
+        ("cache_requests_total", "In-memory cache lookups", "counter",
+         [({"cache": "response", "result": "hit"}, cache["hits"]),
+          ({"cache": "response", "result": "miss"}, cache["misses"]),
+          ({"cache": "metadata", "result": "hit"}, metadata["hits"]),
+          ({"cache": "metadata", "result": "miss"}, metadata["misses"]),
+          ({"cache": "cover_art", "result": "hit"}, cover_art["hits"]),
+          ({"cache": "cover_art", "result": "miss"}, cover_art["misses"]),
+          ({"cache": "cover_art_image", "result": "hit"}, images["hits"]),
+          ({"cache": "cover_art_image", "result": "miss"}, images["downloads"] + images["joined"])]),
+        ("cache_evictions_total", "Entries dropped from the response cache", "counter",
+         [({"reason": "capacity"}, cache["evictions"]), ({"reason": "expired"}, cache["expirations"])]),
+        ("cache_entries", "Entries in the in-memory caches", "gauge",
+         [({"cache": "response"}, cache["entries"]), ({"cache": "metadata"}, metadata["entries"]),
+          ({"cache": "cover_art"}, cover_art["entries"]), ({"cache": "cover_art_image"}, images["files"])]),
+        ("cache_bytes", "Approximate size of the response cache", "gauge", [({}, cache["bytes"])]),
+        ("cover_art_disk_bytes", "Bytes of cover art in the disk cache", "gauge", [({}, images["bytes"])]),
+        ("cover_art_evictions_total", "Cover art files removed to stay within the disk budget", "counter",
+         [({}, images["evictions"])]),
+        ("single_flight_calls_total", "Cache misses by whether they ran or joined a running call", "counter",
+         [({"result": "executed"}, flights["executions"]), ({"result": "coalesced"}, flights["coalesced"])]),
+        ("db_pool_connections", "Database pool connections", "gauge",
+         [({"state": "in_use"}, size - pool.get_idle_size()),
+          ({"state": "idle"}, pool.get_idle_size()),
+          ({"state": "max"}, pool.get_max_size())]),
+        ("db_pool_waiting", "Callers waiting for a database connection", "gauge", [({}, pool.waiting)]),
+        ("enrichment_queue_depth", "Events waiting for enrichment", "gauge", [({}, enrichment["depth"])]),
+        ("enrichment_in_flight", "Events being enriched", "gauge", [({}, enrichment["in_flight"])]),
+        ("enrichment_rejected_total", "Events not queued because the enrichment queue was stopping", "counter",
+         [({}, enrichment["rejected"])]),
+        ("write_buffer_pending", "Events waiting to be flushed", "gauge", [({}, buffer["pending"])]),
+        ("write_buffer_flushed_rows_total", "Rows written by the write buffer", "counter",
+         [({}, buffer["flushed_rows"])]),
+        ("write_buffer_rejected_total", "Writes turned away because the buffer was full", "counter",
+         [({}, buffer["rejected"])]),
+        ("write_buffer_failed_flushes_total", "Write buffer flushes that failed", "counter",
+         [({}, buffer["failed_flushes"])]),
+        ("write_buffer_dropped_total", "Rows dropped after the database kept rejecting them on their own",
+         "counter", [({}, buffer["dropped"])]),
+    ]
+
+
+class MetricsMiddleware:
+    """
+    Pure ASGI middleware recording request latency per route template.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            path = route.path if route is not None else ("/static" if scope["path"].startswith("/static") else "unmatched")
+            http_request_duration.observe(time.perf_counter() - started, scope["method"], path, status[0])
+
+
+class _TimedAcquire:
+    def __init__(self, pool: "TimedPool", context):
+        self._pool = pool
+        self._context = context
+
+    def __await__(self):
+        return self._acquire().__await__()
+
+    async def _acquire(self):
+        started = time.perf_counter()
+        self._pool.waiting += 1
+        try:
+            con = await self._context
+        finally:
+            self._pool.waiting -= 1
+        db_acquire_duration.observe(time.perf_counter() - started)
+        return con
+
+    async def __aenter__(self):
+        started = time.perf_counter()
+        self._pool.waiting += 1
+        try:
+            con = await self._context.__aenter__()
+        finally:
+            self._pool.waiting -= 1
+        db_acquire_duration.observe(time.perf_counter() - started)
+        return con
+
+    async def __aexit__(self, *exc):
+        return await self._context.__aexit__(*exc)
+
+
+class TimedPool:
+    """
+    Wraps an asyncpg pool to record how long `acquire` waits and how many callers
+    are waiting right now. Everything else is passed through.
+    """
+
+    def __init__(self, pool):
+        self._pool = pool
+        self.waiting = 0
+
+    def acquire(self, *, timeout: Optional[float] = None):
+        return _TimedAcquire(self, self._pool.acquire(timeout=timeout))
+
+    def __getattr__(self, name):
+        return getattr(self._pool, name)
@@ -0,0 +1,184 @@
+import asyncio
+import logging
+import random
+from typing import List, NamedTuple, Optional
+
+from asyncpg import Record
+
+from db import create_index_concurrently
+from enrichment import EnrichmentQueue
+from validation import AddMusicModel
+
+logger = logging.getLogger(__name__)
+
+# enrichment state lives on the events row, so nothing is lost with the process
+ALTER_TABLE_QUERY = """
+    ALTER TABLE events
+    ADD COLUMN IF NOT EXISTS artwork_url text,
+    ADD COLUMN IF NOT EXISTS uploaded_artwork text,
+    ADD COLUMN IF NOT EXISTS enrich_attempts integer NOT NULL DEFAULT 0,
+    ADD COLUMN IF NOT EXISTS enrich_after timestamptz;
+"""
+
+# images used to be stored as JSON text, it is bound and read as jsonb now.
+# Checked first, the conversion rewrites the table
+ALTER_IMAGES_QUERY = """
+    DO $$
+    BEGIN
+        IF (SELECT data_type FROM information_schema.columns
+            WHERE table_schema = current_schema() AND table_name = 'events' AND column_name = 'images') = 'text' THEN
+            ALTER TABLE events ALTER COLUMN images TYPE jsonb USING images::jsonb;
+        END IF;
+    END
+    $$;
+"""
+
+CREATE_INDEX_QUERY = """
+    CREATE INDEX CONCURRENTLY IF NOT EXISTS events_pending_idx
+    ON events (enrich_after NULLS FIRST, id)
+    WHERE is_valid IS NULL AND NOT is_deleted;
+"""
+
+# claimed rows are pushed `lease` seconds into the future, a worker that stops
+# or dies before finishing leaves them to be picked up again
+CLAIM_QUERY = """
+    UPDATE events SET enrich_attempts = enrich_attempts + 1, enrich_after = now() + make_interval(secs => $2)
+    WHERE id IN (
+        SELECT id FROM events
+        WHERE is_valid IS NULL AND NOT is_deleted AND (enrich_after IS NULL OR enrich_after <= now())
+        ORDER BY enrich_after NULLS FIRST, id
+        LIMIT $1
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING id, title, artist, album, duration, playbackrate, bundle, elapsed, devicename,
+    artwork_url, uploaded_artwork, enrich_attempts;
+"""
+
+RETRY_QUERY = """
+    UPDATE events SET enrich_after = now() + make_interval(secs => $2) WHERE id = $1 AND is_valid IS NULL;
+"""
+
+
+class PendingEvent(NamedTuple):
+    id: int
+    attempts: int
+    data: AddMusicModel
+    uploaded_artwork: Optional[str]
+
+
+class PendingEnrichment:
+    """
+    Feeds `events` rows that are still pending (is_valid IS NULL) to the
+    enrichment queue. Rows are claimed with a lease, so every worker can run
+    one of these, and rows whose enrichment was dropped at shutdown or crashed
+    come back after the lease. `retry` puts a row back with exponential backoff
+    after a transient failure. `wake` claims right away instead of waiting for
+    the next poll, call it after writing new plays.
+    """
+
+    def __init__(
+        self,
+        pool,
+        queue: EnrichmentQueue,
+        batch_size: int = 100,
+        lease: float = 300.0,
+        backoff_base: float = 30.0,
+        backoff_max: float = 3600.0,
+        poll_interval: float = 30.0,
+        ddl_timeout: Optional[float] = None,
+    ):
+        self._pool = pool
+        self._queue = queue
+        self.batch_size = batch_size
+        self.lease = lease
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.poll_interval = poll_interval
+        self.ddl_timeout = ddl_timeout
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self.claimed = 0
+        self.retried = 0
+
+    async def init(self):
+        async with self._pool.acquire() as con:
+            await con.execute(ALTER_TABLE_QUERY, timeout=self.ddl_timeout)
+            await con.execute(ALTER_IMAGES_QUERY, timeout=self.ddl_timeout)
+            await create_index_concurrently(con, "events_pending_idx", CREATE_INDEX_QUERY, self.ddl_timeout)
+
+    def start(self):
+        if self._task is None:
+            # the first pass picks up whatever an earlier run left pending
+            self._wake.set()
+            self._task = asyncio.create_task(self._run(), name="pending-enrichment")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def wake(self):
+        self._wake.set()
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                while await self._feed():
+                    pass
+            except Exception as e:
+                logger.error(f"failed to claim pending events due to {e}", exc_info=True)
+
+    async def _feed(self) -> bool:
+        """
+        Claim as many due rows as the queue has room for. Returns True if it may have left some behind.
+        """
+        room = self._queue.room()
+        if room == 0:
+            return False
+        limit = self.batch_size if room < 0 else min(self.batch_size, room)
+        rows = await self._claim(limit)
+        self.claimed += len(rows)
+        for row in rows:
+            if not await self._queue.put(self._pending_event(row)):
+                # stopping, the lease brings the row back
+                return False
+        return len(rows) == limit
+
+    async def _claim(self, limit: int) -> List[Record]:
+        async with self._pool.acquire() as con:
+            return await con.fetch(CLAIM_QUERY, limit, float(self.lease))
+
+    @staticmethod
+    def _pending_event(row: Record) -> PendingEvent:
+        data = AddMusicModel(
+            title=row["title"],
+            artist=row["artist"],
+            album=row["album"],
+            duration=row["duration"],
+            playbackRate=row["playbackrate"],
+            bundle=row["bundle"],
+            elapsed=row["elapsed"],
+            deviceName=row["devicename"],
+            artworkUrl=row["artwork_url"],
+        )
+        return PendingEvent(row["id"], row["enrich_attempts"], data, row["uploaded_artwork"])
+
+    async def retry(self, event: PendingEvent):
+        delay = min(self.backoff_max, self.backoff_base * 2 ** min(event.attempts - 1, 20))
+        delay *= random.uniform(0.8, 1.2)
+        try:
+            async with self._pool.acquire() as con:
+                await con.execute(RETRY_QUERY, event.id, delay)
+            self.retried += 1
+        except Exception as e:
+            # the lease runs out and the row is picked up again
+            logger.error(f"failed to reschedule enrichment of event {event.id} due to {e}", exc_info=True)
+
+    def stats(self) -> dict:
+        return {"claimed": self.claimed, "retried": self.retried}
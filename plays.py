@@ -0,0 +1,193 @@
+import asyncio
+import gzip
+import logging
+import os
+import re
+import shutil
+from datetime import date, datetime, timezone
+from typing import List, Optional, Tuple
+
+from db import register_statement
+from validation import AddMusicModel
+
+logger = logging.getLogger(__name__)
+
+CREATE_TABLE_QUERY = """
+    CREATE TABLE IF NOT EXISTS plays (
+        id bigserial,
+        played_at timestamptz NOT NULL DEFAULT now(),
+        title text NOT NULL,
+        artist text NOT NULL,
+        album text,
+        duration double precision,
+        playbackRate boolean,
+        bundle text,
+        elapsed double precision,
+        deviceName text
+    ) PARTITION BY RANGE (played_at);
+    CREATE INDEX IF NOT EXISTS plays_played_at_idx ON plays (played_at);
+"""
+
+# a row per play, the aggregated (event, plays) pairs from the buffer are expanded back out
+INSERT_QUERY = """
+    INSERT INTO plays (title, artist, album, duration, playbackRate, bundle, elapsed, deviceName)
+    SELECT title, artist, album, duration, playbackRate, bundle, elapsed, deviceName
+    FROM unnest($1::text[], $2::text[], $3::text[], $4::float8[], $5::boolean[], $6::text[], $7::float8[], $8::text[], $9::int[])
+    AS t(title, artist, album, duration, playbackRate, bundle, elapsed, deviceName, plays),
+    generate_series(1, t.plays);
+"""
+
+INSERT_PLAYS = register_statement("insert_plays", INSERT_QUERY)
+
+# attached partitions and ones left detached by an interrupted archive run
+LIST_PARTITIONS_QUERY = """
+    SELECT c.relname
+    FROM pg_class c
+    WHERE c.relkind = 'r' AND c.relname ~ '^plays_[0-9]{4}_[0-9]{2}$' AND pg_table_is_visible(c.oid)
+    ORDER BY c.relname;
+"""
+
+IS_ATTACHED_QUERY = """
+    SELECT EXISTS (
+        SELECT 1 FROM pg_inherits WHERE inhrelid = $1::regclass AND inhparent = 'plays'::regclass
+    );
+"""
+
+# only one worker maintains partitions at a time
+MAINTENANCE_LOCK_ID = 0x706C617973
+
+_partition_name = re.compile(r"^plays_(\d{4})_(\d{2})$")
+
+
+def event_columns(rows: List[Tuple[AddMusicModel, int]]) -> List[list]:
+    """
+    (event, plays) pairs as the column arrays the unnest queries take.
+    """
+    columns = [[] for _ in range(9)]
+    for data, plays in rows:
+        values = (
+            data.title,
+            data.artist,
+            data.album,
+            data.duration,
+            data.playbackRate,
+            data.bundle,
+            data.elapsed,
+            data.deviceName,
+            plays,
+        )
+        for column, value in zip(columns, values):
+            column.append(value)
+    return columns
+
+
+def add_months(month: date, n: int) -> date:
+    index = month.year * 12 + month.month - 1 + n
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month: date) -> str:
+    return f"plays_{month.year:04d}_{month.month:02d}"
+
+
+def compress_file(source: str, destination: str):
+    """
+    gzip `source` into `destination` atomically and remove `source`. Blocking, run it in a worker thread.
+    """
+    tmp_path = destination + ".tmp"
+    with open(source, "rb") as src, gzip.open(tmp_path, "wb") as dst:
+        shutil.copyfileobj(src, dst, 1024 * 1024)
+    with open(tmp_path, "rb") as f:
+        os.fsync(f.fileno())
+    os.replace(tmp_path, destination)
+    os.unlink(source)
+
+
+class PlayLog:
+    """
+    Append-only log of every play in the `plays` table, partitioned by month.
+    Partitions are created `months_ahead` in advance. With `retention_months`
+    set, older partitions are detached, written to `archive_dir` as gzipped CSV
+    and dropped. `events` stays the latest-per-track table next to it.
+    """
+
+    def __init__(
+        self,
+        pool,
+        archive_dir: str,
+        retention_months: int = 0,
+        months_ahead: int = 2,
+        maintenance_timeout: Optional[float] = None,
+    ):
+        self._pool = pool
+        # detaching waits for locks and the archive copies a whole month, both outlast the statement timeout
+        self.maintenance_timeout = maintenance_timeout
+        self.archive_dir = archive_dir
+        self.retention_months = retention_months
+        self.months_ahead = months_ahead
+        self.inserted = 0
+        self.archived = 0
+
+    async def init(self):
+        async with self._pool.acquire() as con:
+            await con.execute(CREATE_TABLE_QUERY)
+        await self.maintain()
+
+    async def insert(self, con, rows: List[Tuple[AddMusicModel, int]]):
+        rows = [(data, plays) for data, plays in rows if plays]
+        if not rows:
+            return
+        await con.fetch_prepared(INSERT_PLAYS, *event_columns(rows))
+        self.inserted += sum(plays for _, plays in rows)
+
+    async def maintain(self):
+        async with self._pool.acquire() as con:
+            if not await con.fetchval("SELECT pg_try_advisory_lock($1);", MAINTENANCE_LOCK_ID):
+                return
+            try:
+                await self._create_partitions(con)
+                if self.retention_months > 0:
+                    await self._archive_partitions(con)
+            finally:
+                await con.execute("SELECT pg_advisory_unlock($1);", MAINTENANCE_LOCK_ID)
+
+    async def _create_partitions(self, con):
+        this_month = datetime.now(timezone.utc).date().replace(day=1)
+        for n in range(self.months_ahead + 1):
+            month = add_months(this_month, n)
+            await con.execute(
+                f"CREATE TABLE IF NOT EXISTS {partition_name(month)} PARTITION OF plays "
+                f"FOR VALUES FROM ('{month.isoformat()}') TO ('{add_months(month, 1).isoformat()}');"
+            )
+
+    async def _archive_partitions(self, con):
+        cutoff = add_months(datetime.now(timezone.utc).date().replace(day=1), -self.retention_months)
+        for row in await con.fetch(LIST_PARTITIONS_QUERY):
+            name = row["relname"]
+            year, month = _partition_name.match(name).groups()
+            if add_months(date(int(year), int(month), 1), 1) > cutoff:
+                continue
+            await self._archive(con, name)
+
+    async def _archive(self, con, name: str):
+        if await con.fetchval(IS_ATTACHED_QUERY, name):
+            await con.execute(f"ALTER TABLE plays DETACH PARTITION {name};", timeout=self.maintenance_timeout)
+
+        os.makedirs(self.archive_dir, exist_ok=True)
+        csv_path = os.path.join(self.archive_dir, f"{name}.csv")
+        await con.copy_from_table(name, output=csv_path, format="csv", header=True, timeout=self.maintenance_timeout)
+        await asyncio.to_thread(compress_file, csv_path, csv_path + ".gz")
+        await con.execute(f"DROP TABLE {name};", timeout=self.maintenance_timeout)
+        self.archived += 1
+        logger.info(f"archived {name} to {csv_path}.gz")
+
+    async def run_maintenance(self, interval: float = 3600.0):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.maintain()
+            except Exception as e:
+                logger.error(f"play log maintenance failed due to {e}", exc_info=True)
+
+    def stats(self) -> dict:
+        return {"inserted": self.inserted, "archived": self.archived}
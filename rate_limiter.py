@@ -0,0 +1,135 @@
+import asyncio
+import logging
+import time
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+CREATE_TABLE_QUERY = """
+    CREATE TABLE IF NOT EXISTS rate_limit_buckets (
+        host text PRIMARY KEY,
+        tokens double precision NOT NULL,
+        updated timestamptz NOT NULL DEFAULT clock_timestamp()
+    );
+"""
+
+# take one token, letting the bucket go negative, and return the balance afterwards;
+# a negative balance is a reservation that becomes usable after -balance / rate seconds
+RESERVE_QUERY = """
+    INSERT INTO rate_limit_buckets AS b (host, tokens, updated)
+    VALUES ($1, $3 - 1, clock_timestamp())
+    ON CONFLICT (host)
+    DO UPDATE SET
+    tokens = LEAST($3, b.tokens + extract(epoch from clock_timestamp() - b.updated) * $2) - 1,
+    updated = clock_timestamp()
+    RETURNING tokens;
+"""
+
+REFUND_QUERY = """
+    UPDATE rate_limit_buckets SET tokens = LEAST($2, tokens + 1) WHERE host = $1;
+"""
+
+
+class TokenBucket:
+    """
+    Token bucket refilled at `rate` tokens per second holding at most `burst` tokens.
+    Waiters are served in FIFO order; a waiter that would need longer than
+    `max_wait` seconds gives up without consuming a token.
+    """
+
+    def __init__(self, host: str, rate: float, burst: int = 1, pool=None):
+        self.host = host
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._pool = pool
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+        self.waiting = 0
+        self.rejected = 0
+
+    def _reserve_local(self) -> float:
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate) - 1
+        self._updated = now
+        return self._tokens
+
+    def _refund_local(self):
+        self._tokens = min(self.burst, self._tokens + 1)
+
+    async def _reserve(self) -> float:
+        if self._pool is not None:
+            try:
+                async with self._pool.acquire() as con:
+                    return await con.fetchval(RESERVE_QUERY, self.host, self.rate, float(self.burst))
+            except Exception as e:
+                logger.error(f"shared rate limit unavailable for {self.host}, using local bucket: {e}")
+        return self._reserve_local()
+
+    async def _refund(self):
+        if self._pool is not None:
+            try:
+                async with self._pool.acquire() as con:
+                    await con.execute(REFUND_QUERY, self.host, float(self.burst))
+                return
+            except Exception as e:
+                logger.error(f"shared rate limit refund failed for {self.host}: {e}")
+        self._refund_local()
+
+    async def acquire(self, max_wait: Optional[float] = None) -> bool:
+        """
+        Wait for a token. Returns False if it cannot be granted within `max_wait` seconds.
+        """
+        if self.rate <= 0:
+            return True
+
+        deadline = time.monotonic() + max_wait if max_wait is not None else None
+        self.waiting += 1
+        try:
+            # asyncio.Lock wakes waiters in the order they arrived, which keeps callers FIFO
+            async with self._lock:
+                tokens = await self._reserve()
+                if tokens >= 0:
+                    return True
+
+                wait = -tokens / self.rate
+                if deadline is not None and time.monotonic() + wait > deadline:
+                    await self._refund()
+                    self.rejected += 1
+                    return False
+
+                await asyncio.sleep(wait)
+                return True
+        finally:
+            self.waiting -= 1
+
+
+class RateLimiter:
+    """
+    Per host token buckets. Hosts without a configured limit are not throttled.
+    """
+
+    def __init__(self, max_wait: Optional[float] = None):
+        self.max_wait = max_wait
+        self._buckets: Dict[str, TokenBucket] = {}
+
+    def configure(self, host: Optional[str], interval: float, burst: int = 1, pool=None):
+        """
+        Allow one call per `interval` seconds to `host` on average, with bursts of up to `burst` calls.
+        """
+        if not host:
+            return
+        rate = 1 / interval if interval > 0 else 0
+        self._buckets[host] = TokenBucket(host, rate, burst=burst, pool=pool)
+
+    async def acquire(self, host: Optional[str], max_wait: Optional[float] = None) -> bool:
+        bucket = self._buckets.get(host)
+        if bucket is None:
+            return True
+        return await bucket.acquire(self.max_wait if max_wait is None else max_wait)
+
+    def stats(self) -> dict:
+        return {
+            host: {"waiting": bucket.waiting, "rejected": bucket.rejected}
+            for host, bucket in self._buckets.items()
+        }
@@ -1,8 +1,26 @@
+from datetime import date
+from typing import Optional
+
 from fastapi import APIRouter, Request
-from fastapi.responses import JSONResponse
+from fastapi.responses import ORJSONResponse, PlainTextResponse
 
+from db import check_database
 from email_service import send_email
-from service import add_music, get_cover_art, get_current_playing
+from metrics import registry
+from service import (
+    add_music,
+    add_music_batch,
+    create_stream_token,
+    get_cover_art,
+    get_cover_art_image,
+    get_current_playing,
+    get_daily_plays,
+    get_history,
+    get_top_artists,
+    get_top_tracks,
+    stream_current_playing,
+)
+from settings import DB_HEALTH_MAX_SATURATION, DB_HEALTH_TIMEOUT, HISTORY_PAGE_SIZE
 from validation import AddMusicModel, EmailRequest
 from weather import get_current_weather
 
@@ -11,8 +29,34 @@ api_v1 = APIRouter()
 
 
 @api_v1.get("/health")
-async def health():
-    return {"status": "ok"}
+async def health(request: Request):
+    database = await check_database(request.app.db, DB_HEALTH_TIMEOUT, DB_HEALTH_MAX_SATURATION)
+    content = {
+        "status": "ok" if database["healthy"] else "unavailable",
+        "database": database,
+        "enrichment": request.app.enrichment.stats(),
+        "pending": request.app.pending.stats(),
+        "write_buffer": request.app.write_buffer.stats(),
+        "dedupe": request.app.dedupe.stats(),
+        "cache": request.app.cache.stats(),
+        "single_flight": request.app.flights.stats(),
+        "stream": request.app.broadcaster.stats(),
+        "invalidation": request.app.invalidator.stats(),
+        "artwork": request.app.artwork.stats(),
+        "cover_art": request.app.cover_art.stats(),
+        "cover_art_images": request.app.cover_art_images.stats(),
+        "plays": request.app.plays.stats(),
+        "geocode": request.app.geocode.stats(),
+        "email": request.app.outbox.stats(),
+    }
+    # 503 lets the load balancer take this instance out before queries queue up
+    return ORJSONResponse(content, status_code=200 if database["healthy"] else 503)
+
+
+@api_v1.get("/metrics")
+async def metrics():
+    # scraped with a token that has the "metrics" scope, see required_scope
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
 
 
 @api_v1.get("/version")
@@ -25,19 +69,60 @@ async def _add_music(request: Request, data: AddMusicModel):
     return await add_music(request, data)
 
 
+@api_v1.post("/add-music/batch")
+async def _add_music_batch(request: Request):
+    return await add_music_batch(request)
+
+
 @api_v1.get("/cover-art/{release_id}")
 async def _get_cover_art(request: Request, release_id: str):
     return await get_cover_art(request, release_id)
 
 
+@api_v1.get("/cover-art/{release_id}/image")
+async def _get_cover_art_image(request: Request, release_id: str, size: str = "500"):
+    return await get_cover_art_image(request, release_id, size)
+
+
 @api_v1.get("/current-playing")
 async def _get_current_playing(request: Request):
     return await get_current_playing(request) 
 
+
+@api_v1.get("/current-playing/stream")
+async def _stream_current_playing(request: Request):
+    return await stream_current_playing(request)
+
+
+@api_v1.post("/current-playing/stream-token")
+async def _create_stream_token(request: Request):
+    return await create_stream_token(request)
+
+
+@api_v1.get("/history")
+async def _get_history(request: Request, cursor: Optional[str] = None, limit: int = HISTORY_PAGE_SIZE):
+    return await get_history(request, cursor, limit)
+
+
+@api_v1.get("/stats/top-artists")
+async def _get_top_artists(request: Request, start: Optional[date] = None, end: Optional[date] = None, limit: int = 10):
+    return await get_top_artists(request, start, end, limit)
+
+
+@api_v1.get("/stats/top-tracks")
+async def _get_top_tracks(request: Request, start: Optional[date] = None, end: Optional[date] = None, limit: int = 10):
+    return await get_top_tracks(request, start, end, limit)
+
+
+@api_v1.get("/stats/daily")
+async def _get_daily_plays(request: Request, start: Optional[date] = None, end: Optional[date] = None):
+    return await get_daily_plays(request, start, end)
+
+
 @api_v1.post("/send-email")
 async def _send_email(request: Request, data: EmailRequest):
-    return await send_email(data.email, data.subject, data.body)
+    return await send_email(request, data)
 
 @api_v1.get("/weather")
-async def _get_current_weather(request: Request):
-    return get_current_weather(request)
\ No newline at end of file
+async def _get_current_weather(request: Request, location: Optional[str] = None):
+    return await get_current_weather(request, location)
\ No newline at end of file
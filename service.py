@@ -1,135 +1,352 @@
-import base64
+import asyncio
 import json
 import logging
 import os
-import time
+from datetime import date, datetime, timedelta, timezone
 from typing import List, Optional, Tuple
-import uuid
+from urllib.parse import urlparse
+import orjson
 from asyncpg import Record
 from fastapi import HTTPException, Request
-from fastapi.encoders import jsonable_encoder
-from fastapi.responses import JSONResponse
-from requests import request
+from fastapi.responses import FileResponse, ORJSONResponse, StreamingResponse
+from pydantic import ValidationError
 
-from cache import InMemoryCache
+from artwork import ARTWORK_DIR, ingest_base64, variant_paths
+from broadcaster import Broadcaster, format_event
+from conditional import CachedResponse, cached_response, conditional_response
 from constant import CURRENT_PLAYING_CACHE_KEY
+from cover_art import IMAGE_SIZES, front_image_url, is_release_id
+from db import register_statement
+from dedupe import fingerprint
+from metadata_cache import TrackMetadataCache
+from metrics import enrichment_results, static_bytes_written
+from pending_events import PendingEvent
+from plays import event_columns
 from settings import (
+    ADD_MUSIC_BATCH_LIMIT,
     APP_URL,
-    COVERT_ART_ARCHIVE_BASE_URL,
+    ARTWORK_MAX_UPLOAD_BYTES,
+    ARTWORK_VARIANT_FORMAT,
+    ARTWORK_VARIANT_SIZES,
+    BASE_ROUTE,
+    HISTORY_MAX_PAGE_SIZE,
+    COVER_ART_CACHE_TTL,
+    CURRENT_PLAYING_CACHE_TTL,
+    CURRENT_PLAYING_MAX_AGE,
     LAST_FM_API_KEY,
     MUSICBRAINZ_BASE_URL,
+    SSE_HEARTBEAT_INTERVAL,
+    SSE_RETRY_MS,
+    STATS_CACHE_TTL,
+    STATS_DEFAULT_DAYS,
+    STATS_MAX_LIMIT,
     STATIC_DIR,
     THE_LAST_FM_BASE_URL,
 )
-from utils import guess_file_ext_from_base64, make_api_request
+from singleflight import get_or_compute
+from stats import (
+    decode_cursor,
+    encode_cursor,
+    fetch_daily_plays,
+    fetch_history,
+    fetch_top_artists,
+    fetch_top_tracks,
+    record_plays,
+)
+from stream_token import STREAM_TOKEN_COOKIE, issue_stream_token
+from utils import make_api_request
 from validation import AddMusicModel
 
 logger = logging.getLogger(__name__)
 
-last_added: str = ""
-cache_ttl = 3600
+cache_ttl = CURRENT_PLAYING_CACHE_TTL
+NO_RESULTS = "No results found"
 
 
-def save_cover_art(image_str: str):
+async def save_cover_art(image_str: str):
     if not image_str:
         return None
     image_str = image_str.strip()
 
-    file_ext = guess_file_ext_from_base64(image_str)
-    filename = f"{uuid.uuid4()}.{file_ext}"
-    file_path = os.path.join(STATIC_DIR, filename)
-
-    image_data = base64.b64decode(image_str)
-    with open(file_path, "wb") as f:
-        f.write(image_data)
+    directory = os.path.join(STATIC_DIR, ARTWORK_DIR)
+    filename, written = await asyncio.to_thread(ingest_base64, image_str, directory, ARTWORK_MAX_UPLOAD_BYTES)
+    if not filename:
+        return None
+    static_bytes_written.inc("upload", amount=written)
 
-    return {"filename": filename, "file_path": file_path}
+    return {"filename": f"{ARTWORK_DIR}/{filename}", "file_path": os.path.join(directory, filename)}
 
 
 async def add_music(request: Request, data: AddMusicModel):
-    global last_added
-    key = f"{data.title}-{data.artist}-{data.album}-{data.playbackRate}"
     if not data.duration:
-        return JSONResponse(content={"message": "Missing duration"}, status_code=400)
-    if key == last_added:
-        logger.info(f"Duplicate request for {key}, skipping")
-        return JSONResponse(content={"message": "Duplicate request"}, status_code=200)
-    
-    last_added = key
-    status, msg, validated_data = validate_music(data)
+        return ORJSONResponse(content={"message": "Missing duration"}, status_code=400)
+    if await request.app.dedupe.seen(data):
+        # same play (or a pause/resume of it), keep the latest elapsed/playback state without counting another play
+        request.app.write_buffer.add((data.title, data.artist, data.album), data, 0)
+        logger.info(f"Duplicate request for {fingerprint(data)} from {data.deviceName}, skipping")
+        return ORJSONResponse(content={"message": "Duplicate request"}, status_code=200)
+
+    # the raw event is upserted by the write buffer, metadata is resolved by the enrichment workers
+    if not request.app.write_buffer.add((data.title, data.artist, data.album), data, 1):
+        # the play was not stored, the retry we ask for must not be taken for a duplicate
+        await request.app.dedupe.forget([data])
+        return ORJSONResponse(
+            content={"message": "Too many pending writes, retry later"},
+            status_code=503,
+            headers={"Retry-After": "1"},
+        )
+    return ORJSONResponse(content={"message": "Data saved successfully"}, status_code=200)
+
+
+async def flush_events(app, rows: List[Tuple[AddMusicModel, int]]):
+    """
+    Write buffered events to the database. New tracks are left pending for the enrichment workers.
+    """
+    await write_events(app, rows)
+    await events_written(app, rows)
+
+
+async def events_written(app, rows: List[Tuple[AddMusicModel, int]]):
+    # pending rows are claimed from the table, nothing here waits for the enrichment queue
+    app.pending.wake()
+    if rows:
+        # every upsert bumps `updated`, a new play or a pause/resume of the current track both change
+        # what /current-playing shows. Tracks that are already enriched show up straight away
+        await app.invalidator.invalidate(CURRENT_PLAYING_CACHE_KEY)
+        if app.broadcaster.subscribers:
+            await publish_current_playing(app)
+
+
+# a new play of a track whose lookup found nothing makes it pending again
+BULK_UPSERT_QUERY = """
+    INSERT INTO events AS e
+    (title, artist, album, duration, playbackRate, bundle, elapsed, deviceName, is_valid, playcount,
+    artwork_url, uploaded_artwork)
+    SELECT title, artist, album, duration, playbackRate, bundle, elapsed, deviceName, NULL, plays,
+    artwork_url, uploaded_artwork
+    FROM unnest($1::text[], $2::text[], $3::text[], $4::float8[], $5::boolean[], $6::text[], $7::float8[], $8::text[], $9::int[],
+    $10::text[], $11::text[])
+    AS t(title, artist, album, duration, playbackRate, bundle, elapsed, deviceName, plays, artwork_url, uploaded_artwork)
+    ON CONFLICT (title, artist, album)
+    DO UPDATE SET
+    playbackRate = EXCLUDED.playbackRate, bundle = EXCLUDED.bundle, elapsed = EXCLUDED.elapsed,
+    deviceName = EXCLUDED.deviceName, playcount = e.playcount + EXCLUDED.playcount, updated = now(),
+    artwork_url = coalesce(EXCLUDED.artwork_url, e.artwork_url),
+    uploaded_artwork = coalesce(EXCLUDED.uploaded_artwork, e.uploaded_artwork),
+    is_valid = CASE WHEN e.is_valid IS FALSE AND EXCLUDED.playcount > 0 THEN NULL ELSE e.is_valid END,
+    enrich_attempts = CASE WHEN e.is_valid IS FALSE AND EXCLUDED.playcount > 0 THEN 0 ELSE e.enrich_attempts END,
+    enrich_after = CASE WHEN e.is_valid IS FALSE AND EXCLUDED.playcount > 0 THEN NULL ELSE e.enrich_after END;
+"""
+UPSERT_EVENTS = register_statement("upsert_events", BULK_UPSERT_QUERY)
+
+
+async def upsert_events(con, rows: List[Tuple[AddMusicModel, int]], uploads: List[Optional[str]]):
+    """
+    Upsert many raw events in one statement. `rows` holds (event, plays) pairs
+    and must not contain the same (title, artist, album) twice, `uploads` the
+    stored artwork of each event's base64 image.
+    """
+    artwork_urls = [data.artworkUrl or None for data, _ in rows]
+    await con.fetch_prepared(UPSERT_EVENTS, *event_columns(rows), artwork_urls, uploads)
+
+
+async def save_uploads(rows: List[Tuple[AddMusicModel, int]]) -> List[Optional[str]]:
+    """
+    Store the base64 images sent with new plays, the enrichment workers only see what is in the table.
+    """
+    uploads = []
+    for data, plays in rows:
+        response = await save_cover_art(data.image) if plays and data.image else None
+        uploads.append(response.get("filename") if response else None)
+    return uploads
+
+
+async def write_events(app, rows: List[Tuple[AddMusicModel, int]]):
+    """
+    Append the plays to the play log and fold them into `events` and the stats rollups, in one transaction.
+    """
+    # every writer locks the events rows in the same order, or two flushes touching the same tracks can deadlock
+    rows = sorted(rows, key=lambda row: (row[0].title, row[0].artist, row[0].album or ""))
+    uploads = await save_uploads(rows)
+    async with app.db.acquire() as con:
+        async with con.transaction():
+            await app.plays.insert(con, rows)
+            await upsert_events(con, rows, uploads)
+            await record_plays(con, rows)
+
+
+async def read_batch(request: Request) -> List[Tuple[Optional[AddMusicModel], Optional[str]]]:
+    """
+    Parse a JSON array or an NDJSON stream of AddMusicModel into (item, error) pairs.
+    """
+    items = []
+
+    def parse(raw):
+        if len(items) >= ADD_MUSIC_BATCH_LIMIT:
+            raise HTTPException(status_code=413, detail=f"Batch is limited to {ADD_MUSIC_BATCH_LIMIT} items")
+        try:
+            items.append((AddMusicModel.model_validate(raw), None))
+        except ValidationError as e:
+            items.append((None, str(e.errors(include_url=False))))
+
+    def parse_line(line: bytes):
+        try:
+            raw = orjson.loads(line)
+        except orjson.JSONDecodeError:
+            items.append((None, "Invalid JSON"))
+            return
+        parse(raw)
+
+    content_type = request.headers.get("content-type", "")
+    if "ndjson" in content_type or "jsonlines" in content_type:
+        buffer = b""
+        async for chunk in request.stream():
+            buffer += chunk
+            *lines, buffer = buffer.split(b"\n")
+            for line in lines:
+                if line.strip():
+                    parse_line(line)
+        if buffer.strip():
+            parse_line(buffer)
+        return items
+
+    try:
+        body = orjson.loads(await request.body())
+    except orjson.JSONDecodeError:
+        raise HTTPException(status_code=400, detail="Invalid JSON body")
+    if not isinstance(body, list):
+        raise HTTPException(status_code=400, detail="Expected a JSON array")
+    for raw in body:
+        parse(raw)
+    return items
+
+
+async def add_music_batch(request: Request):
+    items = await read_batch(request)
+
+    results = []
+    rows = {}
+    accepted = []
+    valid = [data for data, _ in items if data is not None and data.duration]
+    # one shared dedupe claim for the whole batch instead of a round trip per item
+    duplicates = iter(await request.app.dedupe.seen_many(valid))
+    for index, (data, error) in enumerate(items):
+        if data is None:
+            results.append({"index": index, "status": "invalid", "message": error})
+            continue
+        if not data.duration:
+            results.append({"index": index, "status": "invalid", "message": "Missing duration"})
+            continue
+        # one row per conflict key, the latest event wins and every accepted one counts as a play.
+        # Duplicates only carry the latest playback state, like in add_music
+        row_key = (data.title, data.artist, data.album)
+        plays = rows[row_key][1] if row_key in rows else 0
+        if next(duplicates):
+            rows[row_key] = (data, plays)
+            results.append({"index": index, "status": "duplicate"})
+            continue
+        rows[row_key] = (data, plays + 1)
+        accepted.append(data)
+        results.append({"index": index, "status": "accepted"})
+
+    if rows:
+        try:
+            await write_events(request.app, list(rows.values()))
+        except Exception as e:
+            logger.error(f"Database error: {str(e)}", exc_info=True)
+            # nothing was stored, a replay of the batch must count these plays again
+            await request.app.dedupe.forget(accepted)
+            raise HTTPException(
+                status_code=500,
+                detail=f"Database error: {str(e)}",
+            )
+
+        await events_written(request.app, list(rows.values()))
+
+    return ORJSONResponse(
+        content={
+            "accepted": sum(1 for result in results if result["status"] == "accepted"),
+            "stored": len(rows),
+            "results": results,
+        },
+        status_code=200,
+    )
+
+
+async def enrich_music(app, event: PendingEvent):
+    """
+    Resolve track metadata and artwork for a pending event and mark it valid, or
+    invalid when the lookup found nothing. Transient failures (rate limited,
+    timeouts, upstream errors) leave it pending and retry it with backoff.
+    """
+    data = event.data
+    status, msg, validated_data = await validate_music(app, data)
+    if not status and msg != NO_RESULTS:
+        enrichment_results.inc("retry")
+        logger.warning(f"enrichment of event {event.id} failed, retrying later: {msg}")
+        await app.pending.retry(event)
+        return
+    enrichment_results.inc("valid" if status else "invalid")
     if not status:
         logger.error(f"Validation error: {msg}")
 
-    
+    # a new list, validated_data may share its images with the metadata cache
+    images = list(validated_data.get("images") or [])
     if data.artworkUrl:
-        validated_data["images"] = validated_data["images"] or []
-        validated_data["images"].append(
+        images.append(
             {
                 "size": "source",
                 "#text": data.artworkUrl,
             }
         )
 
-
-    if not validated_data.get("images") and data.image:
-        response = save_cover_art(data.image)
-        if response:
-            validated_data["images"] = [
-                {
-                    "size": "normal",
-                    "#text": f"{APP_URL}/static/{response.get('filename')}",
-                },
-            ]
+    if not images and event.uploaded_artwork:
+        images = [
+            {
+                "size": "normal",
+                "#text": f"{APP_URL}/static/{event.uploaded_artwork}",
+            },
+        ]
 
     query = """
-        INSERT INTO events
-        (title, recording_id, artist, artist_id, album, release_id, duration, playbackRate, bundle, elapsed, deviceName, images, is_valid, playcount) 
-        VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11, $12, $13, 1)
-        ON CONFLICT (title, artist, album)
-        DO UPDATE SET 
-        playbackRate = $8, bundle = $9, elapsed = $10, deviceName = $11, images = $12,
-        playcount = events.playcount + 1, updated = now();
+        UPDATE events
+        SET recording_id = $2, artist_id = $3, release_id = $4, images = $5, is_valid = $6, enrich_after = NULL
+        WHERE id = $1;
     """
     db_data = {
-        "title": data.title or validated_data["title"],
+        "id": event.id,
         "recording_id": validated_data.get("recording_id"),
-        "artist": data.artist or validated_data.get("artist"),
         "artist_id": validated_data.get("artist_id"),
-        "album": data.album or validated_data.get("album"),
         "release_id": validated_data.get("release_id"),
-        "duration": data.duration or validated_data.get("duration"),
-        "playbackRate": validated_data.get("playbackRate"),
-        "bundle": validated_data.get("bundle"),
-        "elapsed": data.elapsed or validated_data.get("elapsed"),
-        "deviceName": validated_data.get("deviceName"),
-        "images": (
-            json.dumps(validated_data.get("images"))
-            if validated_data.get("images")
-            else None
-        ),
+        "images": images or None,
         "is_valid": status,
     }
 
-    try:
-        async with request.app.db.acquire() as con:
-            await con.execute(query, *db_data.values())
-    except Exception as e:
-        logger.error(f"Database error: {str(e)}", exc_info=True)
-        raise HTTPException(
-            status_code=500,
-            detail=f"Database error: {str(e)}",
-        )
-    
-    request.app.cache.delete(CURRENT_PLAYING_CACHE_KEY)
-    return JSONResponse(content={"message": "Data saved successfully"}, status_code=200)
+    async with app.db.acquire() as con:
+        await con.execute(query, *db_data.values())
 
+    await app.invalidator.invalidate(CURRENT_PLAYING_CACHE_KEY)
+    await publish_current_playing(app)
 
-def validate_music(data: AddMusicModel):
-    # status, msg, resp = lookup_track_mb(data.title, data.artist, data.album or "")
-    status, msg, resp = lookup_track_lastfm(data.title, data.artist)
-    if not status:
-        logger.error(f"Track lookup failed: {msg}")
-        return False, "Track lookup failed", {}
+
+async def validate_music(app, data: AddMusicModel):
+    metadata_cache: TrackMetadataCache = app.metadata_cache
+    hit, resp = await metadata_cache.get(data.title, data.artist)
+    if not hit:
+        # status, msg, resp = await lookup_track_mb(data.title, data.artist, data.album or "")
+        status, msg, resp = await lookup_track_lastfm(data.title, data.artist)
+        if status:
+            await metadata_cache.set(data.title, data.artist, resp)
+        elif msg == NO_RESULTS:
+            await metadata_cache.set(data.title, data.artist, None)
+            resp = None
+        else:
+            logger.error(f"Track lookup failed: {msg}")
+            return False, "Track lookup failed", {}
+
+    if resp is None:
+        logger.error(f"Track lookup failed: {NO_RESULTS}")
+        return False, NO_RESULTS, {}
 
     data_model = data.model_dump()
     data_model.update(resp)
@@ -137,7 +354,7 @@ def validate_music(data: AddMusicModel):
 
 
 # Lookup Track from MusicBrainz
-def lookup_track_mb(
+async def lookup_track_mb(
     title: str, artist: str, album: Optional[str], retry: int = 4
 ) -> Tuple[str, dict]:
     if retry < 0:
@@ -149,10 +366,10 @@ def lookup_track_mb(
 
     params = {"query": query, "fmt": "json", "limit": 1}
 
-    status, reason, response = make_api_request(base_url, "GET", params=params)
+    status, reason, response = await make_api_request(base_url, "GET", params=params)
     if not status:
         if retry > 0:
-            return lookup_track_lastfm(title, artist, retry=retry - 1)
+            return await lookup_track_lastfm(title, artist, retry=retry - 1)
         return False, "request failed", {}
 
     try:
@@ -172,14 +389,14 @@ def lookup_track_mb(
                     result["release_title"] = recording["releases"][0].get("title")
                     result["release_status"] = recording["releases"][0].get("status")
                 return True, "success", result
-        return False, "No results found", {}
+        return False, NO_RESULTS, {}
     except json.JSONDecodeError:
         return False, "Invalid JSON response", {}
-    return False, "No results found", {}
+    return False, NO_RESULTS, {}
 
 
 # Lookup Track from last.fm
-def lookup_track_lastfm(title: str, artist: str, retry: int = 5) -> Tuple[str, dict]:
+async def lookup_track_lastfm(title: str, artist: str, retry: int = 5) -> Tuple[str, dict]:
     if retry < 0:
         return False, "No results found after multiple attempts", {}
     base_url = f"{THE_LAST_FM_BASE_URL}/2.0"
@@ -192,16 +409,15 @@ def lookup_track_lastfm(title: str, artist: str, retry: int = 5) -> Tuple[str, d
         "track": title,
     }
 
-    status, reason, response = make_api_request(base_url, "GET", params=params)
+    status, reason, response = await make_api_request(base_url, "GET", params=params)
     if not status:
         if retry:
-            return lookup_track_mb(title, artist, retry=retry - 1)
+            return await lookup_track_mb(title, artist, None, retry=retry - 1)
         return False, "request failed", {}
     try:
         data = response.json()
-        print(data)
         if data.get("track") is None:
-            return False, "No results found", {}
+            return False, NO_RESULTS, {}
 
         result = {}
 
@@ -220,44 +436,187 @@ def lookup_track_lastfm(title: str, artist: str, retry: int = 5) -> Tuple[str, d
         return False, "Invalid JSON response", {}
 
 
-def get_cover_art(request: Request, release_id: str):
-    if not release_id:
+async def load_cover_art(app, release_id: str) -> Tuple[int, object]:
+    return await get_or_compute(
+        app.cache,
+        app.flights,
+        f"cover-art-{release_id}",
+        cached_response(lambda: app.cover_art.get(release_id)),
+        ttl=COVER_ART_CACHE_TTL,
+    )
+
+
+async def get_cover_art(request: Request, release_id: str):
+    if not release_id or not is_release_id(release_id):
         raise HTTPException(
             status_code=400,
-            detail="Missing release_id",
+            detail="Invalid release_id",
         )
-    base_url = f"{COVERT_ART_ARCHIVE_BASE_URL}/release/{release_id}"
 
-    status, reason, response = make_api_request(base_url, "GET")
-    if not status:
-        return JSONResponse(
-            content={"message": f"Failed to get cover art due to {reason}"},
-            status_code=400,
-        )
+    try:
+        status_code, content = await load_cover_art(request.app, release_id)
+    except asyncio.TimeoutError:
+        return ORJSONResponse(content={"message": "Timed out fetching cover art"}, status_code=504)
+    if status_code == 200:
+        # a release's artwork doesn't change
+        return conditional_response(request, content, COVER_ART_CACHE_TTL)
+    return ORJSONResponse(content=content, status_code=status_code)
+
+
+async def get_cover_art_image(request: Request, release_id: str, size: str):
+    """
+    The release's front image, from the disk cache or streamed from the Cover Art Archive while it is cached.
+    """
+    if not release_id or not is_release_id(release_id):
+        raise HTTPException(status_code=400, detail="Invalid release_id")
+    if size not in IMAGE_SIZES:
+        raise HTTPException(status_code=400, detail=f"size must be one of {', '.join(IMAGE_SIZES)}")
+
+    images = request.app.cover_art_images
+    headers = {"Cache-Control": f"public, max-age={COVER_ART_CACHE_TTL}"}
+    key = f"{release_id}-{size}"
+    cached = images.get(key)
+    if cached is not None:
+        # FileResponse answers Range and conditional requests itself
+        return FileResponse(cached[0], media_type=cached[1], headers=headers)
 
     try:
-        data = response.json()
-        if data.get("images") is None:
-            return JSONResponse(
-                content={"message": "No cover art found"}, status_code=404
-            )
+        status_code, content = await load_cover_art(request.app, release_id)
+    except asyncio.TimeoutError:
+        return ORJSONResponse(content={"message": "Timed out fetching cover art"}, status_code=504)
+    if status_code != 200:
+        return ORJSONResponse(content=content, status_code=status_code)
+    url = front_image_url(content.content, size)
+    if not url:
+        return ORJSONResponse(content={"message": "No cover art found"}, status_code=404)
+
+    download = images.fetch(key, url)
+    try:
+        if request.headers.get("range"):
+            await download.wait()
+            return FileResponse(download.path, media_type=download.media_type, headers=headers)
+        await asyncio.shield(download.ready)
+    except Exception:
+        # logged by the download
+        return ORJSONResponse(content={"message": "Failed to get cover art"}, status_code=502)
+    # no Content-Length, the body goes out chunked as it arrives from upstream
+    return StreamingResponse(download.stream(), media_type=download.media_type, headers=headers)
+
 
-        result = {"release_id": release_id}
+async def get_current_playing(request: Request):
+    """
+    The latest valid event. Playback state (elapsed, playbackRate, device) still
+    waiting in this worker's write buffer is overlaid on it, so a client posting
+    to /add-music and then reading back here sees its change before the flush.
+    That only covers the track already being shown and only the worker holding
+    the buffered event. A new track appears once it is flushed and enriched:
+    until then its metadata is unknown and it may still turn out invalid, so it
+    is deliberately not shown from the buffer.
+    """
+    try:
+        status_code, content = await get_or_compute(
+            request.app.cache,
+            request.app.flights,
+            CURRENT_PLAYING_CACHE_KEY,
+            cached_response(lambda: load_current_playing(request.app, request.headers.get("host"))),
+            ttl=cache_ttl,
+        )
+    except asyncio.TimeoutError:
+        return ORJSONResponse(content={"message": "Timed out loading current playing"}, status_code=504)
+    if status_code != 200:
+        return ORJSONResponse(content=content, status_code=status_code)
+
+    # read your writes: show playback state that is still waiting in the write buffer
+    current = content.content
+    pending: Optional[AddMusicModel] = request.app.write_buffer.get(
+        (current.get("title"), current.get("artist"), current.get("album"))
+    )
+    if pending is not None:
+        content = CachedResponse(
+            {
+                **current,
+                "playbackrate": pending.playbackRate,
+                "elapsed": pending.elapsed,
+                "devicename": pending.deviceName,
+            }
+        )
+    # the cached copy lives until the next event, proxies only get a few seconds
+    return conditional_response(request, content, CURRENT_PLAYING_MAX_AGE)
 
-        for image in data.get("images", []):
-            if image.get("front"):
-                result.update(image)
-                break
 
-        return JSONResponse(content=result, status_code=200)
-    except json.JSONDecodeError:
-        return JSONResponse(
-            content={"message": "Invalid JSON response"}, status_code=400
+async def publish_current_playing(app):
+    """
+    Push the current now-playing payload to every stream subscriber.
+    """
+    try:
+        status_code, content = await get_or_compute(
+            app.cache,
+            app.flights,
+            CURRENT_PLAYING_CACHE_KEY,
+            cached_response(lambda: load_current_playing(app, urlparse(APP_URL).netloc if APP_URL else None)),
+            ttl=cache_ttl,
         )
+    except Exception as e:
+        logger.error(f"failed to load current playing for broadcast due to {e}", exc_info=True)
+        return
+    if status_code == 200:
+        app.broadcaster.publish(content.content)
+
+
+async def stream_current_playing(request: Request):
+    broadcaster: Broadcaster = request.app.broadcaster
+    last_event_id = request.headers.get("last-event-id")
+    last_event_id = int(last_event_id) if last_event_id and last_event_id.isdigit() else None
+
+    if broadcaster.latest() is None:
+        await publish_current_playing(request.app)
+
+    subscriber, backlog = broadcaster.subscribe(last_event_id)
+
+    async def events():
+        try:
+            yield f"retry: {SSE_RETRY_MS}\n\n"
+            for event_id, data in backlog:
+                yield format_event(event_id, data)
+            while True:
+                try:
+                    event = await asyncio.wait_for(subscriber.queue.get(), SSE_HEARTBEAT_INTERVAL)
+                except asyncio.TimeoutError:
+                    yield ": heartbeat\n\n"
+                    continue
+                if event is None:
+                    break
+                yield format_event(*event)
+        finally:
+            broadcaster.unsubscribe(subscriber)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
-async def get_current_playing(request: Request):
-    query = """
+async def create_stream_token(request: Request):
+    """
+    Trades the bearer token for a short-lived read token that a browser
+    EventSource can pass as ?token= or send as the stream_token cookie.
+    """
+    token, ttl = issue_stream_token()
+    response = ORJSONResponse({"token": token, "expires_in": ttl}, headers={"Cache-Control": "no-store"})
+    response.set_cookie(
+        STREAM_TOKEN_COOKIE,
+        token,
+        max_age=ttl,
+        path=f"{BASE_ROUTE or ''}/current-playing/stream",
+        secure=request.url.scheme == "https",
+        httponly=True,
+        samesite="none" if request.url.scheme == "https" else "lax",
+    )
+    return response
+
+
+CURRENT_PLAYING_QUERY = """
     select title , artist , album , release_id , duration , playbackrate , elapsed , devicename , updated, images
     from events e
     where is_deleted = false
@@ -265,15 +624,14 @@ async def get_current_playing(request: Request):
     order by updated desc
     limit 1;
     """
-    cache: InMemoryCache = request.app.cache
-    cached = cache.get(CURRENT_PLAYING_CACHE_KEY)
-    if cached:
-        return JSONResponse(content=cached, status_code=200)
-    
+CURRENT_PLAYING = register_statement("current_playing", CURRENT_PLAYING_QUERY)
+
+
+async def load_current_playing(app, host: Optional[str]) -> Tuple[int, dict]:
     data: List[Record] = None
     try:
-        async with request.app.db.acquire() as con:
-            data = await con.fetch(query)
+        async with app.db.acquire() as con:
+            data = await con.fetch_prepared(CURRENT_PLAYING)
     except Exception as e:
         logger.error(f"Database error: {str(e)}", exc_info=True)
         raise HTTPException(
@@ -281,47 +639,89 @@ async def get_current_playing(request: Request):
             detail=f"Database error: {str(e)}",
         )
     if not data:
-        return JSONResponse(content={"message": "No current playing"}, status_code=404)
-    response = jsonable_encoder(data[0])
-    response["images"] = (
-        json.loads(response.get("images")) if response.get("images") else None
-    )
+        return 404, {"message": "No current playing"}
+    response = dict(data[0])
     image_url = response.get("images")[-1].get("#text") if response.get("images") else None
 
-    static_image_url = download_and_save_image(image_url)    # if image is present, download the image and store it locally, and serve the static local url
+    static_image_url = await app.artwork.get(image_url)    # if image is present, serve it from the local content addressed store
     if static_image_url:
         response.pop("images", None)
-        host = request.headers.get("host")
         if not host:
-            response['artwork'] = static_image_url
-        if "local" in host:
-            response['artwork'] = "http://" + host + static_image_url
+            base_url = ""
+        elif "local" in host:
+            base_url = "http://" + host
         else:
-            response['artwork'] = "https://" + host + static_image_url
-
-    cache.set(CURRENT_PLAYING_CACHE_KEY, response, ttl=cache_ttl)
+            base_url = "https://" + host
+        response['artwork'] = base_url + static_image_url
+        response['artwork_variants'] = {
+            size: base_url + path
+            for size, path in variant_paths(static_image_url, ARTWORK_VARIANT_SIZES, ARTWORK_VARIANT_FORMAT).items()
+        }
 
-    return JSONResponse(content=response, status_code=200)
+    return 200, response
 
 
-def download_and_save_image(image_url: str, image_filename: str = 'current_playing.png'):
+async def get_history(request: Request, cursor: Optional[str], limit: int):
     """
-    - delete the image at static path if present with the same filename
-    - Download the image from the given URL
-    - Save the image to the specified filename
-    - Return the local static link
+    Most recently played tracks, newest first. Pass `next_cursor` back as `cursor` for the next page.
     """
-    
-    if not image_url:
-        return None
-    
-    response = request('GET', image_url)
-    if response.status_code != 200:
-        return None
-    
-    static_path = os.path.join(STATIC_DIR, image_filename)
-    with open(static_path, 'wb') as f:
-        f.write(response.content)
-    
-    return f"/static/{image_filename}?t={int(time.time())}"
-    
\ No newline at end of file
+    limit = max(1, min(limit, HISTORY_MAX_PAGE_SIZE))
+    after = None
+    if cursor:
+        after = decode_cursor(cursor)
+        if after is None:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    rows = await fetch_history(request.app.db, limit, after)
+    return ORJSONResponse(
+        content={
+            "items": [dict(row) for row in rows],
+            "next_cursor": encode_cursor(rows[-1]) if len(rows) == limit else None,
+        },
+        status_code=200,
+    )
+
+
+def stats_range(start: Optional[date], end: Optional[date]) -> Tuple[date, date]:
+    end = end or datetime.now(timezone.utc).date()
+    start = start or end - timedelta(days=STATS_DEFAULT_DAYS - 1)
+    if start > end:
+        raise HTTPException(status_code=400, detail="start must not be after end")
+    return start, end
+
+
+async def get_stats(request: Request, name: str, fn, start: date, end: date, *args):
+    async def load():
+        rows = await fn(request.app.db, start, end, *args)
+        return 200, {
+            "start": start.isoformat(),
+            "end": end.isoformat(),
+            "items": [dict(row) for row in rows],
+        }
+
+    try:
+        status_code, content = await get_or_compute(
+            request.app.cache,
+            request.app.flights,
+            "-".join(["stats", name, start.isoformat(), end.isoformat(), *map(str, args)]),
+            cached_response(load),
+            ttl=STATS_CACHE_TTL,
+        )
+    except asyncio.TimeoutError:
+        return ORJSONResponse(content={"message": "Timed out loading stats"}, status_code=504)
+    return conditional_response(request, content, STATS_CACHE_TTL - content.age())
+
+
+async def get_top_artists(request: Request, start: Optional[date], end: Optional[date], limit: int):
+    start, end = stats_range(start, end)
+    return await get_stats(request, "top-artists", fetch_top_artists, start, end, max(1, min(limit, STATS_MAX_LIMIT)))
+
+
+async def get_top_tracks(request: Request, start: Optional[date], end: Optional[date], limit: int):
+    start, end = stats_range(start, end)
+    return await get_stats(request, "top-tracks", fetch_top_tracks, start, end, max(1, min(limit, STATS_MAX_LIMIT)))
+
+
+async def get_daily_plays(request: Request, start: Optional[date], end: Optional[date]):
+    start, end = stats_range(start, end)
+    return await get_stats(request, "daily", fetch_daily_plays, start, end)
@@ -16,6 +16,11 @@ BASE_ROUTE = getenv('BASE_ROUTE')
 BASIC_AUTH_USER = getenv('BASIC_AUTH_USER')
 BASIC_AUTH_PASS = getenv('BASIC_AUTH_PASS')
 AUTH_TOKEN = getenv('AUTH_TOKEN')
+# extra tokens with scopes (read, ingest, metrics), e.g. "token1:ingest,token2:read+ingest,scraper:metrics"
+AUTH_TOKENS = getenv('AUTH_TOKENS')
+# signs the short-lived read tokens for /current-playing/stream, defaults to AUTH_TOKEN
+STREAM_TOKEN_SECRET = getenv('STREAM_TOKEN_SECRET')
+STREAM_TOKEN_TTL = int(getenv('STREAM_TOKEN_TTL', 60))
 
 # Kafka settings
 KAFKA_BROKERS = getenv('KAFKA_BROKERS')
@@ -26,6 +31,18 @@ DB_PORT = getenv('DB_PORT')
 DB_USER = getenv('DB_USER')
 DB_PASS = getenv('DB_PASS')
 DB_NAME = getenv('DB_NAME')
+DB_POOL_MIN_SIZE = int(getenv('DB_POOL_MIN_SIZE', 2))
+DB_POOL_MAX_SIZE = int(getenv('DB_POOL_MAX_SIZE', 10))
+# idle connections above min size are closed after this many seconds
+DB_MAX_INACTIVE_LIFETIME = float(getenv('DB_MAX_INACTIVE_LIFETIME', 300))
+# per statement timeout in seconds, 0 disables it
+DB_COMMAND_TIMEOUT = float(getenv('DB_COMMAND_TIMEOUT', 10))
+# schema changes, index builds and partition archiving run far longer than a query
+DB_MAINTENANCE_TIMEOUT = float(getenv('DB_MAINTENANCE_TIMEOUT', 3600))
+DB_STATEMENT_CACHE_SIZE = int(getenv('DB_STATEMENT_CACHE_SIZE', 100))
+# /health fails when the ping takes longer or the pool is busier than this fraction
+DB_HEALTH_TIMEOUT = float(getenv('DB_HEALTH_TIMEOUT', 1))
+DB_HEALTH_MAX_SATURATION = float(getenv('DB_HEALTH_MAX_SATURATION', 0.9))
 
 # API keys
 
@@ -48,4 +65,130 @@ EMAIL_SERVER = getenv('EMAIL_SERVER')
 WEATHER_LOCATION_QUERY = getenv('WEATHER_LOCATION_QUERY')
 OPENWEATHER_API_KEY = getenv('OPENWEATHER_API_KEY')
 OPENWEATHER_API_URL = getenv('OPENWEATHER_API_URL')
-OPENWEATHER_URL = getenv('OPENWEATHER_URL')
\ No newline at end of file
+OPENWEATHER_URL = getenv('OPENWEATHER_URL')
+
+# Upstream HTTP client
+HTTP_CONNECT_TIMEOUT = float(getenv('HTTP_CONNECT_TIMEOUT', 3.0))
+HTTP_READ_TIMEOUT = float(getenv('HTTP_READ_TIMEOUT', 10.0))
+HTTP_MAX_CONNECTIONS = int(getenv('HTTP_MAX_CONNECTIONS', 100))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(getenv('HTTP_MAX_KEEPALIVE_CONNECTIONS', 20))
+HTTP_KEEPALIVE_EXPIRY = float(getenv('HTTP_KEEPALIVE_EXPIRY', 30.0))
+
+# Background enrichment
+ENRICHMENT_WORKERS = int(getenv('ENRICHMENT_WORKERS', 4))
+ENRICHMENT_QUEUE_SIZE = int(getenv('ENRICHMENT_QUEUE_SIZE', 1000))
+ENRICHMENT_DRAIN_TIMEOUT = float(getenv('ENRICHMENT_DRAIN_TIMEOUT', 10.0))
+# pending events are claimed from the table in batches, a claim expires after ENRICHMENT_LEASE seconds
+ENRICHMENT_CLAIM_BATCH = int(getenv('ENRICHMENT_CLAIM_BATCH', 100))
+ENRICHMENT_LEASE = float(getenv('ENRICHMENT_LEASE', 300))
+ENRICHMENT_POLL_INTERVAL = float(getenv('ENRICHMENT_POLL_INTERVAL', 30))
+# retries after a transient lookup failure back off exponentially up to ENRICHMENT_BACKOFF_MAX
+ENRICHMENT_BACKOFF_BASE = float(getenv('ENRICHMENT_BACKOFF_BASE', 30))
+ENRICHMENT_BACKOFF_MAX = float(getenv('ENRICHMENT_BACKOFF_MAX', 3600))
+
+# Track metadata cache
+METADATA_CACHE_SIZE = int(getenv('METADATA_CACHE_SIZE', 10000))
+METADATA_CACHE_TTL = int(getenv('METADATA_CACHE_TTL', 604800))
+METADATA_NEGATIVE_TTL = int(getenv('METADATA_NEGATIVE_TTL', 86400))
+
+# Upstream rate limits, burst is the number of calls allowed back to back
+LFM_RATE_BURST = int(getenv('LFM_RATE_BURST', 1))
+MB_RATE_BURST = int(getenv('MB_RATE_BURST', 1))
+CAA_RATE_LIMIT = float(getenv('CAA_RATE_LIMIT', 1))
+CAA_RATE_BURST = int(getenv('CAA_RATE_BURST', 1))
+RATE_LIMIT_MAX_WAIT = float(getenv('RATE_LIMIT_MAX_WAIT', 30))
+# local or postgres
+RATE_LIMIT_BACKEND = getenv('RATE_LIMIT_BACKEND', 'local')
+
+# In-memory cache
+CACHE_MAX_ENTRIES = int(getenv('CACHE_MAX_ENTRIES', 10000))
+CACHE_MAX_BYTES = int(getenv('CACHE_MAX_BYTES', 64 * 1024 * 1024))
+CACHE_SWEEP_INTERVAL = float(getenv('CACHE_SWEEP_INTERVAL', 60))
+
+# Request coalescing
+SINGLE_FLIGHT_TIMEOUT = float(getenv('SINGLE_FLIGHT_TIMEOUT', 30))
+# Cache-Control max-age for cover art, and how long the encoded metadata stays in the response cache
+COVER_ART_CACHE_TTL = int(getenv('COVER_ART_CACHE_TTL', 86400))
+
+# Now-playing stream
+SSE_HEARTBEAT_INTERVAL = float(getenv('SSE_HEARTBEAT_INTERVAL', 15))
+SSE_RETRY_MS = int(getenv('SSE_RETRY_MS', 3000))
+SSE_QUEUE_SIZE = int(getenv('SSE_QUEUE_SIZE', 16))
+SSE_HISTORY_SIZE = int(getenv('SSE_HISTORY_SIZE', 64))
+
+# Cross worker cache invalidation
+CACHE_INVALIDATION_CHANNEL = getenv('CACHE_INVALIDATION_CHANNEL', 'cache_invalidation')
+CURRENT_PLAYING_CACHE_TTL = int(getenv('CURRENT_PLAYING_CACHE_TTL', 3600))
+# Cache-Control max-age for /current-playing, the in-process copy is invalidated on change but proxies can't be
+CURRENT_PLAYING_MAX_AGE = int(getenv('CURRENT_PLAYING_MAX_AGE', 5))
+
+# Artwork store
+ARTWORK_REVALIDATE_AFTER = int(getenv('ARTWORK_REVALIDATE_AFTER', 86400))
+# source URLs remembered in memory, older ones are looked up in the artwork table again
+ARTWORK_KNOWN_URLS = int(getenv('ARTWORK_KNOWN_URLS', 10000))
+ARTWORK_VARIANT_SIZES = [int(size) for size in getenv('ARTWORK_VARIANT_SIZES', '64,300,600').split(',')]
+ARTWORK_VARIANT_FORMAT = getenv('ARTWORK_VARIANT_FORMAT', 'webp')
+ARTWORK_IMAGE_WORKERS = int(getenv('ARTWORK_IMAGE_WORKERS', 2))
+ARTWORK_MAX_UPLOAD_BYTES = int(getenv('ARTWORK_MAX_UPLOAD_BYTES', 10 * 1024 * 1024))
+
+# Batch ingest
+ADD_MUSIC_BATCH_LIMIT = int(getenv('ADD_MUSIC_BATCH_LIMIT', 10000))
+
+# Write-behind buffer for /add-music
+WRITE_BUFFER_FLUSH_MS = int(getenv('WRITE_BUFFER_FLUSH_MS', 500))
+WRITE_BUFFER_MAX_ENTRIES = int(getenv('WRITE_BUFFER_MAX_ENTRIES', 500))
+# new tracks are answered with 503 once this many are waiting, e.g. while the database is down
+WRITE_BUFFER_MAX_PENDING = int(getenv('WRITE_BUFFER_MAX_PENDING', 10000))
+
+# Per device dedupe of /add-music, local or postgres
+DEDUPE_BACKEND = getenv('DEDUPE_BACKEND', 'local')
+DEDUPE_MAX_DEVICES = int(getenv('DEDUPE_MAX_DEVICES', 1000))
+DEDUPE_MAX_PER_DEVICE = int(getenv('DEDUPE_MAX_PER_DEVICE', 64))
+DEDUPE_MIN_WINDOW = float(getenv('DEDUPE_MIN_WINDOW', 30))
+DEDUPE_MAX_WINDOW = float(getenv('DEDUPE_MAX_WINDOW', 3600))
+
+# Listening history and stats
+HISTORY_PAGE_SIZE = int(getenv('HISTORY_PAGE_SIZE', 50))
+HISTORY_MAX_PAGE_SIZE = int(getenv('HISTORY_MAX_PAGE_SIZE', 200))
+STATS_MAX_LIMIT = int(getenv('STATS_MAX_LIMIT', 100))
+STATS_DEFAULT_DAYS = int(getenv('STATS_DEFAULT_DAYS', 30))
+STATS_CACHE_TTL = int(getenv('STATS_CACHE_TTL', 60))
+
+# Append-only play log partitioned by month, a retention of 0 months keeps everything
+PLAYS_PARTITIONS_AHEAD = int(getenv('PLAYS_PARTITIONS_AHEAD', 2))
+PLAYS_RETENTION_MONTHS = int(getenv('PLAYS_RETENTION_MONTHS', 0))
+PLAYS_ARCHIVE_DIR = getenv('PLAYS_ARCHIVE_DIR', 'archive')
+PLAYS_MAINTENANCE_INTERVAL = float(getenv('PLAYS_MAINTENANCE_INTERVAL', 3600))
+
+# Weather, locations are separated by ";" since a query can contain commas ("Berlin,DE")
+WEATHER_LOCATIONS = getenv('WEATHER_LOCATIONS', WEATHER_LOCATION_QUERY)
+# refresh in the background after this many seconds, keep serving the old payload meanwhile
+WEATHER_REFRESH_AFTER = int(getenv('WEATHER_REFRESH_AFTER', 240))
+# how long a payload may be served past WEATHER_REFRESH_AFTER when refreshes keep failing
+WEATHER_MAX_STALE = int(getenv('WEATHER_MAX_STALE', 3600))
+# first retry after a failed refresh, doubling up to WEATHER_REFRESH_AFTER
+WEATHER_RETRY_AFTER = float(getenv('WEATHER_RETRY_AFTER', 10))
+
+# Email outbox. EMAIL_STARTTLS/EMAIL_SSL_TLS off and no credentials for a local stand-in like aiosmtpd
+EMAIL_STARTTLS = getenv('EMAIL_STARTTLS', 'true').lower() == 'true'
+EMAIL_SSL_TLS = getenv('EMAIL_SSL_TLS', 'false').lower() == 'true'
+EMAIL_SMTP_TIMEOUT = float(getenv('EMAIL_SMTP_TIMEOUT', 30))
+EMAIL_BATCH_SIZE = int(getenv('EMAIL_BATCH_SIZE', 20))
+EMAIL_MAX_ATTEMPTS = int(getenv('EMAIL_MAX_ATTEMPTS', 8))
+EMAIL_BACKOFF_BASE = float(getenv('EMAIL_BACKOFF_BASE', 30))
+EMAIL_BACKOFF_MAX = float(getenv('EMAIL_BACKOFF_MAX', 3600))
+# 0 disables the cap
+EMAIL_MAX_PER_MINUTE = float(getenv('EMAIL_MAX_PER_MINUTE', 60))
+EMAIL_BURST = int(getenv('EMAIL_BURST', 10))
+# an SMTP session unused for this long is closed
+EMAIL_IDLE_TIMEOUT = float(getenv('EMAIL_IDLE_TIMEOUT', 60))
+EMAIL_POLL_INTERVAL = float(getenv('EMAIL_POLL_INTERVAL', 5))
+EMAIL_LEASE = float(getenv('EMAIL_LEASE', 300))
+
+# Cover art proxy. Release metadata is kept forever in the cover_art table, image
+# bytes on disk under COVER_ART_CACHE_DIR within COVER_ART_DISK_BUDGET bytes
+COVER_ART_INDEX_SIZE = int(getenv('COVER_ART_INDEX_SIZE', 10000))
+COVER_ART_CACHE_DIR = getenv('COVER_ART_CACHE_DIR', 'cache/cover-art')
+COVER_ART_DISK_BUDGET = int(getenv('COVER_ART_DISK_BUDGET', 512 * 1024 * 1024))
+COVER_ART_MAX_IMAGE_BYTES = int(getenv('COVER_ART_MAX_IMAGE_BYTES', 20 * 1024 * 1024))
+COVER_ART_SWEEP_INTERVAL = float(getenv('COVER_ART_SWEEP_INTERVAL', 300))
@@ -0,0 +1,162 @@
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from cache import InMemoryCache
+
+logger = logging.getLogger(__name__)
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent calls for the same key: the first caller runs the
+    computation, everybody else arriving before it finishes awaits the same
+    result (or exception). A waiter that times out does not cancel the computation.
+    """
+
+    def __init__(self, timeout: Optional[float] = None):
+        self.timeout = timeout
+        self._calls: Dict[str, asyncio.Task] = {}
+        self.executions = 0
+        self.coalesced = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.forgotten = 0
+
+    def _done(self, key: str, task: asyncio.Task):
+        if self._calls.get(key) is task:
+            self._calls.pop(key, None)
+        if not task.cancelled() and task.exception() is not None:
+            self.errors += 1
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]], timeout: Optional[float] = None) -> Any:
+        task = self.start(key, fn)
+        timeout = self.timeout if timeout is None else timeout
+        try:
+            return await asyncio.wait_for(asyncio.shield(task), timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            logger.warning(f"timed out waiting for in-flight computation of {key}")
+            raise
+
+    def start(self, key: str, fn: Callable[[], Awaitable[Any]]) -> asyncio.Task:
+        """
+        Run `fn` in the background unless a call for `key` is already in flight.
+        """
+        task = self._calls.get(key)
+        if task is None:
+            self.executions += 1
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda t: self._done(key, t))
+        else:
+            self.coalesced += 1
+        return task
+
+    def forget(self, key: str, prefix: bool = False):
+        """
+        Detach the in-flight calls for `key` (or every key starting with it) after
+        the data behind them changed. They still finish for whoever awaits them,
+        but the next caller starts a fresh call and is_current() turns False for them.
+        """
+        keys = [k for k in self._calls if k.startswith(key)] if prefix else [key]
+        for k in keys:
+            if self._calls.pop(k, None) is not None:
+                self.forgotten += 1
+
+    def is_current(self, key: str) -> bool:
+        """
+        True inside the call running for `key`, unless it was forgotten since it started.
+        """
+        return self._calls.get(key) is asyncio.current_task()
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": len(self._calls),
+            "executions": self.executions,
+            "coalesced": self.coalesced,
+            "errors": self.errors,
+            "timeouts": self.timeouts,
+            "forgotten": self.forgotten,
+        }
+
+
+async def get_or_compute(
+    cache: InMemoryCache,
+    flights: SingleFlight,
+    key: str,
+    fn: Callable[[], Awaitable[Tuple[int, Any]]],
+    ttl: Optional[int] = None,
+    timeout: Optional[float] = None,
+) -> Tuple[int, Any]:
+    """
+    Return (status_code, payload) for `key`, from the cache or from a single shared call to `fn`.
+    Only 200 results are cached.
+    """
+    cached = cache.get(key)
+    if cached is not None:
+        return 200, cached
+
+    async def compute():
+        cached = cache.get(key)
+        if cached is not None:
+            return 200, cached
+        status_code, payload = await fn()
+        # a payload computed from data invalidated meanwhile would overwrite the fresh one
+        if status_code == 200 and flights.is_current(key):
+            cache.set(key, payload, ttl=ttl)
+        return status_code, payload
+
+    return await flights.do(key, compute, timeout)
+
+
+async def get_or_compute_stale(
+    cache: InMemoryCache,
+    flights: SingleFlight,
+    key: str,
+    fn: Callable[[], Awaitable[Tuple[int, Any]]],
+    refresh_after: float,
+    ttl: int,
+    timeout: Optional[float] = None,
+    retry_after: float = 10.0,
+) -> Tuple[int, Any]:
+    """
+    Stale-while-revalidate version of get_or_compute. Once an entry is older than
+    `refresh_after` it is still returned straight away while a single background
+    call refreshes it. Entries are only dropped after `ttl`, so a failing upstream
+    keeps serving the last good payload until then. A failed refresh keeps the
+    entry and tries again after `retry_after` seconds, doubling on every failure
+    up to `refresh_after`, instead of calling upstream on every request.
+    """
+
+    def backoff():
+        cached = cache.get(key)
+        remaining = cache.ttl(key)
+        if cached is None or not remaining or remaining < 0 or not flights.is_current(key):
+            return
+        payload, _, failures = cached
+        delay = min(refresh_after, retry_after * 2 ** min(failures, 20))
+        # keeps the original expiry, a failing upstream must not extend how stale a payload gets
+        cache.set(key, (payload, time.monotonic() + delay, failures + 1), ttl=remaining)
+
+    async def compute():
+        try:
+            status_code, payload = await fn()
+        except Exception:
+            backoff()
+            raise
+        if status_code != 200:
+            backoff()
+        elif flights.is_current(key):
+            cache.set(key, (payload, time.monotonic() + refresh_after, 0), ttl=ttl)
+        return status_code, payload
+
+    cached = cache.get(key)
+    if cached is not None:
+        payload, refresh_at, _ = cached
+        if time.monotonic() >= refresh_at:
+            flights.start(key, compute)
+        return 200, payload
+
+    return await flights.do(key, compute, timeout)
@@ -0,0 +1,173 @@
+import base64
+import binascii
+import logging
+from datetime import date, datetime
+from typing import List, Optional, Tuple
+
+from asyncpg import Record
+
+from db import create_index_concurrently, register_statement
+from validation import AddMusicModel
+
+logger = logging.getLogger(__name__)
+
+# per day rollups, stats read these instead of scanning events
+CREATE_TABLES_QUERY = """
+    CREATE TABLE IF NOT EXISTS daily_plays (
+        day date PRIMARY KEY,
+        plays bigint NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS daily_artist_plays (
+        day date NOT NULL,
+        artist text NOT NULL,
+        plays bigint NOT NULL,
+        PRIMARY KEY (day, artist)
+    );
+    CREATE TABLE IF NOT EXISTS daily_track_plays (
+        day date NOT NULL,
+        title text NOT NULL,
+        artist text NOT NULL,
+        album text NOT NULL,
+        plays bigint NOT NULL,
+        PRIMARY KEY (day, title, artist, album)
+    );
+"""
+
+# CONCURRENTLY can't run inside a transaction, so one statement per execute
+CREATE_INDEX_QUERIES = {
+    # current-playing and /history, newest valid plays first
+    "events_recent_valid_idx": """
+    CREATE INDEX CONCURRENTLY IF NOT EXISTS events_recent_valid_idx
+    ON events (updated DESC, id DESC)
+    WHERE is_valid AND NOT is_deleted;
+    """,
+}
+
+# one statement for all three rollups, plays are summed per key first because
+# ON CONFLICT can't touch the same row twice in a command. Rows go in key order
+# so concurrent flushes lock them in the same order
+RECORD_PLAYS_QUERY = """
+    WITH batch AS (
+        SELECT title, artist, coalesce(album, '') AS album, plays
+        FROM unnest($1::text[], $2::text[], $3::text[], $4::int[]) AS t(title, artist, album, plays)
+        WHERE plays > 0
+    ), today AS (
+        SELECT (now() AT TIME ZONE 'UTC')::date AS day
+    ), tracks AS (
+        INSERT INTO daily_track_plays AS d (day, title, artist, album, plays)
+        SELECT today.day, title, artist, album, sum(plays) FROM batch, today GROUP BY today.day, title, artist, album
+        ORDER BY title, artist, album
+        ON CONFLICT (day, title, artist, album) DO UPDATE SET plays = d.plays + EXCLUDED.plays
+    ), artists AS (
+        INSERT INTO daily_artist_plays AS d (day, artist, plays)
+        SELECT today.day, artist, sum(plays) FROM batch, today GROUP BY today.day, artist
+        ORDER BY artist
+        ON CONFLICT (day, artist) DO UPDATE SET plays = d.plays + EXCLUDED.plays
+    )
+    INSERT INTO daily_plays AS d (day, plays)
+    SELECT today.day, sum(plays) FROM batch, today GROUP BY today.day
+    ON CONFLICT (day) DO UPDATE SET plays = d.plays + EXCLUDED.plays;
+"""
+
+HISTORY_QUERY = """
+    SELECT id, title, artist, album, release_id, duration, devicename, playcount, updated
+    FROM events
+    WHERE is_valid AND NOT is_deleted
+    ORDER BY updated DESC, id DESC
+    LIMIT $1;
+"""
+
+HISTORY_AFTER_QUERY = """
+    SELECT id, title, artist, album, release_id, duration, devicename, playcount, updated
+    FROM events
+    WHERE is_valid AND NOT is_deleted AND (updated, id) < ($2, $3)
+    ORDER BY updated DESC, id DESC
+    LIMIT $1;
+"""
+
+RECORD_PLAYS = register_statement("record_plays", RECORD_PLAYS_QUERY)
+HISTORY = register_statement("history", HISTORY_QUERY)
+HISTORY_AFTER = register_statement("history_after", HISTORY_AFTER_QUERY)
+
+TOP_ARTISTS_QUERY = """
+    SELECT artist, sum(plays)::bigint AS plays
+    FROM daily_artist_plays
+    WHERE day BETWEEN $1 AND $2
+    GROUP BY artist
+    ORDER BY plays DESC, artist
+    LIMIT $3;
+"""
+
+TOP_TRACKS_QUERY = """
+    SELECT title, artist, album, sum(plays)::bigint AS plays
+    FROM daily_track_plays
+    WHERE day BETWEEN $1 AND $2
+    GROUP BY title, artist, album
+    ORDER BY plays DESC, title, artist
+    LIMIT $3;
+"""
+
+DAILY_PLAYS_QUERY = """
+    SELECT day, plays
+    FROM daily_plays
+    WHERE day BETWEEN $1 AND $2
+    ORDER BY day;
+"""
+
+
+async def init_stats(pool, ddl_timeout: Optional[float] = None):
+    async with pool.acquire() as con:
+        await con.execute(CREATE_TABLES_QUERY, timeout=ddl_timeout)
+        for name, query in CREATE_INDEX_QUERIES.items():
+            await create_index_concurrently(con, name, query, ddl_timeout)
+
+
+async def record_plays(con, rows: List[Tuple[AddMusicModel, int]]):
+    """
+    Add the plays in a flushed batch to today's rollups. Run it in the same
+    transaction as the events upsert so the two never disagree.
+    """
+    columns = [[], [], [], []]
+    for data, plays in rows:
+        if not plays:
+            continue
+        for column, value in zip(columns, (data.title, data.artist, data.album, plays)):
+            column.append(value)
+    if columns[0]:
+        await con.fetch_prepared(RECORD_PLAYS, *columns)
+
+
+def encode_cursor(row: Record) -> str:
+    raw = f"{row['updated'].isoformat()}|{row['id']}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Optional[Tuple[datetime, int]]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        updated, _, row_id = raw.partition("|")
+        return datetime.fromisoformat(updated), int(row_id)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        return None
+
+
+async def fetch_history(pool, limit: int, after: Optional[Tuple[datetime, int]]) -> List[Record]:
+    async with pool.acquire() as con:
+        if after is None:
+            return await con.fetch_prepared(HISTORY, limit)
+        return await con.fetch_prepared(HISTORY_AFTER, limit, *after)
+
+
+async def fetch_top_artists(pool, start: date, end: date, limit: int) -> List[Record]:
+    async with pool.acquire() as con:
+        return await con.fetch(TOP_ARTISTS_QUERY, start, end, limit)
+
+
+async def fetch_top_tracks(pool, start: date, end: date, limit: int) -> List[Record]:
+    async with pool.acquire() as con:
+        return await con.fetch(TOP_TRACKS_QUERY, start, end, limit)
+
+
+async def fetch_daily_plays(pool, start: date, end: date) -> List[Record]:
+    async with pool.acquire() as con:
+        return await con.fetch(DAILY_PLAYS_QUERY, start, end)
@@ -0,0 +1,48 @@
+import hashlib
+import hmac
+import logging
+import secrets
+import time
+from typing import Optional, Tuple
+
+from settings import AUTH_TOKEN, STREAM_TOKEN_SECRET, STREAM_TOKEN_TTL
+
+logger = logging.getLogger(__name__)
+
+# query parameter and cookie the stream token is read from
+STREAM_TOKEN_PARAM = "token"
+STREAM_TOKEN_COOKIE = "stream_token"
+
+
+def _load_secret() -> bytes:
+    secret = STREAM_TOKEN_SECRET or AUTH_TOKEN
+    if secret:
+        return secret.encode()
+    # only valid in this process, so a token issued by one worker is rejected by the others
+    logger.warning("STREAM_TOKEN_SECRET is not set, stream tokens are only valid in the worker that issued them")
+    return secrets.token_bytes(32)
+
+
+_secret = _load_secret()
+
+
+def _sign(expires: int) -> str:
+    return hmac.new(_secret, f"read:{expires}".encode(), hashlib.sha256).hexdigest()
+
+
+def issue_stream_token(ttl: Optional[int] = None) -> Tuple[str, int]:
+    """
+    A signed `read` token for /current-playing/stream, for clients like browser
+    EventSource that can't send an Authorization header. Returns the token and its ttl.
+    """
+    ttl = STREAM_TOKEN_TTL if ttl is None else ttl
+    expires = int(time.time()) + ttl
+    return f"{expires}.{_sign(expires)}", ttl
+
+
+def verify_stream_token(token: str) -> bool:
+    # only checked when the stream is opened, an open stream outlives its token
+    expires, _, signature = token.partition(".")
+    if not expires.isdigit() or int(expires) < time.time():
+        return False
+    return hmac.compare_digest(signature, _sign(int(expires)))
@@ -0,0 +1,108 @@
+import asyncio
+
+from write_buffer import WriteBehindBuffer
+
+
+class FakeTable:
+    """
+    Stands in for the events upsert: rejects a whole batch when it contains a
+    poisoned row, the way Postgres rejects a statement over one bad value.
+    """
+
+    def __init__(self, down: bool = False):
+        self.rows = {}
+        self.down = down
+        self.calls = 0
+
+    async def write(self, batch):
+        self.calls += 1
+        if self.down:
+            raise ConnectionError("database is down")
+        if any("\x00" in title for title, _ in batch):
+            raise ValueError("invalid byte sequence for encoding UTF8: 0x00")
+        for title, count in batch:
+            self.rows[title] = self.rows.get(title, 0) + count
+
+
+async def flush_times(buffer: WriteBehindBuffer, times: int):
+    for _ in range(times):
+        await buffer.flush()
+
+
+def test_poison_row_is_dropped_and_the_rest_written():
+    async def run():
+        table = FakeTable()
+        buffer = WriteBehindBuffer(table.write, split_after=2, max_attempts=3)
+        for i in range(10):
+            buffer.add(f"track {i}", f"track {i}")
+        buffer.add("bad\x00", "bad\x00")
+
+        # the first flushes retry the whole batch
+        await flush_times(buffer, 2)
+        assert table.rows == {}
+        # then the batch is split, the good rows go through right away
+        await buffer.flush()
+        assert table.rows == {f"track {i}": 1 for i in range(10)}
+        assert buffer.stats()["pending"] == 1
+
+        # a lone failure only counts once something else was written in between
+        for i in range(2):
+            await buffer.flush()
+            assert buffer.stats()["dropped"] == 0
+            buffer.add(f"more {i}", f"more {i}")
+            await buffer.flush()
+        stats = buffer.stats()
+        assert stats["pending"] == 0
+        assert stats["dropped"] == 1
+
+        # new writes flush as one batch again
+        buffer.add("track 0", "track 0")
+        calls = table.calls
+        await buffer.flush()
+        assert table.calls == calls + 1
+        assert table.rows["track 0"] == 2
+
+    asyncio.run(run())
+
+
+def test_outage_drops_nothing():
+    async def run():
+        table = FakeTable(down=True)
+        buffer = WriteBehindBuffer(table.write, split_after=2, max_attempts=3)
+        for i in range(100):
+            buffer.add(f"track {i}", f"track {i}")
+
+        calls = table.calls
+        await flush_times(buffer, 10)
+        stats = buffer.stats()
+        assert stats["pending"] == 100
+        assert stats["dropped"] == 0
+        # splitting gives up long before trying every row on its own
+        assert table.calls - calls < 100
+
+        table.down = False
+        await flush_times(buffer, 5)
+        assert buffer.stats()["pending"] == 0
+        assert len(table.rows) == 100
+
+    asyncio.run(run())
+
+
+def test_cancelled_flush_keeps_rows():
+    async def run():
+        started = asyncio.Event()
+
+        async def hang(batch):
+            started.set()
+            await asyncio.sleep(3600)
+
+        buffer = WriteBehindBuffer(hang, split_after=0)
+        for i in range(4):
+            buffer.add(i, i)
+        task = asyncio.ensure_future(buffer.flush())
+        await started.wait()
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        assert buffer.stats()["pending"] == 4
+
+    asyncio.run(run())
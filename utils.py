@@ -1,45 +1,83 @@
 import logging
-import requests
-from datetime import datetime
+import time
+import httpx
 from urllib.parse import urlparse
 
-from settings import APP_NAME, LFM_RATE_LIMIT, MUSICBRAINZ_BASE_URL, OPENWEATHER_API_URL, THE_LAST_FM_BASE_URL, MB_RATE_LIMIT
+from http_client import http_client
+from metrics import upstream_request_duration
+from rate_limiter import CREATE_TABLE_QUERY, RateLimiter
+from settings import (
+    CAA_RATE_BURST,
+    CAA_RATE_LIMIT,
+    COVERT_ART_ARCHIVE_BASE_URL,
+    LFM_RATE_BURST,
+    LFM_RATE_LIMIT,
+    MB_RATE_BURST,
+    MB_RATE_LIMIT,
+    MUSICBRAINZ_BASE_URL,
+    OPENWEATHER_API_URL,
+    RATE_LIMIT_BACKEND,
+    RATE_LIMIT_MAX_WAIT,
+    THE_LAST_FM_BASE_URL,
+)
 
 logger = logging.getLogger(__name__)
-last_call_timestamps = {}
-rate_limits = {
-    THE_LAST_FM_BASE_URL.split("//")[-1]: LFM_RATE_LIMIT,
-    MUSICBRAINZ_BASE_URL.split("//")[-1]: MB_RATE_LIMIT,
-    OPENWEATHER_API_URL.split("//")[-1]: 0,
-}
-
-def make_api_request(url, method, params=None, json=None, headers=None):
-    global last_call_timestamps
+rate_limiter = RateLimiter(max_wait=RATE_LIMIT_MAX_WAIT)
+# make_api_request reason for an upstream 404, so callers can cache the miss
+NOT_FOUND = "not found"
+
+
+def configure_rate_limits(pool=None):
+    """
+    Set up the per host buckets, shared through `pool` when one is given.
+    """
+    rate_limiter.configure(urlparse(THE_LAST_FM_BASE_URL).hostname, LFM_RATE_LIMIT, LFM_RATE_BURST, pool)
+    rate_limiter.configure(urlparse(MUSICBRAINZ_BASE_URL).hostname, MB_RATE_LIMIT, MB_RATE_BURST, pool)
+    rate_limiter.configure(urlparse(COVERT_ART_ARCHIVE_BASE_URL).hostname, CAA_RATE_LIMIT, CAA_RATE_BURST, pool)
+    rate_limiter.configure(urlparse(OPENWEATHER_API_URL).hostname, 0)
+
+
+async def init_rate_limiter(pool):
+    if RATE_LIMIT_BACKEND != "postgres":
+        return
+    async with pool.acquire() as con:
+        await con.execute(CREATE_TABLE_QUERY)
+    configure_rate_limits(pool)
+    logger.info("rate limits shared through postgres")
+
+
+configure_rate_limits()
+
+
+async def make_api_request(url, method, params=None, json=None, headers=None):
     parsed_url = urlparse(url)
     host = parsed_url.hostname
-    _headers = {"User-Agent": f'{APP_NAME}/1.0'}
-    if headers:
-        _headers.update(headers)
-
 
-    last_call_timestamp = last_call_timestamps.get(host, 0)
-    now = datetime.now().timestamp()
-    if now - last_call_timestamp < rate_limits.get(host, 1):
+    if not await rate_limiter.acquire(host):
         msg = f"rate limit exceeded for {host}"
         logger.error(msg)
         return False, msg, None
     
-    last_call_timestamps[host] = now
-    
+    started = time.perf_counter()
     try:
-        response = requests.request(method, url, params=params, json=json, headers=_headers)
+        response = await http_client.request(method, url, params=params, json=json, headers=headers)
         response.raise_for_status()
-    except requests.RequestException as e:
+    except httpx.HTTPStatusError as e:
+        upstream_request_duration.observe(time.perf_counter() - started, host, f"{e.response.status_code // 100}xx")
+        if e.response.status_code == 404:
+            logger.info(f"{url} not found upstream")
+            return False, NOT_FOUND, None
+        logger.error(f"request failed due to {e}", exc_info=True)
+        return False, "failed", None
+    except httpx.HTTPError as e:
+        upstream_request_duration.observe(time.perf_counter() - started, host, "error")
         logger.error(f"request failed due to {e}", exc_info=True)
         return False, "failed", None
     except Exception as e:
+        upstream_request_duration.observe(time.perf_counter() - started, host, "error")
         logger.error(f"request failed due to {e}", exc_info=True)
         return False, "failed", None
+    upstream_request_duration.observe(time.perf_counter() - started, host, "ok")
     return True, "succes", response
 
 
@@ -56,3 +94,18 @@ def guess_file_ext_from_base64(b64_str: str) -> str:
         return 'pdf'
     else:
         return 'unknown'
+
+
+def guess_file_ext_from_bytes(data: bytes) -> str:
+    if data.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'png'
+    elif data.startswith(b'\xff\xd8\xff'):
+        return 'jpg'
+    elif data.startswith(b'GIF87a') or data.startswith(b'GIF89a'):
+        return 'gif'
+    elif data.startswith(b'RIFF') and data[8:12] == b'WEBP':
+        return 'webp'
+    elif data.startswith(b'%PDF-'):
+        return 'pdf'
+    else:
+        return 'unknown'
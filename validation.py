@@ -1,5 +1,5 @@
 from typing import Optional
-from pydantic import BaseModel
+from pydantic import BaseModel, field_validator
 
 
 class AddMusicModel(BaseModel):
@@ -15,6 +15,12 @@ class AddMusicModel(BaseModel):
     pageTitle: Optional[str] = ""
     image: Optional[str] = ""
 
+    @field_validator("album")
+    @classmethod
+    def album_not_null(cls, value: Optional[str]) -> str:
+        # part of the events unique key, where NULLs never conflict
+        return value or ""
+
 
 class GetCoverArtModel(BaseModel):
     # mbid of album
@@ -24,4 +30,12 @@ class GetCoverArtModel(BaseModel):
 class EmailRequest(BaseModel):
     email: str
     subject: str
-    body: str
\ No newline at end of file
+    body: str
+
+    @field_validator("email", "subject")
+    @classmethod
+    def single_line(cls, value: str) -> str:
+        # these end up in message headers
+        if "\r" in value or "\n" in value:
+            raise ValueError("must not contain line breaks")
+        return value
\ No newline at end of file
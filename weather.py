@@ -1,21 +1,92 @@
+import asyncio
 import logging
+from typing import Dict, List, Optional
 
-from fastapi import Request
-from fastapi.responses import JSONResponse
-from cache import InMemoryCache
-from settings import OPENWEATHER_API_KEY, OPENWEATHER_API_URL, OPENWEATHER_URL, WEATHER_LOCATION_QUERY
+from fastapi import HTTPException, Request
+from fastapi.responses import ORJSONResponse
+from conditional import cached_response, conditional_response
+from settings import (
+    OPENWEATHER_API_KEY,
+    OPENWEATHER_API_URL,
+    OPENWEATHER_URL,
+    WEATHER_LOCATIONS,
+    WEATHER_MAX_STALE,
+    WEATHER_REFRESH_AFTER,
+    WEATHER_RETRY_AFTER,
+)
+from singleflight import get_or_compute_stale
 from utils import make_api_request
 
 logger = logging.getLogger(__name__)
 
-def get_lat_long(location: str, limit: int = 1):
+CREATE_TABLE_QUERY = """
+    CREATE TABLE IF NOT EXISTS geocode_cache (
+        query text PRIMARY KEY,
+        data jsonb NOT NULL,
+        created timestamptz NOT NULL DEFAULT now()
+    );
+"""
+
+
+def weather_locations() -> List[str]:
+    return [location.strip() for location in (WEATHER_LOCATIONS or "").split(";") if location.strip()]
+
+
+class GeocodeCache:
+    """
+    Location queries never move, so a geocode result is kept forever: in
+    memory and in the `geocode_cache` table so restarts don't repeat the lookup.
+    Failed lookups are not stored.
+    """
+
+    def __init__(self, pool):
+        self._pool = pool
+        self._local: Dict[str, dict] = {}
+        self.hits = 0
+        self.misses = 0
+
+    async def init(self):
+        async with self._pool.acquire() as con:
+            await con.execute(CREATE_TABLE_QUERY)
+            rows = await con.fetch("SELECT query, data FROM geocode_cache;")
+        for row in rows:
+            self._local[row["query"]] = row["data"]
+
+    async def get(self, location: str) -> Optional[dict]:
+        key = location.strip().casefold()
+        cached = self._local.get(key)
+        if cached is not None:
+            self.hits += 1
+            return cached
+
+        self.misses += 1
+        status, resp = await get_lat_long(location)
+        if not status:
+            return None
+        self._local[key] = resp
+        try:
+            async with self._pool.acquire() as con:
+                await con.execute(
+                    "INSERT INTO geocode_cache (query, data) VALUES ($1, $2) ON CONFLICT (query) DO NOTHING;",
+                    key,
+                    resp,
+                )
+        except Exception as e:
+            logger.error(f"failed to persist geocode result for {location}: {e}")
+        return resp
+
+    def stats(self) -> dict:
+        return {"entries": len(self._local), "hits": self.hits, "misses": self.misses}
+
+
+async def get_lat_long(location: str, limit: int = 1):
     geocode_url = f"{OPENWEATHER_API_URL}/geo/1.0/direct"
     params = {
         "q": location,
         "limit": limit,
         "appid": OPENWEATHER_API_KEY,
     }
-    status, msg, resp = make_api_request(geocode_url, "GET", params=params)
+    status, msg, resp = await make_api_request(geocode_url, "GET", params=params)
     if not status or not resp:
         logger.error(f"Geocode lookup failed: {msg}")
         return status, None
@@ -26,15 +97,15 @@ def get_lat_long(location: str, limit: int = 1):
     
     return status, resp[0]
 
-def get_weather(lat: float, lon: float):
+async def get_weather(lat: float, lon: float):
     weather_url = f"{OPENWEATHER_API_URL}/data/2.5/weather"
     params = {
         "lat": lat,
         "lon": lon,
         "appid": OPENWEATHER_API_KEY,
     }
-    status, msg, resp = make_api_request(weather_url, "GET", params=params)
-    if not status or not resp.ok:
+    status, msg, resp = await make_api_request(weather_url, "GET", params=params)
+    if not status or not resp.is_success:
         logger.error(f"Weather lookup failed: {msg}")
         return status, None
     
@@ -50,26 +121,62 @@ def get_weather_icon(weather_code: str):
     return f"{OPENWEATHER_URL}/img/wn/{weather_code}@2x.png"
 
 
-def get_current_weather(request: Request):
-    cache:InMemoryCache = request.app.cache
-    key = f"weather-{WEATHER_LOCATION_QUERY}"
-    cached = cache.get(key)
-    if cached:
-        return JSONResponse(content=cached, status_code=200)
-    
-    location = WEATHER_LOCATION_QUERY
-    status, resp = get_lat_long(location)
-    if not status:
-        return JSONResponse(content={"message": "No location found"}, status_code=404)
+async def get_current_weather(request: Request, location: Optional[str] = None):
+    locations = weather_locations()
+    if not locations:
+        raise HTTPException(status_code=404, detail="No weather locations configured")
+    if location is None:
+        location = locations[0]
+    elif location not in locations:
+        raise HTTPException(status_code=404, detail="Unknown location")
+
+    try:
+        status_code, content = await load_current_weather(request.app, location)
+    except asyncio.TimeoutError:
+        return ORJSONResponse(content={"message": "Timed out fetching weather"}, status_code=504)
+    if status_code == 200:
+        return conditional_response(
+            request,
+            content,
+            WEATHER_REFRESH_AFTER - content.age(),
+            stale_while_revalidate=WEATHER_MAX_STALE,
+        )
+    return ORJSONResponse(content=content, status_code=status_code)
+
+
+async def load_current_weather(app, location: str):
+    return await get_or_compute_stale(
+        app.cache,
+        app.flights,
+        f"weather-{location}",
+        cached_response(lambda: fetch_current_weather(app, location)),
+        refresh_after=WEATHER_REFRESH_AFTER,
+        ttl=WEATHER_REFRESH_AFTER + WEATHER_MAX_STALE,
+        retry_after=WEATHER_RETRY_AFTER,
+    )
+
+
+def warm_weather(app):
+    """
+    Load every configured location in the background so the first requests hit the cache.
+    """
+    for location in weather_locations():
+        app.flights.start(f"weather-warm-{location}", lambda location=location: load_current_weather(app, location))
+
+
+async def fetch_current_weather(app, location: str):
+    resp = await app.geocode.get(location)
+    if not resp:
+        return 404, {"message": "No location found"}
     
     state = resp.get("state")
     country = resp.get("country")
     lat = resp.get("lat")
     lon = resp.get("lon")
     
-    status, resp = get_weather(lat, lon)
+    status, resp = await get_weather(lat, lon)
     if not status:
-        return JSONResponse(content={"message": "No weather found"}, status_code=404)
+        return 404, {"message": "No weather found"}
     
     response = {
         "weather": resp.get("weather")[0].get("main"),
@@ -83,5 +190,4 @@ def get_current_weather(request: Request):
         "timezone": resp.get("timezone"),
     }
 
-    cache.set(key, response, ttl=300)
-    return JSONResponse(content=response, status_code=200)
\ No newline at end of file
+    return 200, response
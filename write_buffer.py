@@ -0,0 +1,202 @@
+import asyncio
+import logging
+import math
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBehindBuffer:
+    """
+    Merge writes per key in memory and hand them to `flush_fn` as (value, count)
+    pairs every `interval` seconds, or as soon as `max_entries` keys are pending.
+    The latest value for a key wins and counts are summed. At most `max_pending`
+    keys are held, `add` turns new keys away beyond that (for example while the
+    database is down) so memory stays bounded and callers can push back.
+
+    A failed flush puts its rows back for the next one. After `split_after`
+    failed flushes in a row the batch is written in halves, recursively, so one
+    row the database rejects (a NUL in a title, an oversized key) can't hold up
+    the rest. A row that fails on its own `max_attempts` times, with other writes
+    going through in between, is dropped and counted. An outage where nothing
+    succeeds drops nothing.
+    """
+
+    def __init__(
+        self,
+        flush_fn: Callable[[List[Tuple[Any, int]]], Awaitable[None]],
+        interval: float = 0.5,
+        max_entries: int = 500,
+        max_pending: int = 10000,
+        split_after: int = 2,
+        max_attempts: int = 3,
+    ):
+        self._flush_fn = flush_fn
+        self.interval = interval
+        self.max_entries = max_entries
+        self.max_pending = max(max_pending, max_entries)
+        self.split_after = split_after
+        self.max_attempts = max_attempts
+        self._pending: Dict[Hashable, Tuple[Any, int]] = {}
+        # consecutive failed flushes, and per row how often it failed on its own
+        # with the value of `flushes` at the last of those failures
+        self._failed_in_row = 0
+        self._attempts: Dict[Hashable, Tuple[int, int]] = {}
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = asyncio.Event()
+        self._flushing: Optional[asyncio.Task] = None
+        self.writes = 0
+        self.flushes = 0
+        self.flushed_rows = 0
+        self.failed_flushes = 0
+        self.rejected = 0
+        self.dropped = 0
+
+    def add(self, key: Hashable, value: Any, count: int = 1) -> bool:
+        """
+        Buffer a write. Returns False if the buffer is full and `key` isn't in it yet.
+        """
+        if key not in self._pending and len(self._pending) >= self.max_pending:
+            self.rejected += 1
+            self._flush_soon()
+            return False
+        previous = self._pending.pop(key, None)
+        if previous is not None:
+            count += previous[1]
+        # re-inserting keeps the dict ordered by last write
+        self._pending[key] = (value, count)
+        self.writes += 1
+        if len(self._pending) >= self.max_entries:
+            self._flush_soon()
+        return True
+
+    def _flush_soon(self):
+        if self._flushing is None or self._flushing.done():
+            self._flushing = asyncio.get_running_loop().create_task(self.flush())
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """
+        The buffered value for `key` that has not been written yet, if any.
+        """
+        item = self._pending.get(key)
+        return item[0] if item is not None else None
+
+    async def flush(self):
+        async with self._lock:
+            if not self._pending:
+                return
+            batch, self._pending = self._pending, {}
+            if self._failed_in_row >= self.split_after:
+                return await self._flush_split(batch)
+            try:
+                await self._flush_fn(list(batch.values()))
+                self.flushes += 1
+                self.flushed_rows += len(batch)
+                self._failed_in_row = 0
+                self._attempts.clear()
+            except BaseException as e:
+                # put the rows back under anything written since, they go out with the next flush.
+                # Cancellation too, or the rows of a flush interrupted at shutdown would be lost
+                self._restore(batch)
+                if not isinstance(e, Exception):
+                    raise
+                self.failed_flushes += 1
+                self._failed_in_row += 1
+                logger.error(f"write buffer flush of {len(batch)} rows failed due to {e}", exc_info=True)
+
+    async def _flush_split(self, batch: Dict[Hashable, Tuple[Any, int]]):
+        """
+        Write `batch` in halves until the rows that fail on their own are found.
+        Gives up after as many failures in a row as it takes to reach a single
+        row, so a database that is down costs a handful of calls, not one per row.
+        """
+        groups = [list(batch.items())]
+        failed: List[Tuple[Hashable, Tuple[Any, int]]] = []
+        failures = 0
+        give_up_after = math.ceil(math.log2(len(batch))) + 2
+        try:
+            while groups and failures < give_up_after:
+                group = groups.pop()
+                try:
+                    await self._flush_fn([item for _, item in group])
+                except Exception as e:
+                    failures += 1
+                    self.failed_flushes += 1
+                    if len(group) == 1:
+                        failed.append(group[0])
+                        logger.warning(f"write buffer row {group[0][0]!r} failed due to {e}")
+                    else:
+                        half = len(group) // 2
+                        groups.extend((group[half:], group[:half]))
+                    continue
+                failures = 0
+                self.flushes += 1
+                self.flushed_rows += len(group)
+                for key, _ in group:
+                    self._attempts.pop(key, None)
+        except BaseException:
+            groups.append(group)
+            raise
+        finally:
+            remaining = dict(item for group in groups for item in group)
+            for key, item in failed:
+                attempts, flushes = self._attempts.get(key, (0, 0))
+                # only counts if something was written since, otherwise the database may just be down
+                if self.flushes > flushes:
+                    attempts += 1
+                if attempts < self.max_attempts:
+                    self._attempts[key] = (attempts, self.flushes)
+                    remaining[key] = item
+                else:
+                    self._attempts.pop(key, None)
+                    self.dropped += 1
+                    logger.error(f"write buffer dropped {key!r} after it failed {attempts} times on its own")
+            self._restore(remaining)
+            if not remaining:
+                self._failed_in_row = 0
+
+    def _restore(self, batch: Dict[Hashable, Tuple[Any, int]]):
+        for key, (value, count) in batch.items():
+            newer = self._pending.pop(key, None)
+            if newer is not None:
+                self._pending[key] = (newer[0], newer[1] + count)
+            else:
+                self._pending[key] = (value, count)
+
+    async def _run(self):
+        while not self._stopping.is_set():
+            try:
+                await asyncio.wait_for(self._stopping.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            await self.flush()
+
+    def start(self):
+        if self._task is None:
+            self._stopping.clear()
+            self._task = asyncio.create_task(self._run(), name="write-buffer")
+
+    async def stop(self):
+        """
+        Let a running flush finish, then write whatever is still pending.
+        """
+        if self._task is not None:
+            self._stopping.set()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._flushing is not None:
+            await asyncio.gather(self._flushing, return_exceptions=True)
+            self._flushing = None
+        await self.flush()
+
+    def stats(self) -> dict:
+        return {
+            "pending": len(self._pending),
+            "writes": self.writes,
+            "flushes": self.flushes,
+            "flushed_rows": self.flushed_rows,
+            "failed_flushes": self.failed_flushes,
+            "rejected": self.rejected,
+            "dropped": self.dropped,
+        }